@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'weather_app.middleware.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +89,17 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -131,7 +145,7 @@ CRISPY_TEMPLATE_PACK = 'bootstrap5'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 WEATHER_API_KEY = os.getenv('WEATHER_API_KEY')
-WEATHER_API_URL = 'https://api.weatherapi.com/v1'
+WEATHER_API_URL = os.getenv('WEATHER_API_URL', 'https://api.weatherapi.com/v1')
 
 WEATHER_API_METHOD = {
     'history': '/history.json',
@@ -142,8 +156,114 @@ WEATHER_API_LIMITS = {
     'forecast_days_limit': 14,
     'history_days_limit': 365,
     'max_days_range_for_history_request': 30,
+    'max_concurrent_requests': int(os.getenv('WEATHER_API_MAX_CONCURRENT_REQUESTS', 8)),
 }
 WEATHER_API_LANGUAGE_CODE = 'uk'
+WEATHER_API_INCLUDE_HOURLY = str(os.getenv('WEATHER_API_INCLUDE_HOURLY', 'True')) == 'True'
+WEATHER_API_HTTP = {
+    'connect_timeout': float(os.getenv('WEATHER_API_CONNECT_TIMEOUT', 3.05)),
+    'read_timeout': float(os.getenv('WEATHER_API_READ_TIMEOUT', 10)),
+    'max_retries': int(os.getenv('WEATHER_API_MAX_RETRIES', 3)),
+    'backoff_factor': 0.3,
+    'backoff_jitter': 0.3,
+    'pool_connections': 4,
+    'pool_maxsize': int(os.getenv('WEATHER_API_POOL_MAXSIZE', 16)),
+    'async_max_connections': int(os.getenv('WEATHER_API_ASYNC_MAX_CONNECTIONS', 200)),
+}
+WEATHER_API_RATE_LIMIT = {
+    'enabled': str(os.getenv('WEATHER_API_RATE_LIMIT_ENABLED', 'True')) == 'True',
+    'requests_per_second': float(os.getenv('WEATHER_API_REQUESTS_PER_SECOND', 10)),
+    'burst': int(os.getenv('WEATHER_API_BURST', 20)),
+    'daily_quota': int(os.getenv('WEATHER_API_DAILY_QUOTA', 30000)),
+    'priorities': {
+        'interactive': {'reserve': 0, 'quota_share': 1, 'max_wait': 5},
+        'autocomplete': {'reserve': 0.2, 'quota_share': 0.9, 'max_wait': 1},
+        'background': {'reserve': 0.5, 'quota_share': 0.6, 'max_wait': 60},
+    },
+}
+WEATHER_ASYNC_VIEWS = str(os.getenv('WEATHER_ASYNC_VIEWS')) == 'True'
+WEATHER_CACHE_TIMEOUTS = {
+    'validated_city': 60 * 60 * 24 * 30,
+    'invalid_city': 60 * 60,
+    'history': 60 * 60 * 24 * 30,
+    'history_today': 60 * 60,
+    'forecast': 60 * 60 * 3,
+    'search': 60 * 60 * 24 * 7,
+    'weather_table': 60 * 60,
+    'stored_forecast': int(os.getenv('WEATHER_STORED_FORECAST_TTL', 60 * 60 * 3)),
+    'result_page_final': 60 * 60 * 24 * 365,
+    'result_page_provisional': int(os.getenv('WEATHER_RESULT_PAGE_MAX_AGE', 60 * 10)),
+}
+WEATHER_RESPONSE_CACHE = {
+    'max_size': int(os.getenv('WEATHER_RESPONSE_CACHE_MAX_SIZE', 128)),
+    'lock_timeout': 30,
+    'wait_timeout': 15,
+    'poll_interval': 0.05,
+}
+WEATHER_SAVE_TASK_DEDUPLICATION_TIMEOUT = 60
+WEATHER_BATCH_WRITER = {
+    'max_rows': 5000,
+    'flush_interval': float(os.getenv('WEATHER_BATCH_WRITER_FLUSH_INTERVAL', 2)),
+}
+WEATHER_EXPORT = {
+    'chunk_size': 2000,
+    'max_page_size': 100_000,
+    'compress_level': 6,
+    'token': os.getenv('WEATHER_EXPORT_TOKEN', os.getenv('WEATHER_METRICS_TOKEN')),
+}
+WEATHER_BACKFILL = {
+    'max_concurrent_requests': int(os.getenv('WEATHER_BACKFILL_MAX_CONCURRENT_REQUESTS', 4)),
+    'requests_per_second': float(os.getenv('WEATHER_BACKFILL_REQUESTS_PER_SECOND', 5)),
+    'batch_size': 5000,
+}
+WEATHER_BATCH_API = {
+    'max_locations': 50,
+    'max_concurrent_requests': int(os.getenv('WEATHER_BATCH_API_MAX_CONCURRENT_REQUESTS', 16)),
+}
+WEATHER_AGGREGATES = {
+    'heating_base': float(os.getenv('WEATHER_HEATING_BASE_TEMPERATURE', 18)),
+    'cooling_base': float(os.getenv('WEATHER_COOLING_BASE_TEMPERATURE', 18)),
+    'trailing_periods': {'week': 12, 'month': 12},
+    'max_periods': 520,
+}
+WEATHER_METRICS = {
+    'enabled': str(os.getenv('WEATHER_METRICS_ENABLED', 'True')) == 'True',
+    'server_timing': str(os.getenv('WEATHER_SERVER_TIMING', DEBUG)) == 'True',
+    'token': os.getenv('WEATHER_METRICS_TOKEN'),
+    'flush_interval': 5,
+    'buckets': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+}
+
+CITY_INDEX = {
+    'dataset': BASE_DIR / 'weather_app' / 'data' / 'cities.json',
+    'max_results': 10,
+    'min_query_length': 3,
+    'max_query_length': 100,
+    'cache_size': 4096,
+    'cache_ttl': 60 * 60 * 24,
+}
 
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
-CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
\ No newline at end of file
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
+CELERY_BEAT_SCHEDULE = {
+    'prewarm-popular-locations': {
+        'task': 'weather_app.tasks.prewarm_popular_locations',
+        'schedule': crontab(hour=os.getenv('WEATHER_PREWARM_HOUR', '5'), minute=30),
+    },
+    'maintain-weather-data-partitions': {
+        'task': 'weather_app.tasks.maintain_weather_data_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
+
+WEATHER_DATA_RETENTION = {
+    'grace_days': int(os.getenv('WEATHER_DATA_RETENTION_GRACE_DAYS', 30)),
+    'partitions_ahead_months': 3,
+}
+
+WEATHER_PREWARM = {
+    'top_locations': int(os.getenv('WEATHER_PREWARM_TOP_LOCATIONS', 50)),
+    'query_log_days': 7,
+    'max_concurrent_requests': 4,
+    'max_api_requests': int(os.getenv('WEATHER_PREWARM_MAX_API_REQUESTS', 200)),
+}
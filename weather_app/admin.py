@@ -1,5 +1,27 @@
 from django.contrib import admin
-from .models import WeatherData
+from .models import Location, LocationAlias, WeatherData, WeatherQueryLog, WeatherRollup
+from .services.coverage_index import coverage_index
+
+
+class LocationAliasInline(admin.TabularInline):
+    """Inline admin class for the aliases of a Location."""
+
+    model = LocationAlias
+    extra = 0
+
+
+@admin.register(Location)
+class LocationAdmin(admin.ModelAdmin):
+    """Admin class for the Location model.
+
+    Defines the display and behavior of Location objects in the Django admin panel.
+    """
+
+    list_display = ('name', 'local_name', 'region', 'country', 'api_id',)
+    list_display_links = ('name',)
+    search_fields = ('name', 'local_name', 'aliases__alias',)
+    ordering = ('name',)
+    inlines = (LocationAliasInline,)
 
 
 @admin.register(WeatherData)
@@ -7,10 +29,56 @@ class WeatherDataAdmin(admin.ModelAdmin):
     """Admin class for the WeatherData model.
 
     Defines the display and behavior of WeatherData objects in the Django admin panel.
+    Deleting rows invalidates the coverage index of their locations and recomputes their rollups.
+    """
+
+    list_display = ('location', 'date', 'temperature', 'min_temperature', 'max_temperature', 'precipitation',
+                    'source', 'fetched_at',)
+    list_display_links = ('location',)
+    list_select_related = ('location',)
+    readonly_fields = ('location', 'date', 'temperature', 'max_temperature', 'min_temperature', 'precipitation',
+                       'max_wind_speed', 'humidity', 'uv_index', 'hourly_temperatures', 'source', 'fetched_at',)
+    exclude = ('hourly_temperature',)
+    ordering = ('location', 'date',)
+    list_filter = ('location', 'source',)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        coverage_index.invalidate(obj.location_id)
+        WeatherRollup.refresh([(obj.location_id, obj.date)])
+
+    def delete_queryset(self, request, queryset):
+        keys = list(queryset.values_list('location_id', 'date'))
+        super().delete_queryset(request, queryset)
+        for location_id in {location_id for location_id, date in keys}:
+            coverage_index.invalidate(location_id)
+        WeatherRollup.refresh(keys)
+
+
+@admin.register(WeatherRollup)
+class WeatherRollupAdmin(admin.ModelAdmin):
+    """Admin class for the WeatherRollup model.
+
+    Rollups are maintained by the saves of the weather data, so they are read-only.
+    """
+
+    list_display = ('location', 'period', 'start_date', 'days', 'min_temperature', 'max_temperature',
+                    'precipitation_sum',)
+    list_select_related = ('location',)
+    readonly_fields = ('location', 'period', 'start_date', *WeatherRollup.AGGREGATE_FIELDS)
+    ordering = ('location', 'period', 'start_date',)
+    list_filter = ('period', 'location',)
+
+
+@admin.register(WeatherQueryLog)
+class WeatherQueryLogAdmin(admin.ModelAdmin):
+    """Admin class for the WeatherQueryLog model.
+
+    Defines the display and behavior of WeatherQueryLog objects in the Django admin panel.
     """
 
-    list_display = ('city', 'date', 'temperature',)
-    list_display_links = ('city',)
-    readonly_fields = ('city', 'date', 'temperature',)
-    ordering = ('city', 'date',)
-    list_filter = ('city',)
+    list_display = ('location', 'start_date', 'end_date', 'query_date', 'count',)
+    list_select_related = ('location',)
+    readonly_fields = ('location', 'start_date', 'end_date', 'query_date', 'count',)
+    ordering = ('-query_date', '-count',)
+    list_filter = ('query_date',)
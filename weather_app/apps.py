@@ -7,3 +7,10 @@ class WeatherAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weather_app'
     verbose_name = 'Погодні дані'
+
+    def ready(self):
+        from .models import WeatherData
+        from .services.metrics import install_instrumentation, metrics
+
+        if metrics.enabled:
+            install_instrumentation({WeatherData._meta.db_table: 'weather_data'})
@@ -0,0 +1,202 @@
+import datetime
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+
+CONDITIONS = ('Сонячно', 'Мінлива хмарність', 'Хмарно', 'Невеликий дощ', 'Сніг')
+
+
+class WeatherApiStub:
+    """Local stand-in for the Weather API serving the history, forecast and search methods.
+
+    Responses are synthetic, generated deterministically from the location and the date, or replayed
+    from recorded responses of the real API (`<method>.json` files in `recordings_dir`) with the days
+    shifted to the requested dates. Every request is delayed by `latency` seconds, and a part of them
+    given by `error_rate` fails with the 503 status, so retries and timeouts are exercised.
+    The stub is selected by pointing `WEATHER_API_URL` to its `url`.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 recordings_dir: Path | None = None, seed: int | None = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.recordings = {}
+        if recordings_dir is not None:
+            for path in Path(recordings_dir).glob('*.json'):
+                self.recordings[f'/{path.name}'] = json.loads(path.read_text(encoding='utf-8'))
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self.get_handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> 'WeatherApiStub':
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving requests and close the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'WeatherApiStub':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def get_handler_class(self) -> type:
+        stub = self
+
+        class Handler(WeatherApiStubHandler):
+            pass
+
+        Handler.stub = stub
+        return Handler
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def count(self, event: str) -> None:
+        with self._lock:
+            self.stats[event] += 1
+
+    def get_response(self, method: str, params: dict) -> tuple[int, dict | list]:
+        """Build the response of an API method for the query parameters."""
+        if method == settings.WEATHER_API_METHOD['search']:
+            return 200, self.search(params.get('q', ''))
+        if 'q' not in params:
+            return 400, {'error': {'code': 1003, 'message': 'Parameter q is missing.'}}
+        if method == settings.WEATHER_API_METHOD['history']:
+            if 'dt' not in params:
+                return 400, {'error': {'code': 1003, 'message': 'Parameter dt is missing.'}}
+            start_date = datetime.date.fromisoformat(params['dt'])
+            end_date = datetime.date.fromisoformat(params.get('end_dt', params['dt']))
+            return 200, self.get_weather(method, params['q'], start_date, end_date)
+        if method == settings.WEATHER_API_METHOD['forecast']:
+            today = datetime.date.today()
+            days = min(int(params.get('days', 1)), settings.WEATHER_API_LIMITS['forecast_days_limit'])
+            return 200, self.get_weather(method, params['q'], today, today + datetime.timedelta(days=days - 1))
+        return 400, {'error': {'code': 1005, 'message': 'API request url is invalid.'}}
+
+    def search(self, query: str) -> list[dict]:
+        if '/search.json' in self.recordings:
+            return self.recordings['/search.json']
+        query = query.strip()
+        if not query:
+            return []
+        name = query.title()
+        location_id = zlib.crc32(name.casefold().encode()) % 10_000_000
+        return [{'id': location_id, 'name': name, 'region': f'{name} Oblast', 'country': 'Ukraine',
+                 'lat': 44 + location_id % 800 / 100, 'lon': 22 + location_id % 1800 / 100,
+                 'url': name.casefold().replace(' ', '-')}]
+
+    def get_weather(self, method: str, query: str, start_date: datetime.date, end_date: datetime.date) -> dict:
+        dates = [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        recording = self.recordings.get(method)
+        if recording is None:
+            location = self.get_location(query)
+            days = [self.get_synthetic_day(query, date) for date in dates]
+        else:
+            location = recording['location']
+            recorded_days = recording['forecast']['forecastday']
+            days = [self.shift_day(recorded_days[i % len(recorded_days)], date) for i, date in enumerate(dates)]
+        return {'location': location, 'forecast': {'forecastday': days}}
+
+    def get_location(self, query: str) -> dict:
+        if query.startswith('id:'):
+            name = f'Location {query[3:]}'
+        else:
+            name = query.title()
+        return {'name': name, 'region': '', 'country': 'Ukraine', 'lat': 50.45, 'lon': 30.52,
+                'tz_id': settings.TIME_ZONE, 'localtime_epoch': int(time.time()),
+                'localtime': datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}
+
+    @staticmethod
+    def get_synthetic_day(query: str, date: datetime.date) -> dict:
+        """Generate a day of weather that is the same on every request for the location and the date."""
+        day_random = random.Random(zlib.crc32(f'{query}:{date.isoformat()}'.encode()))
+        seasonal = 8 - 13 * math.cos(2 * math.pi * (date.timetuple().tm_yday - 15) / 365)
+        min_temp = round(seasonal - day_random.uniform(2, 8), 1)
+        max_temp = round(seasonal + day_random.uniform(2, 8), 1)
+        hours = []
+        for hour in range(24):
+            temp = round(min_temp + (max_temp - min_temp) * (1 - abs(hour - 14) / 14), 1)
+            hours.append({'time_epoch': int(datetime.datetime.combine(date, datetime.time(hour)).timestamp()),
+                          'time': f'{date.isoformat()} {hour:02d}:00', 'temp_c': temp,
+                          'temp_f': round(temp * 9 / 5 + 32, 1), 'is_day': int(6 <= hour < 20),
+                          'condition': {'text': day_random.choice(CONDITIONS), 'code': 1000},
+                          'wind_kph': round(day_random.uniform(0, 30), 1), 'wind_dir': 'NW',
+                          'pressure_mb': round(day_random.uniform(990, 1030)), 'precip_mm': 0.0,
+                          'humidity': day_random.randint(30, 100), 'cloud': day_random.randint(0, 100),
+                          'feelslike_c': temp, 'chance_of_rain': day_random.randint(0, 100), 'uv': 1.0})
+        return {'date': date.isoformat(),
+                'date_epoch': int(datetime.datetime.combine(date, datetime.time()).timestamp()),
+                'day': {'maxtemp_c': max_temp, 'mintemp_c': min_temp,
+                        'avgtemp_c': round((max_temp + min_temp) / 2, 1),
+                        'maxwind_kph': round(day_random.uniform(5, 40), 1),
+                        'totalprecip_mm': round(day_random.uniform(0, 10), 2),
+                        'avghumidity': day_random.randint(30, 100), 'uv': round(day_random.uniform(0, 8), 1),
+                        'condition': {'text': day_random.choice(CONDITIONS), 'code': 1000}},
+                'astro': {'sunrise': '06:00 AM', 'sunset': '08:00 PM', 'moon_phase': 'Full Moon'},
+                'hour': hours}
+
+    @staticmethod
+    def shift_day(day: dict, date: datetime.date) -> dict:
+        """Move a recorded day to another date."""
+        shift = (date - datetime.date.fromisoformat(day['date'])).days * 24 * 60 * 60
+        return {**day, 'date': date.isoformat(), 'date_epoch': day.get('date_epoch', 0) + shift,
+                'hour': [{**hour, 'time_epoch': hour.get('time_epoch', 0) + shift,
+                          'time': f"{date.isoformat()} {hour.get('time', ' 00:00').split(' ')[-1]}"}
+                         for hour in day.get('hour', [])]}
+
+
+class WeatherApiStubHandler(BaseHTTPRequestHandler):
+    """Request handler of `WeatherApiStub`."""
+
+    stub = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        method = url.path.removeprefix('/v1')
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        if self.stub.should_fail():
+            self.stub.count('errors')
+            self.send_json(503, {'error': {'code': 9999, 'message': 'Internal application error.'}})
+            return
+        self.stub.count(method)
+        self.send_json(*self.stub.get_response(method, params))
+
+    def send_json(self, status: int, payload: dict | list) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,208 @@
+import datetime
+import io
+import json
+import platform
+import statistics
+import time
+from typing import Callable
+
+import django
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from ..models import Location, WeatherData
+from ..services.response_cache import response_cache
+from ..services.response_parser import parse_weather_response
+from ..services.weather_api_service import (ForecastWeatherRetriever, HistoryWeatherRetriever, WeatherDataProcessor,
+                                            split_data_period)
+from ..tasks import batch_writer, save_api_weather_data
+from .stub_server import WeatherApiStub
+
+RANGE_LENGTHS = (7, 30, 90, 365)
+AUTOCOMPLETE_QUERIES = ('Київ', 'Льв', 'Одес', 'Харк', 'Дніп', 'Berl', 'Lond', 'Pari', 'Wars', 'Zzyzx')
+
+
+class BenchmarkSuite:
+    """Benchmarks of the hot paths of the app against a Weather API stand-in.
+
+    Every benchmark is warmed up and measured `repeat` times. It is reported by the best sample, which is
+    the least affected by the noise of a shared machine, and the median, with the unit and whether a higher value
+    is better, so results can be compared with a baseline.
+    The database must be a disposable one, as the benchmarks delete the stored weather data.
+    """
+
+    def __init__(self, api_url: str, repeat: int = 5, only: str | None = None):
+        self.api_url = api_url
+        self.repeat = repeat
+        self.only = only
+        self.client = Client()
+        self.results = {}
+
+    def run(self) -> dict:
+        """Run the benchmarks and return the results with a description of the environment."""
+        benchmarks = {'split_data_period_365_days': self.bench_split_data_period,
+                      'date_filter_14_days': self.bench_date_filter,
+                      **{f'home_post_{days}_days': self.get_home_post_benchmark(days) for days in RANGE_LENGTHS},
+                      'home_post_stored_365_days': self.bench_home_post_stored,
+                      'autocomplete_throughput': self.bench_autocomplete,
+                      'save_api_weather_data_ingestion': self.bench_ingestion,
+                      'aggregates_365_days': self.bench_aggregates}
+        for name, benchmark in benchmarks.items():
+            if self.only is None or self.only in name:
+                self.results[name] = benchmark()
+        return {'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                                'database': connection.vendor, 'api_url': self.api_url},
+                'results': self.results}
+
+    def measure(self, func: Callable[[], None], number: int = 1,
+                setup: Callable[[], None] | None = None) -> list[float]:
+        """Measure the mean time of `number` calls in seconds `repeat` times, calling `setup` before each sample."""
+        if setup is not None:
+            setup()
+        func()
+        samples = []
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            started_at = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples.append((time.perf_counter() - started_at) / number)
+        return samples
+
+    @staticmethod
+    def get_time_result(samples: list[float], scale: float, unit: str) -> dict:
+        """Report the time of a call in the unit, `scale` units per second."""
+        return {'value': round(min(samples) * scale, 3), 'median': round(statistics.median(samples) * scale, 3),
+                'unit': unit, 'higher_is_better': False}
+
+    @staticmethod
+    def get_rate_result(samples: list[float], count: int, unit: str) -> dict:
+        """Report the rate of `count` operations per call."""
+        return {'value': round(count / min(samples), 3), 'median': round(count / statistics.median(samples), 3),
+                'unit': unit, 'higher_is_better': True}
+
+    def bench_split_data_period(self) -> dict:
+        today = datetime.date.today()
+        start_date = today - datetime.timedelta(days=365)
+        samples = self.measure(lambda: split_data_period(start_date, today, HistoryWeatherRetriever.max_days_range),
+                               number=1000)
+        return self.get_time_result(samples, 1e6, 'us')
+
+    def bench_date_filter(self) -> dict:
+        today = datetime.date.today()
+        days = [WeatherApiStub.get_synthetic_day('Kyiv', today + datetime.timedelta(days=i)) for i in range(14)]
+        response = parse_weather_response(io.BytesIO(json.dumps({'location': {'name': 'Kyiv'},
+                                                                  'forecast': {'forecastday': days}}).encode()))
+        retriever = ForecastWeatherRetriever({'city': 'Kyiv', 'start_date': today + datetime.timedelta(days=3),
+                                              'end_date': today + datetime.timedelta(days=9)})
+        samples = self.measure(lambda: retriever.date_filter(response), number=1000)
+        return self.get_time_result(samples, 1e6, 'us')
+
+    def get_home_post_benchmark(self, days: int) -> Callable[[], dict]:
+        """Build the benchmark of the home page request for a range of `days` days fetched from the API."""
+
+        def bench_home_post() -> dict:
+            data = self.get_home_post_data(days)
+            samples = self.measure(lambda: self.post_home(data), setup=self.reset_weather_data)
+            return self.get_time_result(samples, 1e3, 'ms')
+
+        return bench_home_post
+
+    def bench_home_post_stored(self) -> dict:
+        data = self.get_home_post_data(365)
+        self.reset_weather_data()
+        self.post_home(data)
+        location = Location.get_by_alias(data['city'])
+        api_weather_data = WeatherDataProcessor({**data, 'location': location}).get_weather_data_from_API()
+        WeatherData.save_api_weather_data(api_weather_data, location.pk)
+        samples = self.measure(lambda: self.post_home(data), setup=cache.clear)
+        return self.get_time_result(samples, 1e3, 'ms')
+
+    def bench_autocomplete(self) -> dict:
+        url = reverse('autocomplete')
+
+        def autocomplete() -> None:
+            for query in AUTOCOMPLETE_QUERIES:
+                response = self.client.post(url, {'query': query}, content_type='application/json')
+                assert response.status_code == 200, response.status_code
+
+        samples = self.measure(autocomplete, number=20)
+        return self.get_rate_result(samples, len(AUTOCOMPLETE_QUERIES), 'requests/s')
+
+    def bench_ingestion(self) -> dict:
+        today = datetime.date.today()
+        locations = [Location.objects.get_or_create(api_id=900_000 + i, defaults={'name': f'Bench {i}'})[0]
+                     for i in range(10)]
+        days = [WeatherApiStub.get_synthetic_day('Bench', today - datetime.timedelta(days=i)) for i in range(365)]
+        response = parse_weather_response(io.BytesIO(json.dumps({'location': {'name': 'Bench'},
+                                                                  'forecast': {'forecastday': days}}).encode()),
+                                          include_hourly=True)
+        response['fetched_at'] = datetime.datetime.now().isoformat()
+        rows = [row for location in locations
+                for row in WeatherData.compact_api_weather_data({'historical_weather_data': response}, location.pk)]
+
+        def ingest() -> None:
+            save_api_weather_data(rows)
+            batch_writer.flush()
+
+        samples = self.measure(ingest, setup=self.reset_weather_data)
+        return self.get_rate_result(samples, len(rows), 'rows/s')
+
+    def bench_aggregates(self) -> dict:
+        today = datetime.date.today()
+        location = Location.objects.get_or_create(api_id=900_000, defaults={'name': 'Bench 0'})[0]
+        days = [WeatherApiStub.get_synthetic_day('Bench', today - datetime.timedelta(days=i)) for i in range(730)]
+        response = parse_weather_response(io.BytesIO(json.dumps({'location': {'name': 'Bench'},
+                                                                  'forecast': {'forecastday': days}}).encode()))
+        self.reset_weather_data()
+        WeatherData.save_api_weather_data({'historical_weather_data': response}, location.pk)
+        params = {'location': location.pk, 'start_date': today - datetime.timedelta(days=364), 'end_date': today}
+
+        def get_aggregates() -> None:
+            response = self.client.get(reverse('weather_aggregates'), params)
+            assert response.status_code == 200, response.status_code
+
+        samples = self.measure(get_aggregates, number=20)
+        return self.get_time_result(samples, 1e3, 'ms')
+
+    @staticmethod
+    def get_home_post_data(days: int) -> dict:
+        end_date = datetime.date.today() + datetime.timedelta(days=6)
+        return {'start_date': end_date - datetime.timedelta(days=days - 1), 'end_date': end_date, 'city': 'Kyiv'}
+
+    def post_home(self, data: dict) -> None:
+        response = self.client.post(reverse('home'), data, follow=True)
+        assert response.status_code == 200 and response.context['weather_data'], response.status_code
+
+    @staticmethod
+    def reset_weather_data() -> None:
+        cache.clear()
+        response_cache.clear()
+        WeatherData.objects.all().delete()
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """Compare the results with the baseline.
+
+    The change is the relative slowdown: positive if the benchmark got slower, whatever its unit.
+    A benchmark regressed if it got slower by more than `tolerance`.
+    """
+    comparison = []
+    for name, result in results['results'].items():
+        baseline_result = baseline.get('results', {}).get(name)
+        if baseline_result is None or baseline_result['unit'] != result['unit']:
+            comparison.append({'name': name, 'value': result['value'], 'baseline': None, 'change': None,
+                               'status': 'new'})
+            continue
+        if result['higher_is_better']:
+            change = baseline_result['value'] / result['value'] - 1
+        else:
+            change = result['value'] / baseline_result['value'] - 1
+        status = 'regression' if change > tolerance else 'improvement' if change < -tolerance else 'ok'
+        comparison.append({'name': name, 'value': result['value'], 'baseline': baseline_result['value'],
+                           'change': round(change, 3), 'status': status})
+    return comparison
@@ -0,0 +1,13 @@
+import datetime
+
+
+class DateConverter:
+    """Path converter of ISO dates, YYYY-MM-DD."""
+
+    regex = r'\d{4}-\d{2}-\d{2}'
+
+    def to_python(self, value: str) -> datetime.date:
+        return datetime.date.fromisoformat(value)
+
+    def to_url(self, value: datetime.date) -> str:
+        return value.isoformat()
@@ -1,15 +1,26 @@
 import datetime
 from django import forms
 from django.conf import settings
-from weather_app.services.weather_api_service import CitySearcher
+from weather_app.models import Location, WeatherData, WeatherRollup
+from weather_app.services.aggregates import get_period_index
+from weather_app.services.city_index import normalize_city_name
+from weather_app.services.location_service import resolve_location, resolve_locations
+from weather_app.services.upstream_limiter import UpstreamThrottled
+
+THROTTLED_MESSAGE = 'Забагато запитів до сервісу погоди. Спробуйте пізніше.'
 
 
 class WeatherForm(forms.Form):
-    """Form to collect user input for weather request"""
+    """Form to collect user input for weather request
+
+    If the city could not be validated because the external API request was throttled,
+    the `UpstreamThrottled` error is stored in `throttled`.
+    """
 
     start_date = forms.DateField(label='Початкова дата', widget=forms.DateInput(attrs={'type': 'date', }))
     end_date = forms.DateField(label='Кінцева дата', widget=forms.DateInput(attrs={'type': 'date', }))
     city = forms.CharField(label='Місто', max_length=100, widget=forms.TextInput(attrs={'autocomplete': 'off', }))
+    throttled = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -44,13 +55,22 @@ class WeatherForm(forms.Form):
         """Clean and validate the user-input city field.
 
         This method checks if the entered city exists by querying an external API
-        to ensure it's a valid city name.
-        If the city is not found in the API data, an error is added to the field.
+        to ensure it's a valid city name. Resolved cities are stored as location aliases,
+        so the API is queried once per city.
+        The `Location` found for the city is stored in `cleaned_data['location']`.
+        If the city is not found in the API data, or the API request is throttled, an error is added to the field.
         """
         city = self.cleaned_data['city']
-        if not CitySearcher(self.cleaned_data).get_data_from_API():
+        try:
+            location = resolve_location(city)
+        except UpstreamThrottled as error:
+            self.throttled = error
+            self.add_error("city", THROTTLED_MESSAGE)
+            return None
+        if not location:
             self.add_error("city", "Введено некоректне місто. Зробіть вибір із запропонованих варіантів.")
         else:
+            self.cleaned_data['location'] = location
             return city
 
     def clean(self):
@@ -59,8 +79,8 @@ class WeatherForm(forms.Form):
         Checks if the start date is earlier than the end date.
         """
         cleaned_data = super().clean()
-        start_date = cleaned_data['start_date']
-        end_date = cleaned_data['end_date']
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
 
         if start_date and end_date and start_date > end_date:
             self.add_error("start_date", "Початкова дата повинна бути меншою за кінцеву дату")
@@ -76,3 +96,152 @@ class WeatherForm(forms.Form):
     def max_date(self):
         """Get the maximum allowed date for user input."""
         return datetime.date.today() + datetime.timedelta(days=settings.WEATHER_API_LIMITS['forecast_days_limit'] - 1)
+
+
+class MultipleCharField(forms.Field):
+    """Field of a repeated query parameter, cleaned to the list of its non-empty values."""
+
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        return [item.strip() for item in value or [] if item.strip()]
+
+
+class WeatherBatchForm(WeatherForm):
+    """Form to validate the query parameters of a weather data request of many locations.
+
+    Locations are given by their IDs (`location`) and by city names (`city`), both repeatable.
+    Names that have not been resolved before are validated by the external API.
+    The locations are stored in `cleaned_data['locations']` in the order given, IDs first.
+    """
+
+    city = MultipleCharField(label='Міста', required=False)
+    location = forms.ModelMultipleChoiceField(label='Локації', queryset=Location.objects.all(), required=False)
+    field = forms.MultipleChoiceField(label='Показники', required=False,
+                                      choices=[(field, field) for field in WeatherData.METRIC_FIELDS])
+
+    def clean_city(self):
+        """Resolve the city names to locations, adding an error with the names that are not found.
+
+        The number of the names and the IDs is limited before anything is resolved, and the names that
+        have not been resolved before are validated by the external API concurrently.
+        """
+        cities = self.cleaned_data['city']
+        self.cleaned_data['city_locations'] = []
+        max_locations = settings.WEATHER_BATCH_API['max_locations']
+        if len(cities) + len(self['location'].value() or []) > max_locations:
+            self.add_error('city', f'Максимальна кількість локацій: {max_locations}')
+            return cities
+        try:
+            locations = resolve_locations(cities, settings.WEATHER_BATCH_API['max_concurrent_requests'])
+        except UpstreamThrottled as error:
+            self.throttled = error
+            self.add_error('city', THROTTLED_MESSAGE)
+            return cities
+        not_found = [city for city, location in zip(cities, locations) if location is None]
+        if not_found:
+            self.add_error('city', f"Не знайдено міста: {', '.join(not_found)}")
+        self.cleaned_data['city_locations'] = [location for location in locations if location is not None]
+        return cities
+
+    def clean(self):
+        """Combine the locations given by IDs and by names, limiting their number by the batch setting."""
+        cleaned_data = super().clean()
+        locations = {}
+        for location in [*cleaned_data.get('location', []), *cleaned_data.get('city_locations', [])]:
+            locations.setdefault(location.pk, location)
+        max_locations = settings.WEATHER_BATCH_API['max_locations']
+        if not locations and not self.has_error('city'):
+            self.add_error(None, 'Вкажіть хоча б одну локацію')
+        elif len(locations) > max_locations:
+            self.add_error(None, f'Максимальна кількість локацій: {max_locations}')
+        cleaned_data['locations'] = list(locations.values())
+        return cleaned_data
+
+
+class WeatherAggregatesForm(WeatherBatchForm):
+    """Form to validate the query parameters of a request of weather statistics of many locations.
+
+    Statistics are computed from the stored data, so the dates are not limited by the external API,
+    only the number of the weeks or months in the range is limited by the `WEATHER_AGGREGATES` setting.
+    City names are only resolved by the aliases stored before, the external API is not requested.
+    """
+
+    field = None
+    period = forms.ChoiceField(label='Період', choices=WeatherRollup.Period.choices, required=False)
+
+    def clean_city(self):
+        """Find the locations of the city names resolved before, adding an error with the names that are not found."""
+        cities = self.cleaned_data['city']
+        locations = Location.get_by_aliases(cities)
+        not_found = [city for city in cities if normalize_city_name(city) not in locations]
+        if not_found:
+            self.add_error('city', f"Не знайдено міста: {', '.join(not_found)}")
+        self.cleaned_data['city_locations'] = [locations[normalize_city_name(city)] for city in cities
+                                               if normalize_city_name(city) in locations]
+        return cities
+
+    def clean_start_date(self):
+        return self.cleaned_data['start_date']
+
+    def clean_end_date(self):
+        return self.cleaned_data['end_date']
+
+    def clean_period(self):
+        return self.cleaned_data['period'] or WeatherRollup.Period.MONTH
+
+    def clean(self):
+        """Limit the number of the periods in the date range."""
+        cleaned_data = super().clean()
+        start_date, end_date, period = (cleaned_data.get(name) for name in ('start_date', 'end_date', 'period'))
+        max_periods = settings.WEATHER_AGGREGATES['max_periods']
+        if start_date and end_date and period and \
+                get_period_index(period, end_date) - get_period_index(period, start_date) >= max_periods:
+            self.add_error(None, f'Максимальна кількість періодів: {max_periods}')
+        return cleaned_data
+
+
+class WeatherExportForm(forms.Form):
+    """Form to validate the query parameters of a stored weather data export."""
+
+    FORMAT_CHOICES = (('csv', 'CSV'), ('ndjson', 'NDJSON'),)
+
+    format = forms.ChoiceField(label='Формат', choices=FORMAT_CHOICES, required=False)
+    location = forms.ModelMultipleChoiceField(label='Локації', queryset=Location.objects.all(), required=False)
+    start_date = forms.DateField(label='Початкова дата', required=False)
+    end_date = forms.DateField(label='Кінцева дата', required=False)
+    after = forms.RegexField(label='Курсор', regex=r'^\d+:\d{4}-\d{2}-\d{2}$', required=False)
+    limit = forms.IntegerField(label='Кількість рядків', min_value=1, required=False)
+
+    def clean_format(self):
+        """Use CSV if the format is not given."""
+        return self.cleaned_data['format'] or 'csv'
+
+    def clean_after(self):
+        """Parse the keyset cursor "<location id>:<date>" of the last exported row."""
+        after = self.cleaned_data['after']
+        if not after:
+            return None
+        location_id, date = after.split(':')
+        try:
+            return int(location_id), datetime.date.fromisoformat(date)
+        except ValueError:
+            raise forms.ValidationError('Некоректний курсор')
+
+    def clean_limit(self):
+        """Limit the page size by the `max_page_size` export setting, which is also the default page size."""
+        limit = self.cleaned_data['limit']
+        max_page_size = settings.WEATHER_EXPORT['max_page_size']
+        if limit is None:
+            return max_page_size
+        if limit > max_page_size:
+            raise forms.ValidationError(f'Максимальна кількість рядків: {max_page_size}')
+        return limit
+
+    def clean(self):
+        """Check that the start date is not later than the end date."""
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get('start_date'), cleaned_data.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            self.add_error('start_date', 'Початкова дата повинна бути меншою за кінцеву дату')
+        return cleaned_data
@@ -0,0 +1,73 @@
+import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from weather_app.services.backfill import BackfillCheckpoint, WeatherBackfill
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with historical weather data of the cities listed in a file. '
+            'Progress is checkpointed, so an interrupted run resumes where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('cities_file', type=Path, help='Text file with a city name per line.')
+        parser.add_argument('--start-date', type=datetime.date.fromisoformat,
+                            help='First date to fill, YYYY-MM-DD. Defaults to the start of the history window.')
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat,
+                            help='Last date to fill, YYYY-MM-DD. Defaults to today.')
+        parser.add_argument('--workers', type=int, dest='max_concurrent_requests',
+                            help='Number of concurrent API requests.')
+        parser.add_argument('--rate', type=float, dest='requests_per_second',
+                            help='Maximum number of API requests per second, 0 for no limit.')
+        parser.add_argument('--batch-size', type=int, help='Number of rows saved by a single upsert.')
+        parser.add_argument('--checkpoint', type=Path,
+                            help='Checkpoint file. Defaults to the cities file name with ".checkpoint.json".')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over.')
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        min_date = today - datetime.timedelta(days=settings.WEATHER_API_LIMITS['history_days_limit'])
+        start_date = options['start_date'] or min_date
+        end_date = options['end_date'] or today
+        if start_date < min_date or end_date > today or start_date > end_date:
+            raise CommandError(f'Dates must be within the history window from {min_date} to {today}, '
+                               f'the start date not later than the end date')
+        cities_file = options['cities_file']
+        try:
+            cities = [line.strip() for line in cities_file.read_text(encoding='utf-8').splitlines()]
+        except OSError as error:
+            raise CommandError(f'Cannot read the cities file: {error}')
+        cities = [city for city in cities if city and not city.startswith('#')]
+
+        checkpoint_path = options['checkpoint'] or cities_file.with_name(f'{cities_file.name}.checkpoint.json')
+        checkpoint = BackfillCheckpoint(checkpoint_path)
+        if options['restart']:
+            checkpoint.clear()
+        checkpoint.load()
+
+        backfill = WeatherBackfill.from_settings(
+            start_date, end_date, checkpoint, max_concurrent_requests=options['max_concurrent_requests'],
+            requests_per_second=options['requests_per_second'], batch_size=options['batch_size'])
+        backfill.progress = self.write_progress
+        for city in backfill.add_cities(cities):
+            self.stderr.write(f'City not found: {city}')
+        stats = backfill.run()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {stats['days']} days of {len(backfill.locations)} locations "
+            f"in {stats['seconds']:.1f} s: {self.get_rate(stats, 'days'):.1f} days/s, "
+            f"{self.get_rate(stats, 'api_calls'):.2f} API calls/s; "
+            f"{stats['skipped_periods']} periods skipped, {stats['failed_periods']} failed."))
+        if stats['failed_periods']:
+            raise CommandError(f"{stats['failed_periods']} periods failed, run the command again to retry them")
+
+    def write_progress(self, stats: dict) -> None:
+        self.stdout.write(f"{stats['api_calls']}/{stats['periods']} periods, {stats['days']} days, "
+                          f"{self.get_rate(stats, 'days'):.1f} days/s, {self.get_rate(stats, 'api_calls'):.2f} "
+                          f"API calls/s")
+
+    @staticmethod
+    def get_rate(stats: dict, counter: str) -> float:
+        return stats[counter] / stats['seconds'] if stats['seconds'] else 0.0
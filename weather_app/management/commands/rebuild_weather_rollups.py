@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from weather_app.models import WeatherRollup
+
+
+class Command(BaseCommand):
+    help = ('Recompute the weekly and monthly rollups of the stored weather data, e.g. for the data saved '
+            'before rollups were maintained or after the degree-day base temperatures were changed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=int, action='append', dest='location_ids',
+                            help='ID of a location to rebuild, repeatable. Defaults to all the locations.')
+
+    def handle(self, *args, **options):
+        rows_count = WeatherRollup.rebuild(options['location_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {rows_count} rows of weather data.'))
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from weather_app.benchmarks.stub_server import WeatherApiStub
+
+
+class Command(BaseCommand):
+    help = ('Serve a local stand-in for the Weather API with synthetic or recorded responses. '
+            'Point WEATHER_API_URL to the printed URL to use it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8010)
+        parser.add_argument('--latency', type=float, default=0.0, help='Delay of every response in seconds.')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Part of the requests failed with the 503 status, from 0 to 1.')
+        parser.add_argument('--recordings', type=Path,
+                            help='Directory with recorded history.json, forecast.json and search.json responses.')
+        parser.add_argument('--seed', type=int, help='Seed of the error generator.')
+
+    def handle(self, *args, **options):
+        stub = WeatherApiStub(options['host'], options['port'], latency=options['latency'],
+                              error_rate=options['error_rate'], recordings_dir=options['recordings'],
+                              seed=options['seed'])
+        self.stdout.write(f'Serving the Weather API stub at {stub.url}, set WEATHER_API_URL={stub.url}')
+        try:
+            stub.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.server.server_close()
+            self.stdout.write(f'Requests served: {dict(stub.stats)}')
@@ -0,0 +1,75 @@
+import json
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from weather_app.benchmarks.stub_server import WeatherApiStub
+from weather_app.benchmarks.suite import BenchmarkSuite, compare_results
+from weather_app.services.upstream_limiter import upstream_limiter
+from weather_app.services.weather_api_service import AbstractWeatherAPIRetriever
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'weather_app' / 'benchmarks' / 'baseline.json'
+
+
+class Command(BaseCommand):
+    help = ('Run the benchmarks against a local Weather API stub on a test database, '
+            'write the results as JSON and compare them with the baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'),
+                            help='File to write the results to.')
+        parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help='Baseline results file.')
+        parser.add_argument('--update-baseline', action='store_true', help='Replace the baseline with the results.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Relative slowdown reported as a regression.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of samples of every benchmark.')
+        parser.add_argument('--only', help='Run only the benchmarks whose name contains the text.')
+        parser.add_argument('--latency', type=float, default=0.0, help='Delay of every stub response in seconds.')
+        parser.add_argument('--api-url',
+                            help='Use a running stub at the URL instead of starting one in the process.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        stub = None
+        try:
+            api_url = options['api_url']
+            if api_url is None:
+                stub = WeatherApiStub(latency=options['latency']).start()
+                api_url = stub.url
+            # The API URL is read from the settings on import, so the stub is patched into the retrievers.
+            # Saving is measured by its own benchmark instead of through the Celery broker.
+            with mock.patch.object(AbstractWeatherAPIRetriever, 'api_url', api_url), \
+                    mock.patch.object(upstream_limiter, 'enabled', False), \
+                    mock.patch('weather_app.tasks.save_api_weather_data.delay'):
+                results = BenchmarkSuite(api_url, repeat=options['repeat'], only=options['only']).run()
+        finally:
+            if stub is not None:
+                stub.stop()
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        options['output'].write_text(json.dumps(results, indent=2))
+        self.stdout.write(f"Results are written to {options['output']}")
+        if options['update_baseline']:
+            options['baseline'].write_text(json.dumps(results, indent=2))
+            self.stdout.write(f"Baseline is updated: {options['baseline']}")
+            return
+        baseline = json.loads(options['baseline'].read_text()) if options['baseline'].exists() else {}
+        comparison = compare_results(results, baseline, options['tolerance'])
+        self.stdout.write(f"{'benchmark':<34}{'value':>22}{'baseline':>14}{'change':>9}  status")
+        for row in comparison:
+            unit = results['results'][row['name']]['unit']
+            baseline_value = '-' if row['baseline'] is None else f"{row['baseline']:.3f}"
+            change = '-' if row['change'] is None else f"{row['change']:+.0%}"
+            self.stdout.write(f"{row['name']:<34}{row['value']:>11.3f} {unit:<10}{baseline_value:>14}{change:>9}  "
+                              f"{row['status']}")
+        regressions = [row['name'] for row in comparison if row['status'] == 'regression']
+        if regressions:
+            raise CommandError(f"Benchmarks regressed by more than {options['tolerance']:.0%}: "
+                               f"{', '.join(regressions)}")
@@ -0,0 +1,44 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from .services.metrics import metrics
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Middleware observing the duration of the requests and adding the `Server-Timing` header.
+
+    The metrics aggregated by the process are flushed after the response once the flush interval has passed.
+    """
+    if not metrics.enabled:
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with metrics.track_request() as timings:
+                response = await get_response(request)
+            finish_request(request, response, timings)
+            if metrics.is_flush_due():
+                await sync_to_async(metrics.flush, thread_sensitive=False)()
+            return response
+    else:
+        def middleware(request):
+            with metrics.track_request() as timings:
+                response = get_response(request)
+            finish_request(request, response, timings)
+            metrics.maybe_flush()
+            return response
+
+    return middleware
+
+
+def finish_request(request, response, timings) -> None:
+    duration = time.perf_counter() - timings.started_at
+    view = 'unresolved' if request.resolver_match is None else request.resolver_match.view_name
+    metrics.observe('weather_http_request_duration_seconds', duration,
+                    view=view, method=request.method, status=response.status_code)
+    if metrics.server_timing:
+        response['Server-Timing'] = timings.get_header(duration)
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0002_alter_weatherdata_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('api_id', models.PositiveIntegerField(blank=True, null=True, unique=True, verbose_name='ID у Weather API')),
+                ('name', models.CharField(max_length=100, verbose_name='Назва')),
+                ('local_name', models.CharField(blank=True, max_length=100, verbose_name='Локалізована назва')),
+                ('region', models.CharField(blank=True, max_length=100, verbose_name='Регіон')),
+                ('country', models.CharField(blank=True, max_length=100, verbose_name='Країна')),
+                ('lat', models.FloatField(blank=True, null=True, verbose_name='Широта')),
+                ('lon', models.FloatField(blank=True, null=True, verbose_name='Довгота')),
+            ],
+            options={
+                'verbose_name': 'Локація',
+                'verbose_name_plural': 'Локації',
+            },
+        ),
+        migrations.CreateModel(
+            name='LocationAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=100, unique=True, verbose_name='Псевдонім')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='weather_app.location', verbose_name='Локація')),
+            ],
+            options={
+                'verbose_name': 'Псевдонім локації',
+                'verbose_name_plural': 'Псевдоніми локацій',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='weatherdata',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='location',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='weather_data', to='weather_app.location', verbose_name='Локація'),
+        ),
+    ]
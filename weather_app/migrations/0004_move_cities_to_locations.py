@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:00
+
+from django.db import migrations
+
+
+def normalize_city_name(value):
+    for apostrophe in ('’', 'ʼ', '`', '‘'):
+        value = value.replace(apostrophe, "'")
+    return ' '.join(value.casefold().split())
+
+
+def move_cities_to_locations(apps, schema_editor):
+    """Create a location with an alias for every city name stored in weather data.
+
+    City names that differ only in case or whitespace share a location; their duplicate days are dropped.
+    """
+    Location = apps.get_model('weather_app', 'Location')
+    LocationAlias = apps.get_model('weather_app', 'LocationAlias')
+    WeatherData = apps.get_model('weather_app', 'WeatherData')
+    for city in WeatherData.objects.values_list('city', flat=True).distinct():
+        alias = LocationAlias.objects.filter(alias=normalize_city_name(city)).select_related('location').first()
+        if alias is None:
+            location = Location.objects.create(name=city, local_name=city)
+            LocationAlias.objects.create(alias=normalize_city_name(city), location=location)
+        else:
+            location = alias.location
+            stored_dates = WeatherData.objects.filter(location=location).values('date')
+            WeatherData.objects.filter(city=city, date__in=stored_dates).delete()
+        WeatherData.objects.filter(city=city).update(location=location)
+
+
+class Migration(migrations.Migration):
+    """Move the weather data to locations in a migration of its own.
+
+    Foreign key constraints are deferred on PostgreSQL, so the rows are updated in a separate transaction
+    from the following schema changes, which cannot alter a table with pending trigger events.
+    """
+
+    dependencies = [
+        ('weather_app', '0003_location_locationalias_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_cities_to_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0004_move_cities_to_locations'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='weatherdata',
+            name='city',
+        ),
+        migrations.AlterField(
+            model_name='weatherdata',
+            name='location',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weather_data', to='weather_app.location', verbose_name='Локація'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='weatherdata',
+            unique_together={('location', 'date')},
+        ),
+    ]
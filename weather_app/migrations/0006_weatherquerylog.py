@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:03
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0005_remove_weatherdata_city'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherQueryLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField(verbose_name='Початкова дата')),
+                ('end_date', models.DateField(verbose_name='Кінцева дата')),
+                ('query_date', models.DateField(default=datetime.date.today, verbose_name='Дата запиту')),
+                ('count', models.PositiveIntegerField(default=1, verbose_name='Кількість запитів')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='query_logs', to='weather_app.location', verbose_name='Локація')),
+            ],
+            options={
+                'verbose_name': 'Журнал запитів',
+                'verbose_name_plural': 'Журнал запитів',
+                'unique_together': {('location', 'start_date', 'end_date', 'query_date')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0006_weatherquerylog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherdata',
+            name='hourly_temperature',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Погодинна температура'),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='humidity',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Середня вологість, %'),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='max_temperature',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=3, null=True, verbose_name='Максимальна температура, °C'),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='max_wind_speed',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=4, null=True, verbose_name='Максимальна швидкість вітру, км/год'),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='min_temperature',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=3, null=True, verbose_name='Мінімальна температура, °C'),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='precipitation',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True, verbose_name='Опади, мм'),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='uv_index',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=3, null=True, verbose_name='УФ-індекс'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:16
+
+import datetime
+from django.db import migrations, models
+
+
+def mark_existing_rows_expired(apps, schema_editor):
+    """Mark the rows saved before sources were tracked as expired provisional rows.
+
+    It is unknown whether such rows were observed or forecast, so they are fetched again once requested
+    and replaced by rows with a known source.
+    """
+    WeatherData = apps.get_model('weather_app', 'WeatherData')
+    WeatherData.objects.update(fetched_at=datetime.datetime(1970, 1, 1))
+    WeatherData.objects.filter(date__gte=datetime.date.today()).update(source='forecast')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0007_weatherdata_daily_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherdata',
+            name='fetched_at',
+            field=models.DateTimeField(default=datetime.datetime.now, verbose_name='Час отримання'),
+        ),
+        migrations.AddField(
+            model_name='weatherdata',
+            name='source',
+            field=models.CharField(choices=[('history', 'Спостереження'), ('forecast', 'Прогноз')], default='history', max_length=8, verbose_name='Джерело'),
+        ),
+        migrations.RunPython(mark_existing_rows_expired, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:18
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+TABLE = 'weather_app_weatherdata'
+
+
+def add_months(date, months):
+    year, month = divmod(date.month - 1 + months, 12)
+    return datetime.date(date.year + year, month + 1, 1)
+
+
+def partition_weather_data(apps, schema_editor):
+    """Convert the weather data table into a table partitioned by month of the date on PostgreSQL.
+
+    The rows are copied into monthly partitions, created from the month of the retention cutoff, so that any date
+    of the history window can be saved, up to the months ahead kept by the partition maintenance. Other dates
+    are kept in the default partition, so a row out of the range does not fail the whole bulk upsert. The id is served by a sequence owned by the new table,
+    because partitioned tables do not support identity columns before PostgreSQL 17.
+    The primary key includes the partition key, unique, check and foreign key constraints are recreated.
+    Other databases keep a regular table.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    old_table = f'{TABLE}_unpartitioned'
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        if cursor.fetchone():
+            return
+        cursor.execute("SELECT attidentity, pg_get_serial_sequence(%s, 'id') FROM pg_attribute "
+                       "WHERE attrelid = %s::regclass AND attname = 'id'", [TABLE, TABLE])
+        identity, sequence = cursor.fetchone()
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = %s::regclass AND contype IN ('u', 'c', 'f') ORDER BY contype DESC",
+                       [TABLE])
+        constraints = cursor.fetchall()
+        cursor.execute('SELECT min(date), max(date), max(id) FROM %s' % TABLE)
+        min_date, max_date, max_id = cursor.fetchone()
+
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (TABLE, old_table))
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (date)' % (TABLE, old_table))
+        today = datetime.date.today()
+        cutoff_date = today - datetime.timedelta(days=settings.WEATHER_API_LIMITS['history_days_limit']
+                                                 + settings.WEATHER_DATA_RETENTION['grace_days'])
+        month = add_months(min(min_date or today, cutoff_date), 0)
+        last_month = add_months(max(max_date or today, today),
+                                settings.WEATHER_DATA_RETENTION['partitions_ahead_months'])
+        while month <= last_month:
+            next_month = add_months(month, 1)
+            cursor.execute('CREATE TABLE %s_p%04d_%02d PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)'
+                           % (TABLE, month.year, month.month, TABLE), [month, next_month])
+            month = next_month
+        cursor.execute('CREATE TABLE %s_default PARTITION OF %s DEFAULT' % (TABLE, TABLE))
+        cursor.execute('INSERT INTO %s SELECT * FROM %s' % (TABLE, old_table))
+
+        if identity:
+            cursor.execute('DROP TABLE %s' % old_table)
+            sequence = f'{TABLE}_id_seq'
+            cursor.execute('CREATE SEQUENCE %s' % sequence)
+        else:
+            cursor.execute('ALTER SEQUENCE %s OWNED BY NONE' % sequence)
+            cursor.execute('DROP TABLE %s' % old_table)
+        cursor.execute("ALTER TABLE %s ALTER COLUMN id SET DEFAULT nextval('%s')" % (TABLE, sequence))
+        cursor.execute('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, TABLE))
+        if max_id:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, max_id])
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s_pkey PRIMARY KEY (id, date)' % (TABLE, TABLE))
+        for name, definition in constraints:
+            cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (TABLE, name, definition))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0008_weatherdata_source_fetched_at'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='weatherdata',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='weatherdata',
+            name='location',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='weather_data', to='weather_app.location', verbose_name='Локація'),
+        ),
+        migrations.AddConstraint(
+            model_name='weatherdata',
+            constraint=models.UniqueConstraint(fields=('location', 'date'), name='weather_data_location_date_uniq'),
+        ),
+        migrations.RunPython(partition_weather_data, migrations.RunPython.noop),
+        # The primary key of the partitioned table is (id, date), which the model cannot declare,
+        # so it is recorded in the state as a unique constraint of the same name
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AddConstraint(
+                model_name='weatherdata',
+                constraint=models.UniqueConstraint(fields=('id', 'date'), name='weather_app_weatherdata_pkey'),
+            ),
+        ]),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0009_weatherdata_partitioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('week', 'Тиждень'), ('month', 'Місяць')], max_length=5, verbose_name='Період')),
+                ('start_date', models.DateField(verbose_name='Початкова дата')),
+                ('days', models.PositiveSmallIntegerField(verbose_name='Кількість днів')),
+                ('temperature_sum', models.FloatField(verbose_name='Сума середніх температур, °C')),
+                ('min_temperature', models.FloatField(blank=True, null=True, verbose_name='Мінімальна температура, °C')),
+                ('max_temperature', models.FloatField(blank=True, null=True, verbose_name='Максимальна температура, °C')),
+                ('precipitation_sum', models.FloatField(blank=True, null=True, verbose_name='Сума опадів, мм')),
+                ('humidity_sum', models.FloatField(blank=True, null=True, verbose_name='Сума вологості, %')),
+                ('humidity_days', models.PositiveSmallIntegerField(default=0, verbose_name='Кількість днів з вологістю')),
+                ('max_wind_speed', models.FloatField(blank=True, null=True, verbose_name='Максимальна швидкість вітру, км/год')),
+                ('heating_degree_days', models.FloatField(verbose_name='Градусо-дні опалення')),
+                ('cooling_degree_days', models.FloatField(verbose_name='Градусо-дні охолодження')),
+                ('location', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='weather_app.location', verbose_name='Локація')),
+            ],
+            options={
+                'verbose_name': 'Зведення погодних даних',
+                'verbose_name_plural': 'Зведення погодних даних',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='weatherrollup',
+            constraint=models.UniqueConstraint(fields=('location', 'period', 'start_date'), name='weather_rollup_location_period_start_uniq'),
+        ),
+    ]
@@ -1,50 +1,644 @@
 import datetime
+import time
+from decimal import Decimal
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
 from django.db import models
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Cast, Greatest, TruncDate, TruncMonth, TruncWeek
+
+from .services.city_index import normalize_city_name
+from .services.coverage_index import LocationCoverage, coverage_index
+from .services.day_weather import DayWeather, pack_hourly, unpack_hourly
+
+
+class Location(models.Model):
+    """Model to represent a location validated by the external API.
+
+    Weather data refers to the location by an integer key, and any user input
+    resolved to the location is stored as its alias.
+    """
+
+    api_id = models.PositiveIntegerField(verbose_name='ID у Weather API', unique=True, null=True, blank=True)
+    name = models.CharField(verbose_name='Назва', max_length=100)
+    local_name = models.CharField(verbose_name='Локалізована назва', max_length=100, blank=True)
+    region = models.CharField(verbose_name='Регіон', max_length=100, blank=True)
+    country = models.CharField(verbose_name='Країна', max_length=100, blank=True)
+    lat = models.FloatField(verbose_name='Широта', null=True, blank=True)
+    lon = models.FloatField(verbose_name='Довгота', null=True, blank=True)
+
+    def __str__(self):
+        return self.local_name or self.name
+
+    class Meta:
+        verbose_name = 'Локація'
+        verbose_name_plural = 'Локації'
+
+    @property
+    def api_query(self) -> str:
+        """Define the location for the external API request: by API id, coordinates or name."""
+        if self.api_id:
+            return f'id:{self.api_id}'
+        if self.lat is not None and self.lon is not None:
+            return f'{self.lat},{self.lon}'
+        return self.name
+
+    @classmethod
+    def get_by_alias(cls, city: str) -> 'Location | None':
+        """Retrieve the location the user-input city name has already been resolved to."""
+        return cls.objects.filter(aliases__alias=normalize_city_name(city)).first()
+
+    @classmethod
+    def get_by_aliases(cls, cities: Iterable[str]) -> dict[str, 'Location']:
+        """Retrieve the locations of the user-input city names resolved before by a single query.
+
+        The locations are mapped by the normalized names.
+        """
+        aliases = LocationAlias.objects.filter(alias__in={normalize_city_name(city) for city in cities}
+                                               ).select_related('location')
+        return {alias.alias: alias.location for alias in aliases}
+
+    @classmethod
+    def update_or_create_from_api(cls, location_data: dict) -> 'Location':
+        """Save the canonical location returned by the external API search endpoint."""
+        location, _ = cls.objects.update_or_create(
+            api_id=location_data['id'],
+            defaults={'name': location_data['name'],
+                      'region': location_data.get('region') or '',
+                      'country': location_data.get('country') or '',
+                      'lat': location_data.get('lat'),
+                      'lon': location_data.get('lon')})
+        return location
+
+    def add_aliases(self, *names: str) -> None:
+        """Store the names as aliases of the location. Aliases of other locations are left untouched."""
+        aliases = {normalize_city_name(name) for name in names if name}
+        LocationAlias.objects.bulk_create([LocationAlias(alias=alias, location=self) for alias in aliases],
+                                          ignore_conflicts=True)
+
+
+class LocationAlias(models.Model):
+    """Model to represent a normalized name that resolves to a location."""
+
+    alias = models.CharField(verbose_name='Псевдонім', max_length=100, unique=True)
+    location = models.ForeignKey(Location, verbose_name='Локація', on_delete=models.CASCADE, related_name='aliases')
+
+    def __str__(self):
+        return self.alias
+
+    class Meta:
+        verbose_name = 'Псевдонім локації'
+        verbose_name_plural = 'Псевдоніми локацій'
 
 
 class WeatherData(models.Model):
-    """Model to represent weather data for a specific city and date."""
+    """Model to represent weather data for a specific location and date.
+
+    A row observed after its day ended is final. Forecast rows and observations of the current day
+    are provisional: they are trusted for a limited time and replaced by newer data on save.
+    On PostgreSQL the table is partitioned by month of the date (see `services.partitions`).
+    """
+
+    class Source(models.TextChoices):
+        HISTORY = 'history', 'Спостереження'
+        FORECAST = 'forecast', 'Прогноз'
 
-    city = models.CharField(verbose_name='Місто', max_length=100)
+    # Lookups by location are served by the (location, date) unique index, so no separate index is kept
+    location = models.ForeignKey(Location, verbose_name='Локація', on_delete=models.CASCADE,
+                                 related_name='weather_data', db_index=False)
     date = models.DateField(verbose_name='Дата спостереження')
     temperature = models.DecimalField(verbose_name='Температура, °C', max_digits=3, decimal_places=1)
+    max_temperature = models.DecimalField(verbose_name='Максимальна температура, °C', max_digits=3, decimal_places=1,
+                                          null=True, blank=True)
+    min_temperature = models.DecimalField(verbose_name='Мінімальна температура, °C', max_digits=3, decimal_places=1,
+                                          null=True, blank=True)
+    precipitation = models.DecimalField(verbose_name='Опади, мм', max_digits=5, decimal_places=2, null=True,
+                                        blank=True)
+    max_wind_speed = models.DecimalField(verbose_name='Максимальна швидкість вітру, км/год', max_digits=4,
+                                         decimal_places=1, null=True, blank=True)
+    humidity = models.PositiveSmallIntegerField(verbose_name='Середня вологість, %', null=True, blank=True)
+    uv_index = models.DecimalField(verbose_name='УФ-індекс', max_digits=3, decimal_places=1, null=True, blank=True)
+    hourly_temperature = models.BinaryField(verbose_name='Погодинна температура', null=True, blank=True)
+    source = models.CharField(verbose_name='Джерело', max_length=8, choices=Source.choices, default=Source.HISTORY)
+    fetched_at = models.DateTimeField(verbose_name='Час отримання', default=datetime.datetime.now)
 
     def __str__(self):
-        return f'{self.city} / {self.date}'
+        return f'{self.location} / {self.date}'
 
     class Meta:
-        unique_together = ('city', 'date',)
+        # On PostgreSQL the primary key is (id, date), as the key of a partitioned table includes the partition key.
+        # The model cannot declare it, so it is kept as a unique constraint of the same name in the migration state
+        # only. Schema changes of `id` or `date` have to be written by hand for the partitioned table.
+        constraints = (models.UniqueConstraint(fields=('location', 'date'), name='weather_data_location_date_uniq'),
+                       models.UniqueConstraint(fields=('id', 'date'), name='weather_app_weatherdata_pkey'))
         verbose_name = 'Погодні дані'
         verbose_name_plural = 'Погодні дані'
 
+    data_version_key_prefix = 'weather_data_version'
+    data_modified_key_prefix = 'weather_data_modified'
+    # Daily metric columns and the matching DayWeather fields
+    METRIC_FIELDS = {'temperature': 'avgtemp_c', 'max_temperature': 'maxtemp_c', 'min_temperature': 'mintemp_c',
+                     'precipitation': 'totalprecip_mm', 'max_wind_speed': 'maxwind_kph', 'humidity': 'avghumidity',
+                     'uv_index': 'uv'}
+    # Order of the values in compact rows sent to the save task
+    ROW_FIELDS = ('location_id', 'date', *METRIC_FIELDS, 'hourly_temperature', 'source', 'fetched_at')
+    # Sources of the rows by the type of data fetched from the API
+    API_DATA_SOURCES = {'historical_weather_data': Source.HISTORY, 'forecast_weather_data': Source.FORECAST}
+
+    @property
+    def hourly_temperatures(self) -> tuple[float, ...] | None:
+        """Decode the packed hourly temperature curve, if it is stored."""
+        if self.hourly_temperature is None:
+            return None
+        return unpack_hourly(bytes(self.hourly_temperature))
+
     @classmethod
-    def get_data_according_to_form(cls, data: dict) -> models.QuerySet | None:
+    def get_data_according_to_form(cls, data: dict) -> list[DayWeather]:
         """ Retrieve weather data from the database based on user input.
 
-        If only ALL the required data is three-digit in the database, then they return.
-        Otherwise, nothing is returned.
+        All the stored data of the location within the date range is loaded by a single query in date order
+        as compact DayWeather records, without instantiating models. The caller decides which dates are missing.
         """
-        db_weather_data = cls.objects.filter(city=data['city'], date__range=(data['start_date'], data['end_date']))
-        date_range = [data['start_date'] + datetime.timedelta(days=i)
-                      for i in range((data['end_date'] - data['start_date']).days + 1)]
-        if db_weather_data.count() == len(date_range):
-            return db_weather_data
+        return [cls.get_day_weather(row) for row in cls.get_queryset_according_to_form(data)]
+
+    @classmethod
+    async def aget_data_according_to_form(cls, data: dict) -> list[DayWeather]:
+        """Retrieve weather data from the database asynchronously based on user input."""
+        return [cls.get_day_weather(row) async for row in cls.get_queryset_according_to_form(data)]
+
+    @classmethod
+    def get_queryset_according_to_form(cls, data: dict) -> models.QuerySet:
+        """Build a query for the valid stored daily metrics of the location within the date range in date order.
+
+        Provisional rows older than the `stored_forecast` timeout are skipped, so they are fetched again.
+        """
+        return cls.objects.filter(cls.get_valid_filter(), location=data['location'],
+                                  date__range=(data['start_date'], data['end_date'])
+                                  ).order_by('date').values_list('date', *cls.METRIC_FIELDS, 'hourly_temperature')
+
+    @classmethod
+    def get_data_of_locations(cls, location_ids: list[int], start_date: datetime.date,
+                              end_date: datetime.date) -> dict[int, list[DayWeather]]:
+        """Retrieve the valid stored daily metrics of many locations within the date range by a single query.
+
+        Hourly temperature curves are not loaded.
+        """
+        weather_data = {location_id: [] for location_id in location_ids}
+        for location_id, *row in cls.get_queryset_of_locations(location_ids, start_date, end_date):
+            weather_data[location_id].append(cls.get_day_weather((*row, None)))
+        return weather_data
+
+    @classmethod
+    async def aget_data_of_locations(cls, location_ids: list[int], start_date: datetime.date,
+                                     end_date: datetime.date) -> dict[int, list[DayWeather]]:
+        """Retrieve the valid stored daily metrics of many locations within the date range asynchronously."""
+        weather_data = {location_id: [] for location_id in location_ids}
+        async for location_id, *row in cls.get_queryset_of_locations(location_ids, start_date, end_date):
+            weather_data[location_id].append(cls.get_day_weather((*row, None)))
+        return weather_data
+
+    @classmethod
+    def get_queryset_of_locations(cls, location_ids: list[int], start_date: datetime.date,
+                                  end_date: datetime.date) -> models.QuerySet:
+        """Build a query for the valid stored daily metrics of the locations within the date range."""
+        return cls.objects.filter(cls.get_valid_filter(), location_id__in=location_ids,
+                                  date__range=(start_date, end_date)
+                                  ).order_by('location_id', 'date').values_list('location_id', 'date',
+                                                                                *cls.METRIC_FIELDS)
+
+    @classmethod
+    def get_coverage(cls, location_id: int) -> LocationCoverage:
+        """Get the dates of the location covered by valid stored rows.
+
+        The database is queried only if the coverage of the location is not cached yet.
+        """
+        return coverage_index.get(location_id, cls.load_coverage)
+
+    @classmethod
+    def load_coverage(cls, location_id: int, since: datetime.date) -> list[tuple[datetime.date, float | None]]:
+        """Load the stored dates of the location since the date with the times until which they are served."""
+        rows = cls.objects.filter(location_id=location_id, date__gte=since
+                                  ).values_list('date', 'source', 'fetched_at')
+        return [(date, cls.get_expiry({'date': date, 'source': source, 'fetched_at': fetched_at}))
+                for date, source, fetched_at in rows]
+
+    @classmethod
+    def get_expiry(cls, values: dict) -> float | None:
+        """Get the timestamp until which the row is served, or None if the row is final."""
+        if cls.is_final(values):
+            return None
+        return (values['fetched_at'] + datetime.timedelta(
+            seconds=settings.WEATHER_CACHE_TIMEOUTS['stored_forecast'])).timestamp()
+
+    @classmethod
+    def get_final_filter(cls) -> Q:
+        """Build a filter of the rows observed after their day ended."""
+        return Q(source=cls.Source.HISTORY, date__lt=TruncDate('fetched_at'))
+
+    @classmethod
+    def get_valid_filter(cls) -> Q:
+        """Build a filter of the rows that can be served without fetching them again."""
+        fresh_since = datetime.datetime.now() - datetime.timedelta(
+            seconds=settings.WEATHER_CACHE_TIMEOUTS['stored_forecast'])
+        return cls.get_final_filter() | Q(fetched_at__gte=fresh_since)
+
+    @classmethod
+    def get_day_weather(cls, row: tuple) -> DayWeather:
+        """Build a DayWeather record from a (date, *metrics, hourly_temperature) row.
+
+        The packed hourly temperature curve is passed as it is and decoded only when accessed.
+        """
+        date, *metrics, hourly_temperature = row
+        day_metrics = {day_field: float(value) if isinstance(value, Decimal) else value
+                       for day_field, value in zip(cls.METRIC_FIELDS.values(), metrics)}
+        return DayWeather(date, **day_metrics,
+                          hourly_packed=None if hourly_temperature is None else bytes(hourly_temperature))
+
+    @staticmethod
+    def has_shared_data_versions() -> bool:
+        """Check whether the data versions are kept in a cache shared by all processes, including the task workers.
+
+        Otherwise the Django cache is local to each process, so the versions changed by other processes are not seen.
+        """
+        return isinstance(caches['default'], RedisCache)
+
+    @classmethod
+    def get_stored_validators(cls, location_id: int, start_date: datetime.date,
+                              end_date: datetime.date) -> tuple[str, float | None]:
+        """Get the version and the time of the last change of the stored weather data of the location's date range.
+
+        They are derived from the number and the latest fetch time of the stored rows by a single query,
+        so they are the same in all processes even if the data versions are not shared.
+        """
+        return cls.get_stored_state(cls.get_range_queryset(location_id, start_date, end_date).aggregate(
+            rows=Count('id'), fetched_at=Max('fetched_at')))
+
+    @classmethod
+    async def aget_stored_validators(cls, location_id: int, start_date: datetime.date,
+                                     end_date: datetime.date) -> tuple[str, float | None]:
+        """Get the version and the time of the last change of the stored weather data asynchronously."""
+        return cls.get_stored_state(await cls.get_range_queryset(location_id, start_date, end_date).aaggregate(
+            rows=Count('id'), fetched_at=Max('fetched_at')))
+
+    @classmethod
+    def get_range_queryset(cls, location_id: int, start_date: datetime.date,
+                           end_date: datetime.date) -> models.QuerySet:
+        return cls.objects.filter(location_id=location_id, date__range=(start_date, end_date))
+
+    @staticmethod
+    def get_stored_state(state: dict) -> tuple[str, float | None]:
+        """Build the version and the time of the last change from the number and the latest fetch time of rows."""
+        if state['fetched_at'] is None:
+            return f'{state["rows"]}', None
+        last_modified = state['fetched_at'].timestamp()
+        return f'{state["rows"]}.{int(last_modified * 1000000)}', last_modified
+
+    @classmethod
+    def get_data_version(cls, location_id: int) -> int:
+        """Get the version of the stored weather data of the location, changed on every save."""
+        return cache.get(f'{cls.data_version_key_prefix}:{location_id}', 0)
 
     @classmethod
-    def save_api_weather_data(cls, data: dict) -> None:
+    async def aget_data_version(cls, location_id: int) -> int:
+        """Get the version of the stored weather data of the location asynchronously."""
+        return await cache.aget(f'{cls.data_version_key_prefix}:{location_id}', 0)
+
+    @classmethod
+    def get_last_modified(cls, location_id: int) -> float | None:
+        """Get the timestamp of the last change of the data version of the location, if it is known."""
+        return cache.get(f'{cls.data_modified_key_prefix}:{location_id}')
+
+    @classmethod
+    async def aget_last_modified(cls, location_id: int) -> float | None:
+        """Get the timestamp of the last change of the data version of the location asynchronously."""
+        return await cache.aget(f'{cls.data_modified_key_prefix}:{location_id}')
+
+    @classmethod
+    def bump_data_versions(cls, location_ids: set[int]) -> None:
+        """Change the versions of the stored weather data of the locations, so that cached renderings expire.
+
+        The time of the change is kept as well, it is sent as the `Last-Modified` time of the rendered pages.
+        """
+        for location_id in location_ids:
+            key = f'{cls.data_version_key_prefix}:{location_id}'
+            if not cache.add(key, 1, None):
+                try:
+                    cache.incr(key)
+                except ValueError:
+                    cache.set(key, 1, None)
+        if location_ids:
+            now = time.time()
+            cache.set_many({f'{cls.data_modified_key_prefix}:{location_id}': now for location_id in location_ids},
+                           None)
+
+    @classmethod
+    def save_api_weather_data(cls, data: dict, location_id: int) -> None:
         """Save weather data from an external API to the database.
 
         This method extracts relevant data from the API response
-        and saves it as WeatherData records in the database.
+        and saves it as WeatherData records of the location in the database.
         """
-        weather_data_list = []
+        local_name = cls.get_api_location_name(data)
+        cls.save_weather_rows(cls.compact_api_weather_data(data, location_id),
+                              {location_id: local_name} if local_name else {})
+
+    @classmethod
+    def save_weather_rows(cls, rows: list[tuple], local_names: dict[int, str]) -> None:
+        """Save compact rows (see `ROW_FIELDS`) to the database in a single bulk upsert.
+
+        Stored rows of the same location and date are replaced, so forecasts are promoted to observations.
+        Final rows are never replaced by provisional ones, either within the batch or in the database.
+        The saved dates are added to the coverage index of the locations and their rollups are recomputed.
+        Localized names of the locations are stored if they are not known yet.
+        """
+        for location_id, local_name in local_names.items():
+            Location.objects.filter(pk=location_id, local_name='').update(local_name=local_name)
+        values_by_key = {}
+        for row in rows:
+            values = cls.get_row_values(row)
+            key = (values['location_id'], values['date'])
+            if key not in values_by_key or not cls.is_final(values_by_key[key]) or cls.is_final(values):
+                values_by_key[key] = values
+        provisional_keys = [key for key, values in values_by_key.items() if not cls.is_final(values)]
+        covered_dates = {}
+        if provisional_keys:
+            final_keys = cls.objects.filter(
+                cls.get_final_filter(), location_id__in={location_id for location_id, date in provisional_keys},
+                date__in={date for location_id, date in provisional_keys}).values_list('location_id', 'date')
+            for key in final_keys:
+                values_by_key.pop(key, None)
+                covered_dates.setdefault(key[0], []).append((key[1], None))
+        cls.objects.bulk_create([cls.from_row_values(values) for values in values_by_key.values()],
+                                batch_size=1000, update_conflicts=True, unique_fields=('location', 'date'),
+                                update_fields=(*cls.METRIC_FIELDS, 'hourly_temperature', 'source', 'fetched_at'))
+        for (location_id, date), values in values_by_key.items():
+            covered_dates.setdefault(location_id, []).append((date, cls.get_expiry(values)))
+        for location_id, dates in covered_dates.items():
+            coverage_index.update(location_id, dates)
+        WeatherRollup.refresh(values_by_key)
+        cls.bump_data_versions({row[0] for row in rows})
+
+    @classmethod
+    def get_row_values(cls, row: tuple) -> dict:
+        """Map a compact row to field values.
+
+        Values missing in rows queued by older versions of the app are stored as NULL, such rows
+        are considered fetched now, and future dates are considered forecasts.
+        """
+        values = dict(zip(cls.ROW_FIELDS, row))
+        values['date'] = datetime.date.fromisoformat(str(values['date']))
+        fetched_at = values.get('fetched_at')
+        values['fetched_at'] = (datetime.datetime.fromisoformat(fetched_at) if isinstance(fetched_at, str)
+                                else fetched_at or datetime.datetime.now())
+        if not values.get('source'):
+            values['source'] = (cls.Source.FORECAST if values['date'] > values['fetched_at'].date()
+                                else cls.Source.HISTORY)
+        return values
+
+    @classmethod
+    def is_final(cls, values: dict) -> bool:
+        """Check whether the row values were observed after their day ended."""
+        return values['source'] == cls.Source.HISTORY and values['date'] < values['fetched_at'].date()
+
+    @classmethod
+    def from_row(cls, row: tuple) -> 'WeatherData':
+        """Build an unsaved WeatherData record from a compact row."""
+        return cls.from_row_values(cls.get_row_values(row))
+
+    @classmethod
+    def from_row_values(cls, values: dict) -> 'WeatherData':
+        """Build an unsaved WeatherData record from row values, packing the hourly temperature curve."""
+        if values.get('hourly_temperature') is not None:
+            values = {**values, 'hourly_temperature': pack_hourly(values['hourly_temperature'])}
+        return cls(**values)
+
+    @classmethod
+    def compact_api_weather_data(cls, data: dict, location_id: int) -> list[tuple]:
+        """Extract compact rows (see `ROW_FIELDS`) from an external API response.
+
+        Dates are kept as ISO strings and hourly temperatures as lists, so the rows can be sent
+        to a Celery task as they are.
+        """
+        rows = []
         for weather_data_type, value in data.items():
             if value:
-                for day in data[weather_data_type]['forecast']['forecastday']:
-                    city = data[weather_data_type]['location']['name']
-                    date_str = day['date']
-                    avg_temp = day['day']['avgtemp_c']
-                    date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-                    weather_data = cls(city=city, date=date, temperature=avg_temp)
-                    weather_data_list.append(weather_data)
-        cls.objects.bulk_create(weather_data_list, ignore_conflicts=True)
+                source = cls.API_DATA_SOURCES[weather_data_type]
+                fetched_at = value.get('fetched_at')
+                for day in value['forecast']['forecastday']:
+                    hourly_temp_c = day.hourly_temp_c
+                    rows.append((location_id, day.date.isoformat(),
+                                 *(getattr(day, day_field) for day_field in cls.METRIC_FIELDS.values()),
+                                 None if hourly_temp_c is None else list(hourly_temp_c), source.value, fetched_at))
+        return rows
+
+    @classmethod
+    def get_api_expiry(cls, data: dict) -> float | None:
+        """Get the timestamp until which the data fetched from an external API is served, or None if it is final."""
+        return min((expiry for row in cls.compact_api_weather_data(data, None)
+                    if (expiry := cls.get_expiry(cls.get_row_values(row))) is not None), default=None)
+
+    @staticmethod
+    def get_api_location_name(data: dict) -> str | None:
+        """Get the localized location name from an external API response."""
+        for value in data.values():
+            if value:
+                return value['location']['name']
+        return None
+
+
+class WeatherRollup(models.Model):
+    """Model to represent aggregates of the stored weather data of a location for a week or a month.
+
+    Rollups of the weeks and months touched by a save are recomputed from the stored rows, so statistics
+    over long date ranges are read from a few rows per location instead of the daily ones
+    (see `services.aggregates`). Rollups are kept when the rows are removed by the data retention.
+    Only the final rows are rolled up (see `WeatherData.get_final_filter`): forecasts and observations
+    of the current day would skew the statistics of the past, they are counted once they are observed again.
+    Degree-days are counted from the daily mean temperature with the bases of the `WEATHER_AGGREGATES` setting.
+    """
+
+    class Period(models.TextChoices):
+        WEEK = 'week', 'Тиждень'
+        MONTH = 'month', 'Місяць'
+
+    # Lookups by location are served by the (location, period, start date) unique index
+    location = models.ForeignKey(Location, verbose_name='Локація', on_delete=models.CASCADE,
+                                 related_name='rollups', db_index=False)
+    period = models.CharField(verbose_name='Період', max_length=5, choices=Period.choices)
+    start_date = models.DateField(verbose_name='Початкова дата')
+    days = models.PositiveSmallIntegerField(verbose_name='Кількість днів')
+    temperature_sum = models.FloatField(verbose_name='Сума середніх температур, °C')
+    min_temperature = models.FloatField(verbose_name='Мінімальна температура, °C', null=True, blank=True)
+    max_temperature = models.FloatField(verbose_name='Максимальна температура, °C', null=True, blank=True)
+    precipitation_sum = models.FloatField(verbose_name='Сума опадів, мм', null=True, blank=True)
+    humidity_sum = models.FloatField(verbose_name='Сума вологості, %', null=True, blank=True)
+    humidity_days = models.PositiveSmallIntegerField(verbose_name='Кількість днів з вологістю', default=0)
+    max_wind_speed = models.FloatField(verbose_name='Максимальна швидкість вітру, км/год', null=True, blank=True)
+    heating_degree_days = models.FloatField(verbose_name='Градусо-дні опалення')
+    cooling_degree_days = models.FloatField(verbose_name='Градусо-дні охолодження')
+
+    def __str__(self):
+        return f'{self.location} / {self.get_period_display()} {self.start_date}'
+
+    class Meta:
+        constraints = (models.UniqueConstraint(fields=('location', 'period', 'start_date'),
+                                               name='weather_rollup_location_period_start_uniq'),)
+        verbose_name = 'Зведення погодних даних'
+        verbose_name_plural = 'Зведення погодних даних'
+
+    AGGREGATE_FIELDS = ('days', 'temperature_sum', 'min_temperature', 'max_temperature', 'precipitation_sum',
+                        'humidity_sum', 'humidity_days', 'max_wind_speed', 'heating_degree_days',
+                        'cooling_degree_days')
+    # Functions truncating the dates to the first days of the periods in the database
+    PERIOD_TRUNCS = {Period.WEEK: TruncWeek, Period.MONTH: TruncMonth}
+
+    @classmethod
+    def get_period_start(cls, period: str, date: datetime.date) -> datetime.date:
+        """Get the first day of the week (Monday) or the month of the date."""
+        if period == cls.Period.WEEK:
+            return date - datetime.timedelta(days=date.weekday())
+        return date.replace(day=1)
+
+    @classmethod
+    def get_period_end(cls, period: str, start_date: datetime.date) -> datetime.date:
+        """Get the last day of the week or the month starting on the date."""
+        if period == cls.Period.WEEK:
+            return start_date + datetime.timedelta(days=6)
+        return (start_date + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+
+    @staticmethod
+    def get_aggregates() -> dict:
+        """Build the aggregate expressions of the rollup fields over the weather data rows."""
+        temperature = Cast('temperature', models.FloatField())
+        aggregate_settings = settings.WEATHER_AGGREGATES
+        return {'days': Count('date'),
+                'temperature_sum': Sum(temperature),
+                'min_temperature': Min(Cast('min_temperature', models.FloatField())),
+                'max_temperature': Max(Cast('max_temperature', models.FloatField())),
+                'precipitation_sum': Sum(Cast('precipitation', models.FloatField())),
+                'humidity_sum': Sum(Cast('humidity', models.FloatField())),
+                'humidity_days': Count('humidity'),
+                'max_wind_speed': Max(Cast('max_wind_speed', models.FloatField())),
+                'heating_degree_days': Sum(Greatest(Value(aggregate_settings['heating_base']) - temperature,
+                                                    Value(0.0))),
+                'cooling_degree_days': Sum(Greatest(temperature - Value(aggregate_settings['cooling_base']),
+                                                    Value(0.0)))}
+
+    @classmethod
+    def refresh(cls, keys: Iterable[tuple[int, datetime.date]]) -> None:
+        """Recompute the rollups of the weeks and months containing the (location id, date) keys.
+
+        The final rows of each location are aggregated by a query per period over the date range of its touched
+        periods, and the rollups are saved in a single bulk upsert. Rollups of the periods left without rows
+        are removed.
+        """
+        periods = {(location_id, period, cls.get_period_start(period, date))
+                   for location_id, date in keys for period in cls.Period}
+        if not periods:
+            return
+        date_ranges = {}
+        for location_id, period, start_date in periods:
+            end_date = cls.get_period_end(period, start_date)
+            min_date, max_date = date_ranges.get(location_id, (start_date, end_date))
+            date_ranges[location_id] = (min(min_date, start_date), max(max_date, end_date))
+        rows_filter = Q()
+        for location_id, date_range in date_ranges.items():
+            rows_filter |= Q(location_id=location_id, date__range=date_range)
+        rollups = []
+        for period, trunc in cls.PERIOD_TRUNCS.items():
+            aggregates = (WeatherData.objects.filter(WeatherData.get_final_filter(), rows_filter)
+                          .annotate(period_start=trunc('date'))
+                          .values('location_id', 'period_start').annotate(**cls.get_aggregates()).order_by())
+            for values in aggregates:
+                key = (values.pop('location_id'), period, values.pop('period_start'))
+                if key in periods:
+                    periods.remove(key)
+                    rollups.append(cls(location_id=key[0], period=period, start_date=key[2], **values))
+        cls.objects.bulk_create(rollups, batch_size=1000, update_conflicts=True,
+                                unique_fields=('location', 'period', 'start_date'),
+                                update_fields=cls.AGGREGATE_FIELDS)
+        if periods:
+            empty_filter = Q()
+            for location_id, period, start_date in periods:
+                empty_filter |= Q(location_id=location_id, period=period, start_date=start_date)
+            cls.objects.filter(empty_filter).delete()
+
+    @classmethod
+    def rebuild(cls, location_ids: Iterable[int] | None = None) -> int:
+        """Recompute the rollups of all the stored rows of the locations, or of all the locations.
+
+        Returns the number of the final rows rolled up.
+        """
+        queryset = WeatherData.objects.order_by('location_id')
+        if location_ids is not None:
+            queryset = queryset.filter(location_id__in=location_ids)
+        rows_count = 0
+        for location_id in queryset.values_list('location_id', flat=True).distinct():
+            rows = list(WeatherData.objects.filter(location_id=location_id).values('date', 'source', 'fetched_at'))
+            cls.refresh((location_id, row['date']) for row in rows)
+            rows_count += sum(WeatherData.is_final(row) for row in rows)
+        return rows_count
+
+
+class WeatherQueryLog(models.Model):
+    """Model to count weather requests per location, date range and day of the request.
+
+    Used to find popular locations whose data is fetched in advance.
+    """
+
+    location = models.ForeignKey(Location, verbose_name='Локація', on_delete=models.CASCADE,
+                                 related_name='query_logs')
+    start_date = models.DateField(verbose_name='Початкова дата')
+    end_date = models.DateField(verbose_name='Кінцева дата')
+    query_date = models.DateField(verbose_name='Дата запиту', default=datetime.date.today)
+    count = models.PositiveIntegerField(verbose_name='Кількість запитів', default=1)
+
+    def __str__(self):
+        return f'{self.location} / {self.start_date} - {self.end_date}'
+
+    class Meta:
+        unique_together = ('location', 'start_date', 'end_date', 'query_date',)
+        verbose_name = 'Журнал запитів'
+        verbose_name_plural = 'Журнал запитів'
+
+    @classmethod
+    def record(cls, data: dict) -> None:
+        """Count the weather request of the location and date range made today.
+
+        A single UPDATE is issued for a repeated request, a new row is inserted only for the first one.
+        """
+        query = cls.get_record_query(data)
+        if not cls.objects.filter(**query).update(count=F('count') + 1):
+            cls.objects.bulk_create([cls(**query)], ignore_conflicts=True)
+
+    @classmethod
+    async def arecord(cls, data: dict) -> None:
+        """Count the weather request of the location and date range made today asynchronously."""
+        query = cls.get_record_query(data)
+        if not await cls.objects.filter(**query).aupdate(count=F('count') + 1):
+            await cls.objects.abulk_create([cls(**query)], ignore_conflicts=True)
+
+    @staticmethod
+    def get_record_query(data: dict) -> dict:
+        """Define the fields identifying a weather request made today."""
+        return {'location': data['location'], 'start_date': data['start_date'], 'end_date': data['end_date'],
+                'query_date': datetime.date.today()}
+
+    @classmethod
+    def get_popular_locations(cls, top: int, days: int) -> list[Location]:
+        """Retrieve the most requested locations for the last days."""
+        since = datetime.date.today() - datetime.timedelta(days=days)
+        location_ids = list(cls.objects.filter(query_date__gte=since).values('location')
+                            .annotate(total=Sum('count')).order_by('-total').values_list('location', flat=True)[:top])
+        locations = Location.objects.in_bulk(location_ids)
+        return [locations[location_id] for location_id in location_ids if location_id in locations]
+
+    @classmethod
+    def delete_expired(cls, days: int) -> int:
+        """Delete the rows of requests made before the last days, returning the number of deleted rows."""
+        since = datetime.date.today() - datetime.timedelta(days=days)
+        deleted, _ = cls.objects.filter(query_date__lt=since).delete()
+        return deleted
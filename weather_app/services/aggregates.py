@@ -0,0 +1,144 @@
+import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import models
+
+from ..models import Location, WeatherRollup
+
+
+def get_period_index(period: str, date: datetime.date) -> int:
+    """Number the weeks or the months consecutively, so the periods of a date range are positions in arrays."""
+    if period == WeatherRollup.Period.WEEK:
+        # The first day of the proleptic Gregorian calendar is a Monday
+        return (date.toordinal() - 1) // 7
+    return date.year * 12 + date.month - 1
+
+
+def get_period_start(period: str, index: int) -> datetime.date:
+    """Get the first day of the week or the month by its number."""
+    if period == WeatherRollup.Period.WEEK:
+        return datetime.date.fromordinal(index * 7 + 1)
+    year, month = divmod(index, 12)
+    return datetime.date(year, month + 1, 1)
+
+
+def to_list(array: np.ndarray) -> list:
+    """Convert an array of values to a list rounded to hundredths, with None in place of NaN."""
+    return np.where(np.isnan(array), None, np.round(array, 2)).tolist()
+
+
+class WeatherAggregates:
+    """Class to compute statistics of the stored weather data of many locations by weeks or months.
+
+    The date range is widened to whole periods. Statistics are computed from the rollups (see `WeatherRollup`)
+    loaded by a single query into arrays of shape (locations, periods), which also hold `trailing_periods`
+    periods before the range. The temperature anomaly of a period is its mean temperature minus the mean
+    temperature of the `trailing_periods` periods before it. Values of the periods without stored data are None.
+    """
+
+    def __init__(self, locations: list[Location], start_date: datetime.date, end_date: datetime.date,
+                 period: str, trailing_periods: int):
+        self.locations = locations
+        self.period = period
+        self.trailing_periods = trailing_periods
+        self.first_index = get_period_index(period, start_date)
+        self.last_index = get_period_index(period, end_date)
+
+    @classmethod
+    def from_settings(cls, locations: list[Location], start_date: datetime.date, end_date: datetime.date,
+                      period: str) -> 'WeatherAggregates':
+        """Create the statistics configured by the `WEATHER_AGGREGATES` setting."""
+        return cls(locations, start_date, end_date, period,
+                   trailing_periods=settings.WEATHER_AGGREGATES['trailing_periods'][period])
+
+    @property
+    def periods_count(self) -> int:
+        return self.last_index - self.first_index + 1
+
+    def get_data(self) -> dict:
+        """Get the statistics of the locations by the periods and for the whole range."""
+        return self.get_statistics(list(self.get_queryset()))
+
+    async def aget_data(self) -> dict:
+        """Get the statistics of the locations asynchronously."""
+        return self.get_statistics([row async for row in self.get_queryset()])
+
+    def get_queryset(self) -> models.QuerySet:
+        """Build a query for the rollups of the locations from the first trailing period to the last period."""
+        return WeatherRollup.objects.filter(
+            location_id__in=[location.pk for location in self.locations], period=self.period,
+            start_date__range=(get_period_start(self.period, self.first_index - self.trailing_periods),
+                               get_period_start(self.period, self.last_index))
+        ).values_list('location_id', 'start_date', *WeatherRollup.AGGREGATE_FIELDS)
+
+    def get_arrays(self, rows: list[tuple]) -> dict[str, np.ndarray]:
+        """Lay out the rollup rows as arrays of the fields by location and period, NaN where there is no rollup."""
+        shape = (len(self.locations), self.trailing_periods + self.periods_count)
+        arrays = {field: np.full(shape, np.nan) for field in WeatherRollup.AGGREGATE_FIELDS}
+        if not rows:
+            return arrays
+        location_index = {location.pk: i for i, location in enumerate(self.locations)}
+        location_ids, start_dates, *columns = zip(*rows)
+        row_positions = np.fromiter((location_index[location_id] for location_id in location_ids), dtype=np.intp,
+                                    count=len(rows))
+        column_positions = np.fromiter((get_period_index(self.period, start_date) for start_date in start_dates),
+                                       dtype=np.intp, count=len(rows)) - (self.first_index - self.trailing_periods)
+        for field, column in zip(WeatherRollup.AGGREGATE_FIELDS, columns):
+            arrays[field][row_positions, column_positions] = np.array(column, dtype=float)
+        return arrays
+
+    def get_statistics(self, rows: list[tuple]) -> dict:
+        """Compute the statistics of the periods and the totals of the range from the rollup rows."""
+        arrays = self.get_arrays(rows)
+        days = np.nan_to_num(arrays['days'])
+        temperature_sum = np.nan_to_num(arrays['temperature_sum'])
+        # Sums of the `trailing_periods` periods before each period are differences of the cumulative sums
+        cumulative_sum = np.cumsum(np.pad(temperature_sum, ((0, 0), (1, 0))), axis=1)
+        cumulative_days = np.cumsum(np.pad(days, ((0, 0), (1, 0))), axis=1)
+        trailing, count = slice(self.trailing_periods, -1), slice(0, self.periods_count)
+        requested = slice(self.trailing_periods, None)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_temperature = temperature_sum / days
+            trailing_temperature = ((cumulative_sum[:, trailing] - cumulative_sum[:, count])
+                                    / (cumulative_days[:, trailing] - cumulative_days[:, count]))
+            values = {
+                'days': days[:, requested],
+                'mean_temperature': mean_temperature[:, requested],
+                'temperature_anomaly': mean_temperature[:, requested] - trailing_temperature,
+                'min_temperature': arrays['min_temperature'][:, requested],
+                'max_temperature': arrays['max_temperature'][:, requested],
+                'precipitation': arrays['precipitation_sum'][:, requested],
+                'mean_humidity': arrays['humidity_sum'][:, requested] / arrays['humidity_days'][:, requested],
+                'max_wind_speed': arrays['max_wind_speed'][:, requested],
+                'heating_degree_days': arrays['heating_degree_days'][:, requested],
+                'cooling_degree_days': arrays['cooling_degree_days'][:, requested],
+            }
+            totals = self.get_totals(values, temperature_sum[:, requested], arrays, requested)
+        locations = [{'id': location.pk, 'name': str(location),
+                      'values': {name: to_list(array[i]) for name, array in values.items()},
+                      'totals': {name: to_list(array[i:i + 1])[0] for name, array in totals.items()}}
+                     for i, location in enumerate(self.locations)]
+        periods = [get_period_start(self.period, index) for index in range(self.first_index, self.last_index + 1)]
+        return {'period': self.period, 'start_date': periods[0].isoformat(),
+                'end_date': WeatherRollup.get_period_end(self.period, periods[-1]).isoformat(),
+                'periods': [start_date.isoformat() for start_date in periods], 'locations': locations}
+
+    @staticmethod
+    def get_totals(values: dict[str, np.ndarray], temperature_sum: np.ndarray, arrays: dict[str, np.ndarray],
+                   requested: slice) -> dict[str, np.ndarray]:
+        """Reduce the statistics of the periods to the statistics of the whole range of each location."""
+        days = values['days'].sum(axis=1)
+        has_data = days > 0
+        return {
+            'days': days,
+            'mean_temperature': temperature_sum.sum(axis=1) / days,
+            'min_temperature': np.fmin.reduce(values['min_temperature'], axis=1),
+            'max_temperature': np.fmax.reduce(values['max_temperature'], axis=1),
+            'precipitation': np.where(has_data, np.nansum(values['precipitation'], axis=1), np.nan),
+            'mean_humidity': (np.nansum(arrays['humidity_sum'][:, requested], axis=1)
+                              / np.nansum(arrays['humidity_days'][:, requested], axis=1)),
+            'max_wind_speed': np.fmax.reduce(values['max_wind_speed'], axis=1),
+            'heating_degree_days': np.where(has_data, np.nansum(values['heating_degree_days'], axis=1), np.nan),
+            'cooling_degree_days': np.where(has_data, np.nansum(values['cooling_degree_days'], axis=1), np.nan),
+        }
@@ -0,0 +1,212 @@
+import datetime
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable
+
+from django.conf import settings
+
+from ..models import Location, WeatherData
+from .location_service import resolve_location
+from .query_planner import get_missing_periods
+from .upstream_limiter import ApiPriority, api_priority
+from .weather_api_service import HistoryWeatherRetriever
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces the starts of calls evenly at `rate` calls per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Wait until the next call is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(self._next_time, now)
+            self._next_time = start_time + self.interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+class BackfillCheckpoint:
+    """Set of the completed backfill periods kept in a JSON file.
+
+    The file is replaced atomically after every saved batch, so a crashed backfill resumes
+    from the last saved batch. Periods are keyed by the location and the dates, so a checkpoint
+    is only reused by a backfill of the same periods.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done = set()
+
+    def load(self) -> 'BackfillCheckpoint':
+        """Load the completed periods from the file, if it exists."""
+        if self.path.exists():
+            self.done = set(json.loads(self.path.read_text())['done'])
+        return self
+
+    def save(self) -> None:
+        """Write the completed periods to the file."""
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        temp_path.write_text(json.dumps({'done': sorted(self.done)}))
+        os.replace(temp_path, self.path)
+
+    def clear(self) -> None:
+        """Forget the completed periods and remove the file."""
+        self.done = set()
+        self.path.unlink(missing_ok=True)
+
+    @staticmethod
+    def get_key(period: dict) -> str:
+        return f"{period['location'].pk}:{period['start_date'].isoformat()}:{period['end_date'].isoformat()}"
+
+    def __contains__(self, period: dict) -> bool:
+        return self.get_key(period) in self.done
+
+    def add(self, periods: list[dict]) -> None:
+        """Mark the periods as completed."""
+        self.done.update(self.get_key(period) for period in periods)
+
+
+class WeatherBackfill:
+    """Class to fill the database with historical weather data of many locations.
+
+    The date range of each location is split into subperiods of a single history request, the subperiods
+    that are completed by the checkpoint or already stored are skipped. The rest are fetched in a thread pool
+    under a rate limit as background requests of `upstream_limiter`, bypassing the response cache,
+    and their rows are saved by bulk upserts of `batch_size` rows.
+    Completed subperiods are recorded in the checkpoint after every saved batch.
+    """
+
+    def __init__(self, start_date: datetime.date, end_date: datetime.date, checkpoint: BackfillCheckpoint,
+                 max_workers: int, rate_limiter: RateLimiter, batch_size: int,
+                 progress: Callable[[dict], None] | None = None):
+        self.locations = {}
+        self.start_date = start_date
+        self.end_date = end_date
+        self.checkpoint = checkpoint
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = {'periods': 0, 'skipped_periods': 0, 'failed_periods': 0, 'api_calls': 0, 'days': 0,
+                      'seconds': 0.0}
+
+    @classmethod
+    def from_settings(cls, start_date: datetime.date, end_date: datetime.date, checkpoint: BackfillCheckpoint,
+                      **options) -> 'WeatherBackfill':
+        """Create the backfill configured by the `WEATHER_BACKFILL` setting, overridden by `options`."""
+        backfill_settings = {**settings.WEATHER_BACKFILL,
+                             **{name: value for name, value in options.items() if value is not None}}
+        return cls(start_date, end_date, checkpoint,
+                   max_workers=backfill_settings['max_concurrent_requests'],
+                   rate_limiter=RateLimiter(backfill_settings['requests_per_second']),
+                   batch_size=backfill_settings['batch_size'])
+
+    def add_cities(self, cities: list[str]) -> list[str]:
+        """Resolve the city names to the locations to fill, returning the names that were not found.
+
+        Names that have not been resolved before are validated by the external API under the rate limit.
+        """
+        not_found = []
+        for city in cities:
+            location = Location.get_by_alias(city)
+            if location is None:
+                self.rate_limiter.acquire()
+                with api_priority(ApiPriority.BACKGROUND):
+                    location = resolve_location(city)
+            if location is None:
+                not_found.append(city)
+            else:
+                self.locations.setdefault(location.pk, location)
+        return not_found
+
+    def plan(self) -> list[dict]:
+        """Get the subperiods to fetch, skipping the completed ones and the ones already stored.
+
+        The date range is split the same way on every run, so the subperiods of the checkpoint are found again.
+        """
+        periods = []
+        for location in self.locations.values():
+            data = {'location': location, 'city': location.name,
+                    'start_date': self.start_date, 'end_date': self.end_date}
+            coverage = WeatherData.get_coverage(location.pk)
+            for subperiod in HistoryWeatherRetriever(data).get_subperiod_list(None):
+                period = {**data, **subperiod}
+                if period in self.checkpoint or not get_missing_periods(period['start_date'], period['end_date'],
+                                                                        coverage):
+                    self.stats['skipped_periods'] += 1
+                else:
+                    periods.append(period)
+        return periods
+
+    def run(self) -> dict:
+        """Fetch and save the planned subperiods, returning the throughput statistics.
+
+        At most two subperiods per worker are in flight, and each response is dropped once its rows are taken,
+        so the memory used does not grow with the number of the subperiods.
+        """
+        started_at = time.monotonic()
+        periods = self.plan()
+        self.stats['periods'] = len(periods)
+        rows, local_names, saved_periods = [], {}, []
+        planned_periods = iter(periods)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for period in itertools.islice(planned_periods, 2 * self.max_workers - len(pending)):
+                    pending[executor.submit(self.fetch, period)] = period
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    period = pending.pop(future)
+                    self.stats['api_calls'] += 1
+                    try:
+                        api_weather_data = {'historical_weather_data': future.result()}
+                    except Exception:
+                        logger.exception('Failed to backfill weather data of %s', BackfillCheckpoint.get_key(period))
+                        self.stats['failed_periods'] += 1
+                        continue
+                    period_rows = WeatherData.compact_api_weather_data(api_weather_data, period['location'].pk)
+                    rows += period_rows
+                    self.stats['days'] += len(period_rows)
+                    local_name = WeatherData.get_api_location_name(api_weather_data)
+                    if local_name:
+                        local_names[period['location'].pk] = local_name
+                    saved_periods.append(period)
+                    if len(rows) >= self.batch_size:
+                        self.save(rows, local_names, saved_periods, started_at)
+                        rows, local_names, saved_periods = [], {}, []
+        self.save(rows, local_names, saved_periods, started_at)
+        return self.stats
+
+    def fetch(self, period: dict) -> dict:
+        """Fetch historical weather data of a subperiod under the rate limit with the background priority."""
+        self.rate_limiter.acquire()
+        return HistoryWeatherRetriever(period, ApiPriority.BACKGROUND).fetch_response()
+
+    def save(self, rows: list[tuple], local_names: dict[int, str], periods: list[dict], started_at: float) -> None:
+        """Save a batch of rows, record its subperiods in the checkpoint and report the progress."""
+        if rows or local_names:
+            WeatherData.save_weather_rows(rows, local_names)
+            WeatherData.bump_data_versions({period['location'].pk for period in periods})
+        if periods:
+            self.checkpoint.add(periods)
+            self.checkpoint.save()
+        self.stats['seconds'] = time.monotonic() - started_at
+        if self.progress is not None:
+            self.progress(self.stats)
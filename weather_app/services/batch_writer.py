@@ -0,0 +1,53 @@
+import threading
+
+from django.db import connections
+
+from ..models import WeatherData
+
+
+class WeatherDataBatchWriter:
+    """Class to buffer weather data rows in a worker process and save them in batches.
+
+    Rows from many save tasks are aggregated and written by a single bulk insert once the flush interval
+    passes or the buffer is full. Repeated rows of the same location and date are written once,
+    the choice between them is made by `WeatherData.save_weather_rows`.
+    """
+
+    def __init__(self, max_rows: int, flush_interval: float):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._local_names = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, rows: list, local_names: dict[int, str]) -> None:
+        """Add rows to the buffer, flushing it if it is full or flushing is not deferred."""
+        with self._lock:
+            self._rows.extend(rows)
+            self._local_names.update(local_names)
+            is_full = len(self._rows) >= self.max_rows
+            if not is_full and self.flush_interval and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        if is_full or not self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Save all buffered rows to the database."""
+        with self._lock:
+            rows, local_names = self._rows, self._local_names
+            self._rows, self._local_names = [], {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if rows or local_names:
+            WeatherData.save_weather_rows(rows, local_names)
+
+    def flush_in_thread(self) -> None:
+        """Flush the buffer from the timer thread, releasing its database connection afterwards."""
+        try:
+            self.flush()
+        finally:
+            connections.close_all()
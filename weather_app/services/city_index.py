@@ -0,0 +1,144 @@
+import bisect
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .weather_api_service import CitySearcher
+
+
+def normalize_city_name(value: str) -> str:
+    """Normalize a city name for comparison: case-insensitive, apostrophe- and whitespace-agnostic."""
+    for apostrophe in ('’', 'ʼ', '`', '‘'):
+        value = value.replace(apostrophe, "'")
+    return ' '.join(value.casefold().split())
+
+
+class CityIndex:
+    """In-process prefix index over city names, aliases and countries.
+
+    Keys are kept in a sorted list, so a prefix lookup is a binary search followed by a short scan.
+    Prefixes that are not covered by the index are answered by the external API once,
+    its results are added to the index and remembered in an LRU cache with a TTL.
+    """
+
+    NAME_RANK, ALIAS_RANK, COUNTRY_RANK = range(3)
+
+    def __init__(self, cities: list[dict] = (), max_results: int = 10, cache_size: int = 1024,
+                 cache_ttl: int = 60 * 60 * 24):
+        self.max_results = max_results
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._keys = []
+        self._cities = []
+        self._city_positions = {}
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self.add(cities)
+
+    @classmethod
+    def from_settings(cls) -> 'CityIndex':
+        """Create an index seeded from the bundled dataset configured by the `CITY_INDEX` setting."""
+        index_settings = settings.CITY_INDEX
+        with open(index_settings['dataset'], encoding='utf-8') as dataset:
+            cities = json.load(dataset)
+        return cls(cities, max_results=index_settings['max_results'],
+                   cache_size=index_settings['cache_size'], cache_ttl=index_settings['cache_ttl'])
+
+    def search(self, query: str) -> list[dict]:
+        """Return cities matching the query prefix, falling back to the external API only on a miss."""
+        prefix = normalize_city_name(query)
+        cached_cities = self.get_cached(prefix)
+        if cached_cities is not None:
+            return cached_cities
+        cities = self.lookup(prefix)
+        if not cities:
+            cities = CitySearcher({'city': query}).get_data_from_API()
+            self.add(cities)
+            self.set_cached(prefix, cities)
+        return cities
+
+    async def asearch(self, query: str) -> list[dict]:
+        """Return cities matching the query prefix, querying the external API asynchronously on a miss."""
+        prefix = normalize_city_name(query)
+        cached_cities = self.get_cached(prefix)
+        if cached_cities is not None:
+            return cached_cities
+        cities = self.lookup(prefix)
+        if not cities:
+            cities = await CitySearcher({'city': query}).aget_data_from_API()
+            self.add(cities)
+            self.set_cached(prefix, cities)
+        return cities
+
+    def lookup(self, prefix: str) -> list[dict]:
+        """Return cities from the index whose name, alias or country starts with the normalized prefix."""
+        with self._lock:
+            keys = self._keys
+            matches = []
+            for index in range(bisect.bisect_left(keys, (prefix,)), len(keys)):
+                key, rank, position = keys[index]
+                if not key.startswith(prefix):
+                    break
+                matches.append((rank, len(key), position))
+            cities = self._cities
+        positions = dict.fromkeys(position for rank, length, position in sorted(matches))
+        return [cities[position] for position in list(positions)[:self.max_results]]
+
+    def add(self, cities: list[dict]) -> None:
+        """Add cities to the index, updating already known ones with the new data."""
+        with self._lock:
+            for city in cities:
+                aliases = {normalize_city_name(alias) for alias in city.get('aliases', ())}
+                city = {field: value for field, value in city.items() if field != 'aliases'}
+                identity = self.get_identity(city)
+                position = self._city_positions.get(identity)
+                if position is None:
+                    position = len(self._cities)
+                    self._cities.append(city)
+                    self._city_positions[identity] = position
+                    self.insert_key(normalize_city_name(city['country']), self.COUNTRY_RANK, position)
+                else:
+                    self._cities[position] = {**self._cities[position], **city}
+                self.insert_key(normalize_city_name(city['name']), self.NAME_RANK, position)
+                for alias in aliases:
+                    self.insert_key(alias, self.ALIAS_RANK, position)
+
+    def insert_key(self, key: str, rank: int, position: int) -> None:
+        """Insert a key into the sorted key list unless it is already there."""
+        item = (key, rank, position)
+        index = bisect.bisect_left(self._keys, item)
+        if index == len(self._keys) or self._keys[index] != item:
+            self._keys.insert(index, item)
+
+    @staticmethod
+    def get_identity(city: dict) -> tuple:
+        """Return the key identifying the same city in the bundled dataset and in API results."""
+        return (normalize_city_name(city['name']), normalize_city_name(city.get('country', '')),
+                round(float(city.get('lat', 0))), round(float(city.get('lon', 0))))
+
+    def get_cached(self, prefix: str) -> list[dict] | None:
+        """Return API results cached for the prefix if they have not expired yet."""
+        with self._lock:
+            cached = self._cache.get(prefix)
+            if cached is None:
+                return None
+            expires_at, cities = cached
+            if expires_at < time.monotonic():
+                del self._cache[prefix]
+                return None
+            self._cache.move_to_end(prefix)
+            return cities
+
+    def set_cached(self, prefix: str, cities: list[dict]) -> None:
+        """Cache API results for the prefix, evicting the least recently used entries."""
+        with self._lock:
+            self._cache[prefix] = (time.monotonic() + self.cache_ttl, cities)
+            self._cache.move_to_end(prefix)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+city_index = CityIndex.from_settings()
@@ -0,0 +1,118 @@
+import datetime
+import time
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import metrics
+
+
+class LocationCoverage:
+    """Bitmap of the dates of a location that have valid rows in the database.
+
+    Bit `i` stands for the date with the ordinal `base + i`, where `base` is the first date of the supported
+    window. Final rows are kept as bits, provisional rows (forecasts and observations of the current day)
+    are kept with the time until which they are served.
+    """
+
+    __slots__ = ('base', 'final_bits', 'provisional',)
+
+    def __init__(self, base: int):
+        self.base = base
+        self.final_bits = 0
+        self.provisional = {}
+
+    def __contains__(self, date: datetime.date) -> bool:
+        offset = date.toordinal() - self.base
+        if offset < 0:
+            return False
+        if self.final_bits >> offset & 1:
+            return True
+        return self.provisional.get(date.toordinal(), 0) > time.time()
+
+    def add(self, date: datetime.date, expires_at: float | None) -> None:
+        """Mark the date as stored: finally if `expires_at` is None, otherwise until the timestamp."""
+        ordinal = date.toordinal()
+        if ordinal < self.base:
+            return
+        if expires_at is None:
+            self.final_bits |= 1 << (ordinal - self.base)
+            self.provisional.pop(ordinal, None)
+        elif not self.final_bits >> (ordinal - self.base) & 1:
+            self.provisional[ordinal] = expires_at
+
+    def get_expiry(self, start_date: datetime.date, end_date: datetime.date) -> float | None:
+        """Get the earliest time until which the provisional dates of the range are served, None if there are none."""
+        start, end, now = start_date.toordinal(), end_date.toordinal(), time.time()
+        return min((expires_at for ordinal, expires_at in self.provisional.items()
+                    if start <= ordinal <= end and expires_at > now), default=None)
+
+    def rebase(self, base: int) -> None:
+        """Move the start of the window, dropping the dates before it."""
+        if base > self.base:
+            self.final_bits >>= base - self.base
+        elif base < self.base:
+            self.final_bits <<= self.base - base
+        self.provisional = {ordinal: expires_at for ordinal, expires_at in self.provisional.items()
+                            if ordinal >= base}
+        self.base = base
+
+
+class CoverageIndex:
+    """Per-location index of the dates stored in the database, kept in the Django cache.
+
+    Coverage of a location is rebuilt from the database by a single query when it is not cached,
+    and updated by the save path afterwards. Updates are not atomic: a lost update only makes
+    a stored date look missing, so it is fetched again, a missing date never looks stored.
+    """
+
+    key_prefix = 'weather_coverage'
+
+    def __init__(self, window_days: int):
+        self.window_days = window_days
+
+    def get(self, location_id: int,
+            load: Callable[[int, datetime.date], Iterable[tuple[datetime.date, float | None]]]) -> LocationCoverage:
+        """Get the coverage of the location, building it from the rows returned by `load` on a miss."""
+        key = self.get_key(location_id)
+        base_date = self.get_base_date()
+        coverage = cache.get(key)
+        if coverage is None:
+            metrics.inc('weather_coverage_lookups_total', result='miss')
+            coverage = LocationCoverage(base_date.toordinal())
+            for date, expires_at in load(location_id, base_date):
+                coverage.add(date, expires_at)
+            cache.add(key, coverage, None)
+        else:
+            metrics.inc('weather_coverage_lookups_total', result='hit')
+            coverage.rebase(base_date.toordinal())
+        return coverage
+
+    def update(self, location_id: int, dates: Iterable[tuple[datetime.date, float | None]]) -> None:
+        """Add the saved dates to the coverage of the location if it is cached.
+
+        Coverage that is not cached yet is built from the database later, already including the saved rows.
+        """
+        key = self.get_key(location_id)
+        coverage = cache.get(key)
+        if coverage is None:
+            return
+        coverage.rebase(self.get_base_date().toordinal())
+        for date, expires_at in dates:
+            coverage.add(date, expires_at)
+        cache.set(key, coverage, None)
+
+    def invalidate(self, location_id: int) -> None:
+        """Remove the coverage of the location, so that it is rebuilt from the database."""
+        cache.delete(self.get_key(location_id))
+
+    def get_base_date(self) -> datetime.date:
+        """Get the first date of the supported window."""
+        return datetime.date.today() - datetime.timedelta(days=self.window_days)
+
+    def get_key(self, location_id: int) -> str:
+        return f'{self.key_prefix}:{location_id}'
+
+
+coverage_index = CoverageIndex(window_days=settings.WEATHER_API_LIMITS['history_days_limit'] + 1)
@@ -0,0 +1,70 @@
+import datetime
+import sys
+from array import array
+
+
+def pack_hourly(values: list[float] | tuple[float, ...]) -> bytes:
+    """Pack an hourly series into a fixed-order little-endian array of int16 tenths of a unit."""
+    packed = array('h', (round(value * 10) for value in values))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_hourly(data: bytes) -> tuple[float, ...]:
+    """Decode an hourly series packed by `pack_hourly`."""
+    packed = array('h')
+    packed.frombytes(data)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return tuple(value / 10 for value in packed)
+
+
+class DayWeather:
+    """Compact record of weather data for a single day.
+
+    Keeps the parsed date and the daily aggregates. The hourly temperature curve is optional,
+    it is kept packed and decoded only when accessed.
+    """
+
+    __slots__ = ('date', 'avgtemp_c', 'maxtemp_c', 'mintemp_c', 'totalprecip_mm', 'maxwind_kph', 'avghumidity',
+                 'uv', 'hourly_packed',)
+    DAY_FIELDS = ('avgtemp_c', 'maxtemp_c', 'mintemp_c', 'totalprecip_mm', 'maxwind_kph', 'avghumidity', 'uv',)
+
+    def __init__(self, date: datetime.date, avgtemp_c: float | None = None, maxtemp_c: float | None = None,
+                 mintemp_c: float | None = None, totalprecip_mm: float | None = None,
+                 maxwind_kph: float | None = None, avghumidity: float | None = None, uv: float | None = None,
+                 hourly_temp_c: list[float] | tuple[float, ...] | None = None, hourly_packed: bytes | None = None):
+        self.date = date
+        self.avgtemp_c = avgtemp_c
+        self.maxtemp_c = maxtemp_c
+        self.mintemp_c = mintemp_c
+        self.totalprecip_mm = totalprecip_mm
+        self.maxwind_kph = maxwind_kph
+        self.avghumidity = avghumidity
+        self.uv = uv
+        if hourly_temp_c is not None:
+            hourly_packed = pack_hourly(hourly_temp_c)
+        self.hourly_packed = hourly_packed
+
+    @property
+    def hourly_temp_c(self) -> tuple[float, ...] | None:
+        """Decode the hourly temperature curve, if it is known."""
+        if self.hourly_packed is None:
+            return None
+        return unpack_hourly(self.hourly_packed)
+
+    def __repr__(self):
+        return f'DayWeather({self.date.isoformat()}, avgtemp_c={self.avgtemp_c})'
+
+    def __eq__(self, other):
+        if not isinstance(other, DayWeather):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
@@ -0,0 +1,170 @@
+import csv
+import datetime
+import io
+import itertools
+import json
+import zlib
+from decimal import Decimal
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q, QuerySet
+
+from ..models import WeatherData
+from .day_weather import unpack_hourly
+
+
+class WeatherDataExporter:
+    """Class to export stored weather data as CSV or NDJSON in chunks of bytes.
+
+    Rows are read by a server-side cursor in batches of `chunk_size` and encoded batch by batch,
+    so memory use does not depend on the size of the export. Rows are ordered by the location and the date,
+    the key of the unique index, which is also used as a keyset cursor to page through large exports.
+    """
+
+    EXPORT_FIELDS = ('location_id', 'location__api_id', 'location__name', 'date', *WeatherData.METRIC_FIELDS,
+                     'hourly_temperature', 'source', 'fetched_at')
+    COLUMNS = ('location_id', 'location_api_id', 'location_name', 'date', *WeatherData.METRIC_FIELDS,
+               'hourly_temperature', 'source', 'fetched_at')
+    CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson; charset=utf-8'}
+
+    def __init__(self, data: dict, chunk_size: int):
+        self.format = data['format']
+        self.locations = data.get('location')
+        self.start_date = data.get('start_date')
+        self.end_date = data.get('end_date')
+        self.after = data.get('after')
+        self.limit = data.get('limit')
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_settings(cls, data: dict) -> 'WeatherDataExporter':
+        """Create the exporter configured by the `WEATHER_EXPORT` setting."""
+        return cls(data, chunk_size=settings.WEATHER_EXPORT['chunk_size'])
+
+    @property
+    def content_type(self) -> str:
+        return self.CONTENT_TYPES[self.format]
+
+    @property
+    def filename(self) -> str:
+        return f'weather_data.{self.format}'
+
+    def get_queryset(self) -> QuerySet:
+        """Filter the stored rows by the locations, the date range and the cursor in the export order."""
+        queryset = WeatherData.objects.all()
+        if self.locations:
+            queryset = queryset.filter(location__in=self.locations)
+        if self.start_date:
+            queryset = queryset.filter(date__gte=self.start_date)
+        if self.end_date:
+            queryset = queryset.filter(date__lte=self.end_date)
+        if self.after:
+            location_id, date = self.after
+            queryset = queryset.filter(Q(location_id__gt=location_id) | Q(location_id=location_id, date__gt=date))
+        return queryset.order_by('location_id', 'date')
+
+    def get_rows_queryset(self) -> QuerySet:
+        """Get the rows of the requested page as tuples of `EXPORT_FIELDS`."""
+        queryset = self.get_queryset().values_list(*self.EXPORT_FIELDS)
+        return queryset[:self.limit] if self.limit else queryset
+
+    def get_next_cursor_queryset(self) -> QuerySet:
+        """Get the keys of the last row of the page and the row after it."""
+        return self.get_queryset().values_list('location_id', 'date')[self.limit - 1:self.limit + 1]
+
+    def get_next_cursor(self) -> str | None:
+        """Get the cursor of the next page, if the export is paginated and there are rows after the page."""
+        if not self.limit:
+            return None
+        return self.format_cursor(list(self.get_next_cursor_queryset()))
+
+    async def aget_next_cursor(self) -> str | None:
+        """Get the cursor of the next page asynchronously."""
+        if not self.limit:
+            return None
+        return self.format_cursor([key async for key in self.get_next_cursor_queryset()])
+
+    @staticmethod
+    def format_cursor(keys: list[tuple[int, datetime.date]]) -> str | None:
+        if len(keys) < 2:
+            return None
+        location_id, date = keys[0]
+        return f'{location_id}:{date.isoformat()}'
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """Yield the encoded export, a batch of rows per chunk."""
+        yield self.encode_header()
+        rows = self.get_rows_queryset().iterator(chunk_size=self.chunk_size)
+        while batch := self.get_batch(rows):
+            yield self.encode_rows(batch)
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        """Yield the encoded export asynchronously, so it is streamed by ASGI servers without buffering.
+
+        Batches are read from the server-side cursor in a thread: `QuerySet.aiterator()` of this Django version
+        executes the query of `values_list()` on the event loop.
+        """
+        yield self.encode_header()
+        rows = self.get_rows_queryset().iterator(chunk_size=self.chunk_size)
+        while batch := await sync_to_async(self.get_batch)(rows):
+            yield self.encode_rows(batch)
+
+    def get_batch(self, rows: Iterator[tuple]) -> list[tuple]:
+        """Read the next batch of rows from the cursor."""
+        return list(itertools.islice(rows, self.chunk_size))
+
+    def encode_header(self) -> bytes:
+        """Encode the CSV header line; NDJSON has no header."""
+        if self.format != 'csv':
+            return b''
+        return self.encode_rows([self.COLUMNS], raw=True)
+
+    def encode_rows(self, rows: list[tuple], raw: bool = False) -> bytes:
+        """Encode a batch of rows in the export format."""
+        if self.format == 'ndjson':
+            return ''.join(json.dumps(dict(zip(self.COLUMNS, self.get_values(row))), ensure_ascii=False) + '\n'
+                           for row in rows).encode()
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerows(rows if raw else (self.get_csv_values(row) for row in rows))
+        return output.getvalue().encode()
+
+    @staticmethod
+    def get_values(row: tuple) -> list:
+        """Convert the values of a row to JSON types, decoding the packed hourly temperatures."""
+        values = []
+        for value in row:
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = float(value)
+            elif isinstance(value, (bytes, memoryview)):
+                value = list(unpack_hourly(bytes(value)))
+            values.append(value)
+        return values
+
+    def get_csv_values(self, row: tuple) -> list:
+        """Convert the values of a row to CSV cells, joining the hourly temperatures by semicolons."""
+        return [';'.join(map(str, value)) if isinstance(value, list) else value for value in self.get_values(row)]
+
+
+def gzip_chunks(chunks: Iterator[bytes], level: int) -> Iterator[bytes]:
+    """Compress a stream of chunks into a single gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def agzip_chunks(chunks: AsyncIterator[bytes], level: int) -> AsyncIterator[bytes]:
+    """Compress an asynchronous stream of chunks into a single gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
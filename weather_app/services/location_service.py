@@ -0,0 +1,80 @@
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .city_index import normalize_city_name
+from .upstream_limiter import api_concurrency_limit
+from .weather_api_service import CitySearcher
+from ..models import Location
+
+LOCATION_FIELDS = ('id', 'name', 'region', 'country', 'lat', 'lon',)
+
+
+def resolve_location(city: str) -> Location | None:
+    """Resolve the user-input city name to a stored location, or None if the city is not found.
+
+    A city name that has already been resolved is found by its alias without querying the external API.
+    Otherwise, the canonical location is validated by the API, saved, and the input is stored as its alias.
+    """
+    location = Location.get_by_alias(city)
+    if location is None:
+        location_data = get_validated_location(city)
+        if location_data is None:
+            return None
+        location = Location.update_or_create_from_api(location_data)
+        location.add_aliases(city)
+    return location
+
+
+def resolve_locations(cities: list[str], max_concurrent_requests: int) -> list[Location | None]:
+    """Resolve the user-input city names to stored locations in their order, with None for the cities not found.
+
+    Names resolved before are found by a single query of their aliases. The others are validated by the external
+    API concurrently in a thread pool with at most `max_concurrent_requests` requests in flight, and the found
+    locations are saved in the calling thread.
+    """
+    locations = Location.get_by_aliases(cities)
+    unknown = {}
+    for city in cities:
+        alias = normalize_city_name(city)
+        if alias not in locations:
+            unknown.setdefault(alias, city)
+    unknown = list(unknown.items())
+    if unknown:
+        with api_concurrency_limit(max_concurrent_requests), \
+                ThreadPoolExecutor(max_workers=min(max_concurrent_requests, len(unknown))) as executor:
+            contexts = [contextvars.copy_context() for _ in unknown]
+            validated = list(executor.map(lambda context, city: context.run(get_validated_location, city),
+                                          contexts, [city for _, city in unknown]))
+        for (alias, city), location_data in zip(unknown, validated):
+            if location_data is not None:
+                locations[alias] = Location.update_or_create_from_api(location_data)
+                locations[alias].add_aliases(city)
+    return [locations.get(normalize_city_name(city)) for city in cities]
+
+
+def get_validated_location(city: str) -> dict | None:
+    """Return the canonical location for the user-input city name, or None if the city is not found.
+
+    The user input is validated against the external API search endpoint only once;
+    the canonical location is then shared by all workers through the Django cache.
+    """
+    cache_key = get_validated_location_cache_key(city)
+    location = cache.get(cache_key)
+    if location is None:
+        search_results = CitySearcher({'city': city}).get_data_from_API()
+        if search_results:
+            location = {field: search_results[0].get(field) for field in LOCATION_FIELDS}
+            cache.set(cache_key, location, settings.WEATHER_CACHE_TIMEOUTS['validated_city'])
+        else:
+            location = {}
+            cache.set(cache_key, location, settings.WEATHER_CACHE_TIMEOUTS['invalid_city'])
+    return location or None
+
+
+def get_validated_location_cache_key(city: str) -> str:
+    """Build a cache key for the normalized user-input city name."""
+    return 'validated_city:' + hashlib.sha1(normalize_city_name(city).encode()).hexdigest()
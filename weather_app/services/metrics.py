@@ -0,0 +1,353 @@
+import contextlib
+import contextvars
+import datetime
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from typing import BinaryIO
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.template.response import TemplateResponse
+
+from .upstream_limiter import UpstreamLimiter
+
+logger = logging.getLogger(__name__)
+
+METRICS = {
+    'weather_http_request_duration_seconds': (
+        'histogram', 'Duration of the requests to the app by view, method and status.'),
+    'weather_api_requests_total': (
+        'counter', 'Requests sent to the Weather API by method and response status.'),
+    'weather_api_request_duration_seconds': (
+        'histogram', 'Duration of the Weather API requests including the parsing of the streamed body.'),
+    'weather_api_response_bytes_total': (
+        'counter', 'Bytes of the decoded Weather API response bodies read by method.'),
+    'weather_api_response_chunks_total': (
+        'counter', 'Chunks of the Weather API response bodies read by method.'),
+    'weather_db_query_duration_seconds': (
+        'histogram', 'Duration of the database queries by table and operation.'),
+    'weather_coverage_lookups_total': (
+        'counter', 'Lookups of the coverage index by result: hit if the coverage was cached, miss if it was built.'),
+    'weather_query_plans_total': (
+        'counter', 'Weather data requests by the part of the range found in the database: all, part or none.'),
+    'weather_template_render_duration_seconds': (
+        'histogram', 'Duration of the template rendering by template.'),
+    'weather_celery_task_duration_seconds': (
+        'histogram', 'Duration of the Celery tasks by task and final state.'),
+    'weather_celery_task_queue_lag_seconds': (
+        'histogram', 'Time the Celery tasks waited in the queue from publishing (or the ETA) to the start.'),
+}
+
+_request_timings = contextvars.ContextVar('weather_request_timings', default=None)
+
+_LE_LABEL = re.compile(r',?le="([^"]*)"')
+
+
+class RequestTimings:
+    """Durations of the work done for a request by kind, reported by the `Server-Timing` header."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration: float) -> None:
+        with self._lock:
+            total, count = self.durations.get(name, (0.0, 0))
+            self.durations[name] = (total + duration, count + 1)
+
+    def get_header(self, total: float) -> str:
+        """Build the `Server-Timing` header value in milliseconds.
+
+        Work done concurrently (such as parallel API requests) is summed, so it may exceed the total.
+        """
+        with self._lock:
+            durations = sorted(self.durations.items())
+        entries = [f'{name};dur={duration * 1000:.1f};desc="{count}"' for name, (duration, count) in durations]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+class WeatherMetrics:
+    """Registry of the counters and histograms of the app, exposed in the Prometheus text format.
+
+    Samples are aggregated in the process under a lock, which is cheap enough for the hot paths.
+    When the Django cache is Redis, the aggregated increments are added to a Redis hash at most every
+    `flush_interval` seconds, so the metrics of all web and Celery worker processes are exposed together.
+    Otherwise only the metrics of the serving process are exposed.
+    Durations recorded with a `timing` name during a request are also reported by the `Server-Timing` header
+    if `server_timing` is on.
+    """
+
+    key = 'weather_metrics'
+
+    def __init__(self, enabled: bool, server_timing: bool, flush_interval: float, buckets: tuple[float, ...],
+                 token: str | None = None):
+        self.enabled = enabled
+        self.server_timing = server_timing
+        self.flush_interval = flush_interval
+        self.buckets = tuple(sorted(buckets))
+        self.token = token
+        self.query_tables = {}
+        self._pending = Counter()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'WeatherMetrics':
+        """Create the registry configured by the `WEATHER_METRICS` setting."""
+        return cls(**settings.WEATHER_METRICS)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Increment a counter."""
+        if not self.enabled:
+            return
+        key = f'{name}{{{format_labels(labels)}}}'
+        with self._lock:
+            self._pending[key] += value
+
+    def observe(self, name: str, value: float, timing: str | None = None, **labels) -> None:
+        """Add an observation to a histogram and to the timings of the current request under the `timing` name."""
+        if not self.enabled:
+            return
+        if timing is not None:
+            self.add_timing(timing, value)
+        label_string = format_labels(labels)
+        prefix = f'{name}_bucket{{{label_string},' if label_string else f'{name}_bucket{{'
+        with self._lock:
+            for bound in self.buckets:
+                self._pending[f'{prefix}le="{bound}"}}'] += value <= bound
+            self._pending[f'{prefix}le="+Inf"}}'] += 1
+            self._pending[f'{name}_sum{{{label_string}}}'] += value
+            self._pending[f'{name}_count{{{label_string}}}'] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name: str, timing: str | None = None, **labels):
+        """Observe the duration of the block in seconds."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, timing, **labels)
+
+    @staticmethod
+    def add_timing(name: str, duration: float) -> None:
+        """Add a duration to the timings of the current request, if a request is tracked."""
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(name, duration)
+
+    @contextlib.contextmanager
+    def track_request(self):
+        """Collect the timings of the work done in the block (and the threads started with its context)."""
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        try:
+            yield timings
+        finally:
+            _request_timings.reset(token)
+
+    def is_flush_due(self) -> bool:
+        return self.enabled and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self) -> None:
+        """Add the increments aggregated in the process to the Redis hash shared by all processes."""
+        client = UpstreamLimiter.get_redis_client()
+        self._last_flush = time.monotonic()
+        if client is None:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+        try:
+            pipeline = client.pipeline(transaction=False)
+            for key, value in pending.items():
+                pipeline.hincrbyfloat(self.key, key, value)
+            pipeline.execute()
+        except Exception:
+            logger.warning('Failed to flush metrics to Redis', exc_info=True)
+            with self._lock:
+                self._pending.update(pending)
+
+    def maybe_flush(self) -> None:
+        """Flush the aggregated increments if the flush interval has passed."""
+        if self.is_flush_due():
+            self.flush()
+
+    def get_samples(self) -> dict[str, float]:
+        """Get the values of all samples: the shared ones and the increments not flushed by the process yet."""
+        samples = Counter()
+        client = UpstreamLimiter.get_redis_client()
+        if client is not None:
+            samples.update({key.decode(): float(value) for key, value in client.hgetall(self.key).items()})
+        with self._lock:
+            samples.update(self._pending)
+        return samples
+
+    def render(self) -> str:
+        """Render the samples in the Prometheus text exposition format."""
+        samples_by_name = {}
+        for key, value in self.get_samples().items():
+            samples_by_name.setdefault(key.split('{', 1)[0], []).append((key, value))
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            names = (f'{name}_bucket', f'{name}_sum', f'{name}_count') if metric_type == 'histogram' else (name,)
+            samples = [sample for sample_name in names for sample in samples_by_name.get(sample_name, [])]
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+            lines += [f'{key.replace("{}", "")} {format_value(value)}'
+                      for key, value in sorted(samples, key=get_sample_sort_key)]
+        return '\n'.join(lines) + '\n'
+
+    def get_query_table(self, sql: str) -> str:
+        """Get the label of the table of an SQL query, `other` for the tables without a label."""
+        for table, label in self.query_tables.items():
+            if table in sql:
+                return label
+        return 'other'
+
+    def time_query(self, execute, sql, params, many, context):
+        """Database execute wrapper observing the duration of the queries."""
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.observe('weather_db_query_duration_seconds', time.perf_counter() - started_at, 'db',
+                         table=self.get_query_table(sql), operation=sql.split(None, 1)[0].upper())
+
+    def upstream_request(self, url: str) -> 'UpstreamRequest':
+        return UpstreamRequest(self, url.rsplit('/', 1)[-1])
+
+    def clear(self) -> None:
+        """Remove the samples of the process and the shared ones."""
+        with self._lock:
+            self._pending.clear()
+        client = UpstreamLimiter.get_redis_client()
+        if client is not None:
+            client.delete(self.key)
+
+
+class UpstreamRequest:
+    """Context manager recording the duration, status and body size of an external API request."""
+
+    def __init__(self, registry: WeatherMetrics, method: str):
+        self.registry = registry
+        self.method = method
+        self.status = 'error'
+        self.bytes = 0
+        self.chunks = 0
+
+    def __enter__(self) -> 'UpstreamRequest':
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        registry = self.registry
+        registry.observe('weather_api_request_duration_seconds', time.perf_counter() - self.started_at, 'upstream',
+                         method=self.method)
+        registry.inc('weather_api_requests_total', method=self.method, status=self.status)
+        registry.inc('weather_api_response_bytes_total', self.bytes, method=self.method)
+        registry.inc('weather_api_response_chunks_total', self.chunks, method=self.method)
+
+    def add_chunk(self, chunk: bytes) -> bytes:
+        self.chunks += 1
+        self.bytes += len(chunk)
+        return chunk
+
+    def wrap(self, stream: BinaryIO) -> 'CountingReader':
+        return CountingReader(stream, self)
+
+
+class CountingReader:
+    """File-like reader counting the chunks and bytes read from a stream."""
+
+    def __init__(self, stream: BinaryIO, upstream_request: UpstreamRequest):
+        self.stream = stream
+        self.upstream_request = upstream_request
+
+    def read(self, size: int | None = None) -> bytes:
+        return self.upstream_request.add_chunk(self.stream.read() if size is None else self.stream.read(size))
+
+
+class TimedTemplateResponse(TemplateResponse):
+    """Template response observing the duration of its rendering."""
+
+    @property
+    def rendered_content(self):
+        template_name = self.template_name if isinstance(self.template_name, str) else self.template_name[0]
+        with metrics.timer('weather_template_render_duration_seconds', 'render', template=template_name):
+            return super().rendered_content
+
+
+def format_labels(labels: dict) -> str:
+    return ','.join(f'{name}="{escape_label_value(value)}"' for name, value in sorted(labels.items()))
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def get_sample_sort_key(sample: tuple[str, float]) -> tuple:
+    """Sort the samples by the name and the labels, and the buckets of a histogram by their bounds."""
+    key = sample[0]
+    match = _LE_LABEL.search(key)
+    if match is None:
+        return key, 0.0
+    return _LE_LABEL.sub('', key, count=1), float(match.group(1))
+
+
+metrics = WeatherMetrics.from_settings()
+
+_task_started_at = {}
+
+
+def install_instrumentation(query_tables: dict[str, str]) -> None:
+    """Observe the database queries, labelling the tables of `query_tables` by their labels, and the Celery tasks."""
+    metrics.query_tables = query_tables
+    connection_created.connect(add_query_timer)
+    before_task_publish.connect(add_published_at)
+    task_prerun.connect(start_task_timer)
+    task_postrun.connect(observe_task)
+
+
+def add_query_timer(sender, connection, **kwargs) -> None:
+    if metrics.time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.time_query)
+
+
+def add_published_at(sender=None, headers=None, **kwargs) -> None:
+    """Add the publishing time to the headers of a task message, so the worker can measure the queue lag."""
+    if headers is not None:
+        headers.setdefault('weather_published_at', time.time())
+
+
+def start_task_timer(sender=None, task_id=None, task=None, **kwargs) -> None:
+    """Observe the queue lag of a task and start measuring its duration.
+
+    Tasks scheduled with an ETA are only expected to start at it, so their lag is measured from the ETA.
+    """
+    _task_started_at[task_id] = time.perf_counter()
+    published_at = getattr(task.request, 'weather_published_at', None)
+    if published_at is None:
+        return
+    eta = getattr(task.request, 'eta', None)
+    if eta:
+        published_at = max(published_at, datetime.datetime.fromisoformat(str(eta)).timestamp())
+    metrics.observe('weather_celery_task_queue_lag_seconds', max(time.time() - published_at, 0.0), task=task.name)
+
+
+def observe_task(sender=None, task_id=None, task=None, state=None, **kwargs) -> None:
+    """Observe the duration of a finished task and flush the metrics of the worker if the interval has passed."""
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        metrics.observe('weather_celery_task_duration_seconds', time.perf_counter() - started_at,
+                        task=task.name, state=state or 'UNKNOWN')
+    metrics.maybe_flush()
@@ -0,0 +1,110 @@
+import datetime
+import re
+
+from django.conf import settings
+from django.db import connection
+
+from ..models import WeatherData
+
+
+def add_months(date: datetime.date, months: int) -> datetime.date:
+    """Return the first day of the month that is `months` after the month of the date."""
+    year, month = divmod(date.month - 1 + months, 12)
+    return datetime.date(date.year + year, month + 1, 1)
+
+
+class WeatherDataPartitions:
+    """Class to maintain the monthly partitions of the weather data table on PostgreSQL.
+
+    Partitions are named `<table>_pYYYY_MM` and hold the dates of a single month. They are created for the whole
+    retention period and ahead of time, so a partition exists for any date that can be saved, and the partitions
+    older than the retention period are dropped as a whole instead of deleting rows one by one.
+    Dates out of the monthly partitions are kept in the default partition, whose expired rows are deleted.
+    On other databases the table is not partitioned and expired rows are deleted.
+    """
+
+    table = WeatherData._meta.db_table
+
+    def __init__(self, months_ahead: int, retention_days: int):
+        self.months_ahead = months_ahead
+        self.retention_days = retention_days
+
+    @classmethod
+    def from_settings(cls) -> 'WeatherDataPartitions':
+        """Create the maintainer configured by the `WEATHER_DATA_RETENTION` setting."""
+        retention_settings = settings.WEATHER_DATA_RETENTION
+        return cls(months_ahead=retention_settings['partitions_ahead_months'],
+                   retention_days=settings.WEATHER_API_LIMITS['history_days_limit'] + retention_settings['grace_days'])
+
+    @property
+    def is_partitioned(self) -> bool:
+        """Check whether the weather data table is partitioned."""
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [self.table])
+            return cursor.fetchone() is not None
+
+    def get_cutoff_date(self) -> datetime.date:
+        """Get the date before which weather data is not kept."""
+        return datetime.date.today() - datetime.timedelta(days=self.retention_days)
+
+    def maintain(self) -> dict:
+        """Create the partitions ahead of time and remove the expired data."""
+        if not self.is_partitioned:
+            deleted, _ = WeatherData.objects.filter(date__lt=self.get_cutoff_date()).delete()
+            return {'created': [], 'dropped': [], 'deleted_rows': deleted}
+        return {'created': self.create_partitions(), 'dropped': self.drop_expired_partitions(),
+                'deleted_rows': self.delete_expired_default_rows()}
+
+    def get_partitions(self) -> dict[datetime.date, str]:
+        """Get the names of the existing partitions by the first day of their month."""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass',
+                           [self.table])
+            names = [name for name, in cursor.fetchall()]
+        partitions = {}
+        for name in names:
+            match = re.fullmatch(rf'{self.table}_p(\d{{4}})_(\d{{2}})', name)
+            if match:
+                partitions[datetime.date(int(match[1]), int(match[2]), 1)] = name
+        return partitions
+
+    def create_partitions(self) -> list[str]:
+        """Create the missing partitions from the month of the cutoff date up to `months_ahead` months ahead.
+
+        The cutoff date precedes the history window, so a partition exists for any date that can be saved.
+        """
+        existing_months = self.get_partitions()
+        first_month = add_months(self.get_cutoff_date(), 0)
+        last_month = add_months(datetime.date.today(), self.months_ahead)
+        created = []
+        with connection.cursor() as cursor:
+            months_count = (last_month.year - first_month.year) * 12 + last_month.month - first_month.month
+            for months in range(months_count + 1):
+                month = add_months(first_month, months)
+                if month in existing_months:
+                    continue
+                name = f'{self.table}_p{month.year:04d}_{month.month:02d}'
+                cursor.execute(f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {self.table} '
+                               f'FOR VALUES FROM (%s) TO (%s)', [month, add_months(month, 1)])
+                created.append(name)
+        return created
+
+    def delete_expired_default_rows(self) -> int:
+        """Delete the expired rows of the default partition, which keeps the dates out of the monthly partitions."""
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {self.table}_default PARTITION OF {self.table} DEFAULT')
+            cursor.execute(f'DELETE FROM {self.table}_default WHERE date < %s', [self.get_cutoff_date()])
+            return cursor.rowcount
+
+    def drop_expired_partitions(self) -> list[str]:
+        """Drop the partitions whose whole month is older than the retention period."""
+        cutoff_date = self.get_cutoff_date()
+        dropped = []
+        with connection.cursor() as cursor:
+            for month, name in sorted(self.get_partitions().items()):
+                if add_months(month, 1) <= cutoff_date:
+                    cursor.execute(f'DROP TABLE {name}')
+                    dropped.append(name)
+        return dropped
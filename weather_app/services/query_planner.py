@@ -0,0 +1,123 @@
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.utils.functional import SimpleLazyObject
+
+from ..models import WeatherData
+from .coverage_index import LocationCoverage
+from .metrics import metrics
+from .day_weather import DayWeather
+
+
+class WeatherQueryPlan:
+    """Class to plan a weather data request against the data already stored in the database.
+
+    The dates of the user-defined range that are not stored are found by the coverage index of the location
+    without querying the database, and grouped into the minimal set of periods to fetch from the API.
+    Stored rows are loaded by a single query only when they are needed.
+    """
+
+    def __init__(self, data: dict, coverage: LocationCoverage | None = None):
+        self.data = data
+        if coverage is None:
+            coverage = WeatherData.get_coverage(data['location'].pk)
+        self.coverage = coverage
+        self.missing_periods = get_missing_periods(data['start_date'], data['end_date'], coverage)
+        self._stored_weather_data = None
+        metrics.inc('weather_query_plans_total',
+                    stored='all' if self.is_covered else 'part' if self.has_stored_data else 'none')
+
+    @classmethod
+    async def acreate(cls, data: dict) -> 'WeatherQueryPlan':
+        """Plan a weather data request getting the coverage of the location asynchronously."""
+        return cls(data, await sync_to_async(WeatherData.get_coverage)(data['location'].pk))
+
+    @property
+    def is_covered(self) -> bool:
+        """Check whether all the requested data is stored in the database."""
+        return not self.missing_periods
+
+    @property
+    def has_stored_data(self) -> bool:
+        """Check whether any of the requested data is stored in the database."""
+        return self.missing_periods != [{'start_date': self.data['start_date'], 'end_date': self.data['end_date']}]
+
+    def get_stored_expiry(self) -> float | None:
+        """Get the time until which the stored provisional rows of the range are served, None if all are final."""
+        return self.coverage.get_expiry(self.data['start_date'], self.data['end_date'])
+
+    @property
+    def stored_weather_data(self) -> list[DayWeather]:
+        """Stored rows of the date range, loaded on first access."""
+        if self._stored_weather_data is None:
+            self._stored_weather_data = (WeatherData.get_data_according_to_form(self.data) if self.has_stored_data
+                                         else [])
+        return self._stored_weather_data
+
+    async def aload_stored_weather_data(self) -> list[DayWeather]:
+        """Load the stored rows of the date range asynchronously."""
+        if self._stored_weather_data is None:
+            self._stored_weather_data = (await WeatherData.aget_data_according_to_form(self.data)
+                                         if self.has_stored_data else [])
+        return self._stored_weather_data
+
+    @classmethod
+    def load_stored_weather_data_of_plans(cls, plans: list['WeatherQueryPlan']) -> None:
+        """Load the stored rows of the plans of the same date range by a single query, without hourly curves."""
+        plans = cls.get_plans_to_load(plans)
+        if plans:
+            stored_weather_data = WeatherData.get_data_of_locations(
+                [plan.data['location'].pk for plan in plans], plans[0].data['start_date'], plans[0].data['end_date'])
+            for plan in plans:
+                plan._stored_weather_data = stored_weather_data[plan.data['location'].pk]
+
+    @classmethod
+    async def aload_stored_weather_data_of_plans(cls, plans: list['WeatherQueryPlan']) -> None:
+        """Load the stored rows of the plans of the same date range by a single query asynchronously."""
+        plans = cls.get_plans_to_load(plans)
+        if plans:
+            stored_weather_data = await WeatherData.aget_data_of_locations(
+                [plan.data['location'].pk for plan in plans], plans[0].data['start_date'], plans[0].data['end_date'])
+            for plan in plans:
+                plan._stored_weather_data = stored_weather_data[plan.data['location'].pk]
+
+    @staticmethod
+    def get_plans_to_load(plans: list['WeatherQueryPlan']) -> list['WeatherQueryPlan']:
+        """Get the plans with stored rows that are not loaded yet, the plans without stored rows get empty lists."""
+        plans_to_load = []
+        for plan in plans:
+            if plan._stored_weather_data is None:
+                if plan.has_stored_data:
+                    plans_to_load.append(plan)
+                else:
+                    plan._stored_weather_data = []
+        return plans_to_load
+
+    def get_lazy_stored_weather_data(self) -> SimpleLazyObject:
+        """Get the stored rows as a lazy object, so they are not loaded if a cached rendering is used."""
+        return SimpleLazyObject(lambda: self.stored_weather_data)
+
+    def merge(self, api_weather_days: list[DayWeather]) -> list[DayWeather]:
+        """Merge stored rows with the data fetched from the API for the missing periods in date order."""
+        if not self.stored_weather_data:
+            return api_weather_days
+        weather_data_by_date = {weather_data.date: weather_data for weather_data in api_weather_days}
+        for weather_data in self.stored_weather_data:
+            weather_data_by_date.setdefault(weather_data.date, weather_data)
+        return [weather_data_by_date[date] for date in sorted(weather_data_by_date)
+                if self.data['start_date'] <= date <= self.data['end_date']]
+
+
+def get_missing_periods(start_date: datetime.date, end_date: datetime.date,
+                        stored_dates: set[datetime.date] | LocationCoverage) -> list[dict]:
+    """Group the dates of a date range that are not stored into contiguous periods."""
+    missing_periods = []
+    date = start_date
+    while date <= end_date:
+        if date not in stored_dates:
+            if missing_periods and missing_periods[-1]['end_date'] == date - datetime.timedelta(days=1):
+                missing_periods[-1]['end_date'] = date
+            else:
+                missing_periods.append({'start_date': date, 'end_date': date})
+        date += datetime.timedelta(days=1)
+    return missing_periods
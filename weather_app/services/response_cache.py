@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class ResponseCache:
+    """Two-tier cache of external API responses.
+
+    The first tier is a bounded in-process LRU, the second one is the Django cache (Redis in production),
+    shared by all workers. Entries are keyed by the API method and the normalized query parameters.
+    Cached responses are shared between callers, so they must not be mutated.
+    The shared tier keeps the expiry time next to the response, so a response copied to the first tier
+    expires there together with the shared entry instead of living for another full timeout.
+
+    On a miss, identical concurrent requests are coalesced (single flight): only one of them is sent
+    to the API, while the others wait for its result. Threads of a process wait for an in-process flight,
+    other processes wait for the response to appear in the shared tier while a lock in the Django cache is held.
+    If the result does not appear within the wait timeout, the waiting caller fetches the response itself.
+    """
+
+    key_prefix = 'weather_api_response:v4'
+    ignored_params = ('key',)
+
+    def __init__(self, max_size: int, lock_timeout: int, wait_timeout: float, poll_interval: float):
+        self.max_size = max_size
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._local = OrderedDict()
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def get_or_fetch(self, api_method: str, params: dict, fetch: Callable[[], dict | list], timeout: int):
+        """Return the cached response for the request, fetching and caching it on a miss."""
+        key = self.get_key(api_method, params)
+        response = self.get_local(key)
+        if response is not None:
+            self.count('local_hit')
+            return response
+        response = self.copy_shared(key, cache.get(key))
+        if response is not None:
+            self.count('shared_hit')
+            return response
+        self.count('miss')
+        return self.fetch_once(key, fetch, timeout)
+
+    async def aget_or_fetch(self, api_method: str, params: dict, fetch: Callable[[], Awaitable[dict | list]],
+                            timeout: int):
+        """Return the cached response for the request asynchronously, fetching and caching it on a miss."""
+        key = self.get_key(api_method, params)
+        response = self.get_local(key)
+        if response is not None:
+            self.count('local_hit')
+            return response
+        response = self.copy_shared(key, await cache.aget(key))
+        if response is not None:
+            self.count('shared_hit')
+            return response
+        self.count('miss')
+        return await self.afetch_once(key, fetch, timeout)
+
+    def fetch_once(self, key: str, fetch: Callable[[], dict | list], timeout: int):
+        """Fetch the response once for all threads of the process requesting it at the same time."""
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = Flight()
+        if not is_leader:
+            self.count('coalesced')
+            if flight.done.wait(self.wait_timeout):
+                return flight.get_result()
+            self.count('wait_timeout')
+            return fetch()
+        try:
+            flight.response = self.fetch_shared(key, fetch, timeout)
+            return flight.response
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def fetch_shared(self, key: str, fetch: Callable[[], dict | list], timeout: int):
+        """Fetch the response once for all processes, holding a lock in the Django cache."""
+        lock_key = f'{key}:lock'
+        if not cache.add(lock_key, True, self.lock_timeout):
+            self.count('coalesced_shared')
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                response = self.copy_shared(key, cache.get(key))
+                if response is not None:
+                    return response
+                if not cache.get(lock_key):
+                    break
+            else:
+                self.count('wait_timeout')
+            response = fetch()
+            self.set(key, response, timeout)
+            return response
+        try:
+            response = fetch()
+            self.set(key, response, timeout)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    async def afetch_once(self, key: str, fetch: Callable[[], Awaitable[dict | list]], timeout: int):
+        """Fetch the response once for all tasks of the event loop requesting it at the same time."""
+        flight_key = (asyncio.get_running_loop(), key)
+        flight = self._async_flights.get(flight_key)
+        if flight is not None:
+            self.count('coalesced')
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight), self.wait_timeout)
+            except asyncio.TimeoutError:
+                self.count('wait_timeout')
+                return await fetch()
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                return await fetch()
+        flight = self._async_flights[flight_key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self.afetch_shared(key, fetch, timeout)
+            flight.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as error:
+            flight.set_exception(error)
+            flight.exception()
+            raise
+        finally:
+            del self._async_flights[flight_key]
+
+    async def afetch_shared(self, key: str, fetch: Callable[[], Awaitable[dict | list]], timeout: int):
+        """Fetch the response once for all processes asynchronously, holding a lock in the Django cache."""
+        lock_key = f'{key}:lock'
+        if not await cache.aadd(lock_key, True, self.lock_timeout):
+            self.count('coalesced_shared')
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                response = self.copy_shared(key, await cache.aget(key))
+                if response is not None:
+                    return response
+                if not await cache.aget(lock_key):
+                    break
+            else:
+                self.count('wait_timeout')
+            response = await fetch()
+            await self.aset(key, response, timeout)
+            return response
+        try:
+            response = await fetch()
+            await self.aset(key, response, timeout)
+            return response
+        finally:
+            await cache.adelete(lock_key)
+
+    def set(self, key: str, response: dict | list, timeout: int) -> None:
+        """Store the response in both cache tiers."""
+        cache.set(key, (time.time() + timeout, response), timeout)
+        self.set_local(key, response, timeout)
+
+    async def aset(self, key: str, response: dict | list, timeout: int) -> None:
+        """Store the response in both cache tiers asynchronously."""
+        await cache.aset(key, (time.time() + timeout, response), timeout)
+        self.set_local(key, response, timeout)
+
+    def copy_shared(self, key: str, entry: tuple[float, dict | list] | None) -> dict | list | None:
+        """Return the response of a shared tier entry, storing it in the first tier for the rest of its lifetime."""
+        if entry is None:
+            return None
+        expires_at, response = entry
+        remaining = expires_at - time.time()
+        if remaining > 0:
+            self.set_local(key, response, remaining)
+        return response
+
+    def invalidate(self, api_method: str, params: dict) -> None:
+        """Remove the cached response for the request from both cache tiers."""
+        key = self.get_key(api_method, params)
+        cache.delete(key)
+        with self._lock:
+            self._local.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all responses from the in-process cache tier and reset the counters."""
+        with self._lock:
+            self._local.clear()
+            self.stats.clear()
+
+    def get_local(self, key: str) -> dict | list | None:
+        """Return the response from the in-process cache tier if it has not expired yet."""
+        with self._lock:
+            cached = self._local.get(key)
+            if cached is None:
+                return None
+            expires_at, response = cached
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return response
+
+    def set_local(self, key: str, response: dict | list, timeout: float) -> None:
+        """Store the response in the in-process cache tier, evicting the least recently used entries."""
+        with self._lock:
+            self._local[key] = (time.monotonic() + timeout, response)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def count(self, event: str) -> None:
+        """Increment the counter of a cache event."""
+        with self._lock:
+            self.stats[event] += 1
+
+    def get_key(self, api_method: str, params: dict) -> str:
+        """Build a cache key from the API method and the normalized query parameters."""
+        normalized_params = '&'.join(f'{name}={str(value).strip().casefold()}'
+                                     for name, value in sorted(params.items()) if name not in self.ignored_params)
+        digest = hashlib.sha1(f'{api_method}?{normalized_params}'.encode()).hexdigest()
+        return f'{self.key_prefix}:{digest}'
+
+
+class Flight:
+    """Result slot of an in-process request that other threads wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+    def get_result(self):
+        """Return the response of the finished request or raise its error."""
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+response_cache = ResponseCache(**settings.WEATHER_RESPONSE_CACHE)
@@ -0,0 +1,83 @@
+import datetime
+import json
+from typing import BinaryIO
+
+import ijson
+
+from .day_weather import DayWeather
+
+DAY_PREFIX = 'forecast.forecastday.item'
+
+
+def parse_json_response(stream: BinaryIO) -> dict | list:
+    """Parse the whole JSON response."""
+    return json.load(stream)
+
+
+def parse_weather_response(stream: BinaryIO, include_hourly: bool = False) -> dict:
+    """Parse a history or forecast response incrementally, keeping only the fields used by the app.
+
+    The response stream is read event by event, so neither the whole JSON text nor the whole object tree
+    is built. The result keeps the scalar location fields and a `DayWeather` record per day
+    in the response shape: {'location': {...}, 'forecast': {'forecastday': [DayWeather, ...]}}.
+    Hourly temperatures are packed into the records if `include_hourly` is set, otherwise they are dropped.
+    """
+    return project_weather_events(ijson.parse(stream, use_float=True), include_hourly)
+
+
+async def aparse_weather_response(stream, include_hourly: bool = False) -> dict:
+    """Parse a history or forecast response incrementally from an asynchronous stream."""
+    builder = WeatherResponseBuilder(include_hourly)
+    async for prefix, event, value in ijson.parse_async(stream, use_float=True):
+        builder.send(prefix, event, value)
+    return builder.result
+
+
+def project_weather_events(events, include_hourly: bool) -> dict:
+    """Build the projected response from JSON parser events."""
+    builder = WeatherResponseBuilder(include_hourly)
+    for prefix, event, value in events:
+        builder.send(prefix, event, value)
+    return builder.result
+
+
+class WeatherResponseBuilder:
+    """Class to build a projected weather response from JSON parser events."""
+
+    day_fields = {f'{DAY_PREFIX}.day.{field}': field for field in DayWeather.DAY_FIELDS}
+    hourly_temp_prefix = f'{DAY_PREFIX}.hour.item.temp_c'
+
+    def __init__(self, include_hourly: bool):
+        self.include_hourly = include_hourly
+        self.location = {}
+        self.forecastdays = []
+        self.day = None
+        self.hourly_temp_c = None
+        self.result = {'location': self.location, 'forecast': {'forecastday': self.forecastdays}}
+
+    def send(self, prefix: str, event: str, value) -> None:
+        """Process a single parser event."""
+        if prefix.startswith('location.'):
+            if event in ('string', 'number', 'boolean', 'null'):
+                self.location[prefix[len('location.'):]] = value
+        elif prefix == DAY_PREFIX:
+            if event == 'start_map':
+                self.day = {}
+                self.hourly_temp_c = [] if self.include_hourly else None
+            elif event == 'end_map':
+                self.finish_day()
+        elif self.day is not None:
+            field = self.day_fields.get(prefix)
+            if field is not None:
+                self.day[field] = value
+            elif prefix == f'{DAY_PREFIX}.date':
+                self.day['date'] = datetime.date.fromisoformat(value)
+            elif self.hourly_temp_c is not None and prefix == self.hourly_temp_prefix:
+                self.hourly_temp_c.append(value)
+
+    def finish_day(self) -> None:
+        """Store the record of the day that has been parsed."""
+        if self.hourly_temp_c:
+            self.day['hourly_temp_c'] = self.hourly_temp_c
+        self.forecastdays.append(DayWeather(**self.day))
+        self.day = self.hourly_temp_c = None
@@ -0,0 +1,260 @@
+import asyncio
+import contextlib
+import contextvars
+import datetime
+import logging
+import math
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+
+class ApiPriority:
+    """Priority classes of external API requests, from the most to the least important."""
+
+    INTERACTIVE = 'interactive'
+    AUTOCOMPLETE = 'autocomplete'
+    BACKGROUND = 'background'
+
+
+_api_priority = contextvars.ContextVar('weather_api_priority', default=ApiPriority.INTERACTIVE)
+
+
+@contextlib.contextmanager
+def api_priority(priority: str):
+    """Send the external API requests made within the block with the priority."""
+    token = _api_priority.set(priority)
+    try:
+        yield
+    finally:
+        _api_priority.reset(token)
+
+
+def get_api_priority() -> str:
+    """Get the priority of the external API requests made in the current context."""
+    return _api_priority.get()
+
+
+class ApiConcurrencyLimit:
+    """Limit of the external API requests in flight, shared by the threads and the tasks of a block of work."""
+
+    def __init__(self, limit: int):
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.asemaphore = asyncio.Semaphore(limit)
+
+
+_api_concurrency_limit = contextvars.ContextVar('weather_api_concurrency_limit', default=None)
+
+
+@contextlib.contextmanager
+def api_concurrency_limit(limit: int):
+    """Allow at most `limit` external API requests in flight within the block.
+
+    The limit is shared with the threads started in a copy of the context of the block and with its tasks.
+    """
+    token = _api_concurrency_limit.set(ApiConcurrencyLimit(limit))
+    try:
+        yield
+    finally:
+        _api_concurrency_limit.reset(token)
+
+
+def get_api_concurrency_limit() -> ApiConcurrencyLimit | None:
+    """Get the limit of the external API requests in flight in the current context, if it is set."""
+    return _api_concurrency_limit.get()
+
+
+class UpstreamThrottled(Exception):
+    """Raised when an external API request is not allowed by the rate limit or the daily quota.
+
+    `retry_after` is the number of seconds after which the request may be granted.
+    """
+
+    def __init__(self, priority: str, reason: str, retry_after: float = 1):
+        super().__init__(f'External API request with {priority} priority is throttled by the {reason} limit')
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, min_tokens = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local quota_limit, priority, quota_ttl = tonumber(ARGV[4]), ARGV[5], tonumber(ARGV[6])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+if tonumber(redis.call('HGET', KEYS[2], 'used') or '0') >= quota_limit then
+    redis.call('HINCRBY', KEYS[2], 'rejected:' .. priority, 1)
+    redis.call('EXPIRE', KEYS[2], quota_ttl)
+    return {0, '-1'}
+end
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local granted = tokens >= min_tokens
+if granted then
+    tokens = tokens - 1
+    redis.call('HINCRBY', KEYS[2], 'used', 1)
+    redis.call('HINCRBY', KEYS[2], 'used:' .. priority, 1)
+    redis.call('EXPIRE', KEYS[2], quota_ttl)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+if granted then
+    return {1, '0'}
+end
+return {0, tostring((min_tokens - tokens) / rate)}
+"""
+
+
+class UpstreamLimiter:
+    """Token bucket limiting the external API requests of all processes sharing the API key.
+
+    The bucket is refilled at `requests_per_second` up to `burst` tokens. Priority classes are ordered
+    by the part of the bucket reserved for the more important ones: a request is only granted if
+    the reserve is left after taking its token, so interactive requests are served first when the bucket
+    runs low. The same way, each class may only use its share of the daily quota, so background jobs
+    throttle themselves long before the quota is exhausted for users.
+
+    The state is kept in Redis and updated atomically by a script when the Django cache is Redis,
+    otherwise it is kept in the process. Requests wait for a token up to the `max_wait` of their class.
+    """
+
+    key_prefix = 'weather_api_limiter'
+
+    def __init__(self, requests_per_second: float, burst: int, daily_quota: int, priorities: dict,
+                 enabled: bool = True):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.priorities = priorities
+        self.enabled = enabled
+        self.stats = Counter()
+        self._script = None
+        self._local_bucket = (float(burst), time.monotonic())
+        self._local_usage = (datetime.date.today(), Counter())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> 'UpstreamLimiter':
+        """Create the limiter configured by the `WEATHER_API_RATE_LIMIT` setting."""
+        return cls(**settings.WEATHER_API_RATE_LIMIT)
+
+    def acquire(self, priority: str) -> None:
+        """Wait for a token for an external API request, raising `UpstreamThrottled` if it is not granted."""
+        if not self.enabled:
+            return
+        deadline = time.monotonic() + self.priorities[priority]['max_wait']
+        while True:
+            wait = self.try_acquire(priority)
+            if wait is None:
+                return
+            self.check_wait(priority, wait, deadline)
+            time.sleep(wait)
+
+    async def aacquire(self, priority: str) -> None:
+        """Wait for a token for an external API request asynchronously."""
+        if not self.enabled:
+            return
+        deadline = time.monotonic() + self.priorities[priority]['max_wait']
+        while True:
+            wait = await sync_to_async(self.try_acquire, thread_sensitive=False)(priority)
+            if wait is None:
+                return
+            self.check_wait(priority, wait, deadline)
+            await asyncio.sleep(wait)
+
+    def check_wait(self, priority: str, wait: float, deadline: float) -> None:
+        """Raise `UpstreamThrottled` if the quota is exhausted or the token is not available before the deadline."""
+        if wait < 0:
+            self.count(f'rejected_quota:{priority}')
+            logger.warning('Daily quota of external API requests with %s priority is exhausted', priority)
+            tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+            raise UpstreamThrottled(priority, 'quota', (tomorrow - datetime.datetime.now()).total_seconds())
+        if time.monotonic() + wait > deadline:
+            self.count(f'rejected_rate:{priority}')
+            raise UpstreamThrottled(priority, 'rate', wait)
+        self.count(f'throttled:{priority}')
+
+    def try_acquire(self, priority: str) -> float | None:
+        """Take a token if it is allowed for the priority.
+
+        Returns None if the token is taken, the time to wait for it otherwise, or -1 if the quota is exhausted.
+        """
+        limits = self.priorities[priority]
+        min_tokens = 1 + limits['reserve'] * self.burst
+        quota_limit = int(self.daily_quota * limits['quota_share'])
+        client = self.get_redis_client()
+        if client is None:
+            wait = self.try_acquire_local(priority, min_tokens, quota_limit)
+        else:
+            if self._script is None:
+                self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+            granted, wait = self._script(
+                keys=[f'{self.key_prefix}:bucket', self.get_quota_key()],
+                args=[self.requests_per_second, self.burst, min_tokens, quota_limit, priority, 60 * 60 * 48],
+                client=client)
+            wait = None if granted else float(wait)
+        if wait is None:
+            self.count(f'granted:{priority}')
+        return wait
+
+    def try_acquire_local(self, priority: str, min_tokens: float, quota_limit: int) -> float | None:
+        """Take a token from the bucket of the process."""
+        with self._lock:
+            usage = self.get_local_usage()
+            if usage['used'] >= quota_limit:
+                usage[f'rejected:{priority}'] += 1
+                return -1
+            tokens, updated_at = self._local_bucket
+            now = time.monotonic()
+            tokens = min(self.burst, tokens + (now - updated_at) * self.requests_per_second)
+            if tokens < min_tokens:
+                self._local_bucket = (tokens, now)
+                return (min_tokens - tokens) / self.requests_per_second
+            self._local_bucket = (tokens - 1, now)
+            usage['used'] += 1
+            usage[f'used:{priority}'] += 1
+            return None
+
+    def get_usage(self) -> dict[str, int]:
+        """Get today's usage of the daily quota: requests used and rejected in total and by priority."""
+        client = self.get_redis_client()
+        if client is None:
+            with self._lock:
+                usage = dict(self.get_local_usage())
+        else:
+            usage = {field.decode(): int(value) for field, value in client.hgetall(self.get_quota_key()).items()}
+        return {'daily_quota': self.daily_quota, 'used': 0, **usage}
+
+    def get_local_usage(self) -> Counter:
+        """Get today's usage counters of the process, starting them anew on a new day."""
+        if self._local_usage[0] != datetime.date.today():
+            self._local_usage = (datetime.date.today(), Counter())
+        return self._local_usage[1]
+
+    def get_quota_key(self) -> str:
+        return f'{self.key_prefix}:quota:{datetime.date.today().isoformat()}'
+
+    @staticmethod
+    def get_redis_client():
+        """Get the client of the Redis server used by the Django cache, or None if the cache is not Redis."""
+        default_cache = caches['default']
+        if not isinstance(default_cache, RedisCache):
+            return None
+        return default_cache._cache.get_client(write=True)
+
+    def count(self, event: str) -> None:
+        """Increment the counter of a limiter event."""
+        with self._lock:
+            self.stats[event] += 1
+
+
+upstream_limiter = UpstreamLimiter.from_settings()
@@ -1,10 +1,27 @@
-import copy
+import asyncio
+import contextlib
+import contextvars
 import datetime
 import json
+import os
+import random
+import threading
+import weakref
+import httpx
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, BinaryIO, Callable
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from django.conf import settings
 
+from .day_weather import DayWeather
+from .metrics import UpstreamRequest, metrics
+from .response_cache import response_cache
+from .response_parser import aparse_weather_response, parse_json_response, parse_weather_response
+from .upstream_limiter import get_api_concurrency_limit, get_api_priority, upstream_limiter
+
 
 class WeatherDataProcessor:
     """Class to process weather data retrieval from an external API.
@@ -16,21 +33,67 @@ class WeatherDataProcessor:
         self.data = data
         self.forecast_weather_data, self.historical_weather_data = {}, {}
 
-    def get_weather_data_from_API(self) -> dict:
+    def get_weather_data_from_API(self, periods: list[dict] | None = None) -> dict:
         """Fetch weather data from an external API based on user input.
 
         Determines whether to fetch historical or forecast data, or both, based on user-defined date ranges.
+        If `periods` is given, only the data for these date periods within the user-defined range is fetched.
+        """
+        history_periods, forecast_data = self.classify_periods(periods)
+        if forecast_data:
+            self.forecast_weather_data = ForecastWeatherRetriever(forecast_data).get_data_from_API()
+        if history_periods:
+            self.historical_weather_data = HistoryWeatherRetriever(self.data).get_data_from_API(history_periods)
+        return {'historical_weather_data': self.historical_weather_data,
+                'forecast_weather_data': self.forecast_weather_data, }
+
+    async def aget_weather_data_from_API(self, periods: list[dict] | None = None) -> dict:
+        """Fetch weather data from an external API asynchronously based on user input.
+
+        Historical and forecast data are fetched concurrently when the date range includes both.
         """
-        if self.data['start_date'] > datetime.date.today():
-            self.forecast_weather_data = ForecastWeatherRetriever(self.data).get_data_from_API()
-        elif self.data['end_date'] <= datetime.date.today():
-            self.historical_weather_data = HistoryWeatherRetriever(self.data).get_data_from_API()
-        else:
-            self.forecast_weather_data = ForecastWeatherRetriever(self.data).get_data_from_API()
-            self.historical_weather_data = HistoryWeatherRetriever(self.data).get_data_from_API()
+        history_periods, forecast_data = self.classify_periods(periods)
+        retrievals = []
+        if forecast_data:
+            retrievals.append(ForecastWeatherRetriever(forecast_data).aget_data_from_API())
+        if history_periods:
+            retrievals.append(HistoryWeatherRetriever(self.data).aget_data_from_API(history_periods))
+        responses = await gather_in_order(retrievals)
+        if forecast_data:
+            self.forecast_weather_data = responses.pop(0)
+        if history_periods:
+            self.historical_weather_data = responses.pop(0)
         return {'historical_weather_data': self.historical_weather_data,
                 'forecast_weather_data': self.forecast_weather_data, }
 
+    @staticmethod
+    def get_weather_days(api_weather_data: dict) -> list[DayWeather]:
+        """Get the days of historical and forecast weather data fetched from the API as a single list in date order."""
+        weather_days = []
+        for weather_data_type in ('historical_weather_data', 'forecast_weather_data'):
+            if api_weather_data[weather_data_type]:
+                weather_days.extend(api_weather_data[weather_data_type]['forecast']['forecastday'])
+        return weather_days
+
+    def classify_periods(self, periods: list[dict] | None) -> tuple[list[dict], dict | None]:
+        """Classify date periods into historical periods and the user input for the forecast request.
+
+        If `periods` is not given, the user-defined date range is used.
+        """
+        if periods is None:
+            periods = [{'start_date': self.data['start_date'], 'end_date': self.data['end_date']}]
+        today = datetime.date.today()
+        history_periods = [{'start_date': period['start_date'], 'end_date': min(period['end_date'], today)}
+                           for period in periods if period['start_date'] <= today]
+        forecast_periods = [{'start_date': max(period['start_date'], today + datetime.timedelta(days=1)),
+                             'end_date': period['end_date']}
+                            for period in periods if period['end_date'] > today]
+        forecast_data = None
+        if forecast_periods:
+            forecast_data = {**self.data, 'start_date': forecast_periods[0]['start_date'],
+                             'end_date': forecast_periods[-1]['end_date']}
+        return history_periods, forecast_data
+
 
 class AbstractWeatherAPIRetriever:
     """Abstract class for fetching data from an external API.
@@ -42,25 +105,109 @@ class AbstractWeatherAPIRetriever:
     api_url = settings.WEATHER_API_URL
     api_method = None
     api_language_code = settings.WEATHER_API_LANGUAGE_CODE
+    cache_timeout = None
 
-    def __init__(self, data: dict):
+    def __init__(self, data: dict, priority: str | None = None):
         self.data = data
+        self.priority = priority or get_api_priority()
 
     def get_response(self) -> dict:
-        """Send a request to the external API and return the response."""
+        """Send a request to the external API and return the response.
+
+        Responses are cached by `response_cache`, so the same request is sent once per cache timeout.
+        Requests sent on a miss are limited by `upstream_limiter` according to the priority of the retriever,
+        taken from the current context (see `api_priority`) if it is not given.
+        """
+        query_params = self.get_query_params()
+        response = response_cache.get_or_fetch(
+            self.api_method, query_params, lambda: self.fetch_response(query_params),
+            self.get_cache_timeout(query_params))
+        return response
+
+    def fetch_response(self, query_params: dict | None = None) -> dict:
+        """Send a request to the external API bypassing the response cache once the rate limit allows it.
+
+        If a concurrency limit is set for the current context (see `api_concurrency_limit`), the request
+        waits for its turn first.
+        """
+        if query_params is None:
+            query_params = self.get_query_params()
+        concurrency_limit = get_api_concurrency_limit()
+        with contextlib.nullcontext() if concurrency_limit is None else concurrency_limit.semaphore:
+            upstream_limiter.acquire(self.priority)
+            return request_to_api(self.api_url + self.api_method, query_params, self.parse_response)
+
+    async def afetch_response(self, query_params: dict | None = None) -> dict:
+        """Send a request to the external API asynchronously bypassing the response cache."""
+        if query_params is None:
+            query_params = self.get_query_params()
+        concurrency_limit = get_api_concurrency_limit()
+        async with contextlib.nullcontext() if concurrency_limit is None else concurrency_limit.asemaphore:
+            await upstream_limiter.aacquire(self.priority)
+            return await arequest_to_api(self.api_url + self.api_method, query_params, self.aparse_response)
+
+    async def aget_response(self) -> dict:
+        """Send a request to the external API asynchronously and return the response."""
         query_params = self.get_query_params()
-        response = request_to_api(self.api_url + self.api_method, query_params)
+        response = await response_cache.aget_or_fetch(
+            self.api_method, query_params, lambda: self.afetch_response(query_params),
+            self.get_cache_timeout(query_params))
         return response
 
+    def parse_response(self, stream: BinaryIO) -> dict | list:
+        """Parse the body of the API response."""
+        return parse_json_response(stream)
+
+    async def aparse_response(self, stream: 'AsyncResponseStream') -> dict | list:
+        """Parse the body of the API response read asynchronously."""
+        return json.loads(await stream.read())
+
+    def get_cache_timeout(self, query_params: dict) -> int:
+        """Define how long the API response for the query parameters is cached."""
+        return self.cache_timeout
+
     def get_query_params(self) -> dict:
         """Define query parameters for the API request."""
         query_params = {'key': self.api_key,
-                        'q': self.data['city'],
+                        'q': self.get_location_query(),
                         'lang': self.api_language_code}
         return query_params
 
+    def get_location_query(self) -> str:
+        """Define the location for the API request.
+
+        The canonical location resolved by the form is preferred over the raw user input.
+        """
+        location = self.data.get('location')
+        if location is None:
+            return self.data['city']
+        return location.api_query
+
+
+class AbstractDailyWeatherRetriever(AbstractWeatherAPIRetriever):
+    """Abstract class for fetching daily weather data from an external API.
+
+    Responses are parsed incrementally into `DayWeather` records, hourly data is kept only if
+    `include_hourly` is set. The time of the request is stored in the response as `fetched_at`,
+    so it is known for cached responses as well.
+    """
+
+    include_hourly = settings.WEATHER_API_INCLUDE_HOURLY
+
+    def parse_response(self, stream: BinaryIO) -> dict:
+        """Parse the response stream keeping only the fields used by the app."""
+        response = parse_weather_response(stream, self.include_hourly)
+        response['fetched_at'] = datetime.datetime.now().isoformat()
+        return response
+
+    async def aparse_response(self, stream: 'AsyncResponseStream') -> dict:
+        """Parse the asynchronous response stream keeping only the fields used by the app."""
+        response = await aparse_weather_response(stream, self.include_hourly)
+        response['fetched_at'] = datetime.datetime.now().isoformat()
+        return response
 
-class HistoryWeatherRetriever(AbstractWeatherAPIRetriever):
+
+class HistoryWeatherRetriever(AbstractDailyWeatherRetriever):
     """Class for fetching historical weather data from an external API.
 
     Retrieves historical weather data within a given date range.
@@ -68,35 +215,93 @@ class HistoryWeatherRetriever(AbstractWeatherAPIRetriever):
 
     api_method = settings.WEATHER_API_METHOD['history']
     max_days_range = settings.WEATHER_API_LIMITS['max_days_range_for_history_request']
+    max_concurrent_requests = settings.WEATHER_API_LIMITS['max_concurrent_requests']
+    cache_timeout = settings.WEATHER_CACHE_TIMEOUTS['history']
 
-    def get_data_from_API(self):
+    def get_data_from_API(self, periods: list[dict] | None = None) -> dict:
         """Fetch historical weather data from the API, considering API's evening behavior.
 
         This method retrieves historical weather data within the specified date range,
         accounting for the API's behavior. In the evening, the API provides weather data
         for the next day in historical data. Therefore, if the end date is greater than today,
         it's adjusted to today's date.
+        If `periods` is given, the data is retrieved only for these date periods.
+        """
+        response_list = self.get_combined_response(self.get_subperiod_list(periods))
+        return self.merge_responses(response_list)
+
+    async def aget_data_from_API(self, periods: list[dict] | None = None) -> dict:
+        """Fetch historical weather data from the API asynchronously."""
+        response_list = await self.aget_combined_response(self.get_subperiod_list(periods))
+        return self.merge_responses(response_list)
+
+    def get_subperiod_list(self, periods: list[dict] | None) -> list[dict]:
+        """Split the date periods into subperiods supported by a single API request."""
+        if periods is None:
+            periods = [{'start_date': self.data['start_date'], 'end_date': self.data['end_date']}]
+        subperiod_list = []
+        for period in periods:
+            end_date = min(period['end_date'], datetime.date.today())
+            subperiod_list += split_data_period(period['start_date'], end_date, self.max_days_range)
+        return subperiod_list
+
+    @staticmethod
+    def merge_responses(response_list: list[dict]) -> dict:
+        """Merge the responses for subperiods into a single response without mutating them.
+
+        The merged response is considered fetched when its oldest part was fetched.
+        """
+        forecastdays = []
+        for response in response_list:
+            forecastdays.extend(response['forecast']['forecastday'])
+        fetched_at = min((response['fetched_at'] for response in response_list if response.get('fetched_at')),
+                         default=None)
+        return {**response_list[0], 'fetched_at': fetched_at,
+                'forecast': {**response_list[0]['forecast'], 'forecastday': forecastdays}}
+
+    def get_combined_response(self, subperiod_list: list[dict]) -> list[dict]:
+        """Fetch historical weather data for multiple subperiods concurrently.
+
+        Each subperiod is requested by its own retriever in a bounded thread pool,
+        in a copy of the current context, so the priority and the request timings are kept.
+        Responses are returned in the order of `subperiod_list`, so the merged data stays chronological.
+        If any request fails, the exception of the earliest failed subperiod is raised
+        and the subperiods that have not started yet are cancelled.
+        """
+        if len(subperiod_list) == 1:
+            return [self.get_subperiod_response(subperiod_list[0])]
+        max_workers = min(self.max_concurrent_requests, len(subperiod_list))
+        contexts = [contextvars.copy_context() for _ in subperiod_list]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda context, subperiod: context.run(self.get_subperiod_response, subperiod),
+                                     contexts, subperiod_list))
+
+    def get_subperiod_response(self, subperiod: dict) -> dict:
+        """Fetch historical weather data for a single subperiod."""
+        return self.__class__({**self.data, **subperiod}, self.priority).get_response()
+
+    async def aget_combined_response(self, subperiod_list: list[dict]) -> list[dict]:
+        """Fetch historical weather data for multiple subperiods concurrently on the event loop.
+
+        At most `max_concurrent_requests` requests are in flight; the order and failure handling
+        are the same as in `get_combined_response`.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+        async def aget_subperiod_response(subperiod: dict) -> dict:
+            async with semaphore:
+                return await self.__class__({**self.data, **subperiod}, self.priority).aget_response()
+
+        return await gather_in_order([aget_subperiod_response(subperiod) for subperiod in subperiod_list])
+
+    def get_cache_timeout(self, query_params: dict) -> int:
+        """Define how long historical weather data is cached.
+
+        Data of past days never changes, while data of today is still being updated.
         """
-        data = copy.deepcopy(self.data)
-        if data['end_date'] > datetime.date.today():
-            data['end_date'] = datetime.date.today()
-        subperiod_list = split_data_period(data['start_date'], data['end_date'], self.max_days_range)
-        response_list = self.get_combined_response(subperiod_list)
-        result_response = response_list[0]
-        if len(response_list) > 1:
-            for i in range(1, len(response_list)):
-                result_response['forecast']['forecastday'].extend(response_list[i]['forecast']['forecastday'])
-        return result_response
-
-    def get_combined_response(self, subperiod_list: list[dict]):
-        """Fetch historical weather data for multiple subperiods."""
-        combined_response = []
-        for subperiod in subperiod_list:
-            self.data['start_date'] = subperiod['start_date']
-            self.data['end_date'] = subperiod['end_date']
-            response = self.get_response()
-            combined_response.append(response)
-        return combined_response
+        if query_params['end_dt'] < datetime.date.today():
+            return self.cache_timeout
+        return settings.WEATHER_CACHE_TIMEOUTS['history_today']
 
     def get_query_params(self) -> dict:
         """Define query parameters specific to historical weather data."""
@@ -106,7 +311,7 @@ class HistoryWeatherRetriever(AbstractWeatherAPIRetriever):
         return query_params
 
 
-class ForecastWeatherRetriever(AbstractWeatherAPIRetriever):
+class ForecastWeatherRetriever(AbstractDailyWeatherRetriever):
     """Class for fetching forecast weather data from an external API.
 
     Retrieves forecast weather data within a given date range.
@@ -114,6 +319,7 @@ class ForecastWeatherRetriever(AbstractWeatherAPIRetriever):
 
     api_method = settings.WEATHER_API_METHOD['forecast']
     api_limit = settings.WEATHER_API_LIMITS['forecast_days_limit']
+    cache_timeout = settings.WEATHER_CACHE_TIMEOUTS['forecast']
 
     def get_data_from_API(self) -> dict:
         """Fetch forecast weather data from the API based on user input.
@@ -121,24 +327,42 @@ class ForecastWeatherRetriever(AbstractWeatherAPIRetriever):
         The API allows querying data for a specific number of days starting from today.
         To accommodate this limitation, the method fetches data for the entire available period
         and then filters it to provide the data relevant to the user's specified date range.
-        This ensures that the user gets the data they requested."""
+        This ensures that the user gets the data they requested.
+        The entire period is cached, so the forecast is fetched once per city and sliced for every range."""
         response = self.get_response()
         return self.date_filter(response)
 
+    async def aget_data_from_API(self) -> dict:
+        """Fetch forecast weather data from the API asynchronously based on user input."""
+        response = await self.aget_response()
+        return self.date_filter(response)
+
     def date_filter(self, response: dict) -> dict:
         """Filter forecast weather data based on the user-defined date range.
 
         This method takes the raw forecast weather data from the API and filters it
         to retain only the data that falls within the user-specified date range.
+        Forecast days are consecutive, so the range is cut out by slice bounds computed from the first date.
+        The cached response is left untouched; a filtered copy is returned.
         """
         forecastdays = response['forecast']['forecastday']
         filtered_forecast = []
-        for day in forecastdays:
-            date = datetime.datetime.strptime(day['date'], "%Y-%m-%d").date()
-            if self.data['start_date'] <= date <= self.data['end_date'] and datetime.date.today() < date:
-                filtered_forecast.append(day)
-        response['forecast']['forecastday'] = filtered_forecast
-        return response
+        if forecastdays:
+            first_date = forecastdays[0].date
+            start_date = max(self.data['start_date'], datetime.date.today() + datetime.timedelta(days=1))
+            start = max((start_date - first_date).days, 0)
+            end = max((self.data['end_date'] - first_date).days + 1, start)
+            filtered_forecast = forecastdays[start:end]
+        return {**response, 'forecast': {**response['forecast'], 'forecastday': filtered_forecast}}
+
+    def get_cache_timeout(self, query_params: dict) -> int:
+        """Define how long forecast weather data is cached.
+
+        The forecast starts from today, so it is not cached past midnight.
+        """
+        now = datetime.datetime.now()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        return min(self.cache_timeout, int((midnight - now).total_seconds()) + 1)
 
     def get_query_params(self) -> dict:
         """Define query parameters specific to forecast weather data."""
@@ -151,6 +375,7 @@ class CitySearcher(AbstractWeatherAPIRetriever):
     """Class to search for city names and retrieve city-related data from an external API."""
 
     api_method = settings.WEATHER_API_METHOD['search']
+    cache_timeout = settings.WEATHER_CACHE_TIMEOUTS['search']
 
     def get_data_from_API(self) -> dict:
         """Fetch city name suggestions based on user input.
@@ -160,6 +385,10 @@ class CitySearcher(AbstractWeatherAPIRetriever):
         """
         return self.get_response()
 
+    async def aget_data_from_API(self) -> dict:
+        """Fetch city name suggestions asynchronously based on user input."""
+        return await self.aget_response()
+
 
 def split_data_period(start_date: datetime.date, end_date: datetime.date, interval_in_day: int) -> list[dict]:
     """Split a date range into subperiods based on a specified interval."""
@@ -175,10 +404,153 @@ def split_data_period(start_date: datetime.date, end_date: datetime.date, interv
     return subperiod_list
 
 
-def request_to_api(url: str, params: dict):
-    """Send a request to an external API and return the response"""
-    response = requests.get(url, params)
-    if response.status_code == 200:
-        return json.loads(response.text)
-    else:
-        raise response.raise_for_status()
+async def gather_in_order(coroutines: list) -> list:
+    """Run coroutines concurrently and return their results in the same order.
+
+    If any coroutine fails, the exception of the earliest failed one is raised and the rest are cancelled.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return [await task for task in tasks]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Return the shared HTTP session of the current process.
+
+    The session keeps connections to the external API alive in a pool and retries
+    requests that failed with 429/5xx statuses using jittered exponential backoff.
+    A new session is created after fork, so worker processes never share sockets.
+    """
+    global _http_session, _http_session_pid
+    if _http_session is None or _http_session_pid != os.getpid():
+        with _http_session_lock:
+            if _http_session is None or _http_session_pid != os.getpid():
+                _http_session = create_http_session()
+                _http_session_pid = os.getpid()
+    return _http_session
+
+
+def create_http_session() -> requests.Session:
+    """Create an HTTP session configured by the `WEATHER_API_HTTP` setting."""
+    http_settings = settings.WEATHER_API_HTTP
+    retry = Retry(total=http_settings['max_retries'],
+                  backoff_factor=http_settings['backoff_factor'],
+                  backoff_jitter=http_settings['backoff_jitter'],
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=('GET',),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=http_settings['pool_connections'],
+                          pool_maxsize=http_settings['pool_maxsize'],
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def request_to_api(url: str, params: dict, parse: Callable[[BinaryIO], dict | list] = parse_json_response):
+    """Send a request to an external API and return the response parsed from the streamed body.
+
+    The duration, the status and the size of the body are recorded by `metrics`.
+    """
+    http_settings = settings.WEATHER_API_HTTP
+    timeout = (http_settings['connect_timeout'], http_settings['read_timeout'])
+    with metrics.upstream_request(url) as upstream_request:
+        with get_http_session().get(url, params=params, stream=True, timeout=timeout) as response:
+            upstream_request.status = response.status_code
+            if response.status_code == 200:
+                response.raw.decode_content = True
+                return parse(upstream_request.wrap(response.raw))
+            else:
+                raise response.raise_for_status()
+
+
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+async def get_async_http_client() -> httpx.AsyncClient:
+    """Return the shared asynchronous HTTP client of the running event loop.
+
+    The client keeps connections to the external API alive in a pool sized for many in-flight requests.
+    It is closed when the event loop shuts down its asynchronous generators before being closed,
+    as `asyncio.run`, `async_to_sync` and ASGI servers do, so connections are not left open by discarded loops.
+    """
+    loop = asyncio.get_running_loop()
+    client, _ = _async_http_clients.get(loop, (None, None))
+    if client is None:
+        http_settings = settings.WEATHER_API_HTTP
+        limits = httpx.Limits(max_connections=http_settings['async_max_connections'],
+                              max_keepalive_connections=http_settings['async_max_connections'])
+        timeout = httpx.Timeout(http_settings['read_timeout'], connect=http_settings['connect_timeout'])
+        client = httpx.AsyncClient(timeout=timeout, transport=httpx.AsyncHTTPTransport(limits=limits, retries=1))
+        closer = close_with_event_loop(client)
+        _async_http_clients[loop] = client, closer
+        await anext(closer)
+    return client
+
+
+async def close_with_event_loop(client: httpx.AsyncClient):
+    """Keep the client open until the event loop finalizes this asynchronous generator on its shutdown."""
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def arequest_to_api(url: str, params: dict,
+                          parse: Callable[['AsyncResponseStream'], Awaitable[dict | list]] | None = None):
+    """Send a request to an external API asynchronously and return the response parsed from the streamed body.
+
+    Requests that failed with 429/5xx statuses are retried using jittered exponential backoff.
+    """
+    http_settings = settings.WEATHER_API_HTTP
+    params = {name: str(value) for name, value in params.items()}
+    client = await get_async_http_client()
+    for attempt in range(http_settings['max_retries'] + 1):
+        with metrics.upstream_request(url) as upstream_request:
+            async with client.stream('GET', url, params=params) as response:
+                upstream_request.status = response.status_code
+                if response.status_code == 200:
+                    stream = AsyncResponseStream(response, upstream_request)
+                    return await parse(stream) if parse else json.loads(await stream.read())
+                if response.status_code not in RETRY_STATUSES or attempt == http_settings['max_retries']:
+                    await response.aread()
+                    raise response.raise_for_status()
+        await asyncio.sleep(http_settings['backoff_factor'] * 2 ** attempt
+                            + random.uniform(0, http_settings['backoff_jitter']))
+
+
+class AsyncResponseStream:
+    """Asynchronous file-like reader of a streamed response body."""
+
+    def __init__(self, response: httpx.Response, upstream_request: UpstreamRequest | None = None):
+        self._chunks = response.aiter_bytes()
+        self.upstream_request = upstream_request
+        self._buffer = b''
+        self._exhausted = False
+
+    async def read(self, size: int = -1) -> bytes:
+        """Read up to `size` bytes of the body, or the rest of it if `size` is negative."""
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            try:
+                chunk = await self._chunks.__anext__()
+                if self.upstream_request is not None:
+                    self.upstream_request.add_chunk(chunk)
+                self._buffer += chunk
+            except StopAsyncIteration:
+                self._exhausted = True
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
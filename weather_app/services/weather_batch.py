@@ -0,0 +1,115 @@
+import contextvars
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from ..models import Location, WeatherData
+from .day_weather import DayWeather
+from .query_planner import WeatherQueryPlan
+from .upstream_limiter import api_concurrency_limit
+from .weather_api_service import WeatherDataProcessor, gather_in_order
+
+
+class WeatherBatch:
+    """Class to get weather data of many locations for the same date range in a columnar layout.
+
+    Locations whose data is fully stored are served from the database by a single query together
+    with the stored parts of the others. The missing periods are fetched by `WeatherDataProcessor`
+    for all locations concurrently, with at most `max_concurrent_requests` external API requests
+    in flight for the whole batch, however the periods are split into subperiods.
+    The fetched data is kept in `fetched` for the caller to save.
+    """
+
+    def __init__(self, locations: list[Location], start_date: datetime.date, end_date: datetime.date,
+                 fields: list[str], max_concurrent_requests: int):
+        self.locations = locations
+        self.start_date = start_date
+        self.end_date = end_date
+        self.fields = fields
+        self.max_concurrent_requests = max_concurrent_requests
+        self.fetched = []
+
+    @classmethod
+    def from_settings(cls, locations: list[Location], start_date: datetime.date, end_date: datetime.date,
+                      fields: list[str] | None = None) -> 'WeatherBatch':
+        """Create the batch configured by the `WEATHER_BATCH_API` setting, with all the metrics by default."""
+        return cls(locations, start_date, end_date, fields or list(WeatherData.METRIC_FIELDS),
+                   max_concurrent_requests=settings.WEATHER_BATCH_API['max_concurrent_requests'])
+
+    def get_data(self) -> dict:
+        """Get the weather data of the locations, fetching the missing periods from the API."""
+        plans = [WeatherQueryPlan(self.get_query_data(location)) for location in self.locations]
+        api_weather_data = self.fetch([plan for plan in plans if not plan.is_covered])
+        WeatherQueryPlan.load_stored_weather_data_of_plans(plans)
+        return self.get_columns(plans, api_weather_data)
+
+    async def aget_data(self) -> dict:
+        """Get the weather data of the locations asynchronously, fetching the missing periods on the event loop."""
+        plans = [await WeatherQueryPlan.acreate(self.get_query_data(location)) for location in self.locations]
+        api_weather_data = await self.afetch([plan for plan in plans if not plan.is_covered])
+        await WeatherQueryPlan.aload_stored_weather_data_of_plans(plans)
+        return self.get_columns(plans, api_weather_data)
+
+    def get_query_data(self, location: Location) -> dict:
+        return {'location': location, 'city': location.name, 'start_date': self.start_date, 'end_date': self.end_date}
+
+    def fetch(self, plans: list[WeatherQueryPlan]) -> dict[int, dict]:
+        """Fetch the missing periods of the plans concurrently in a thread pool under the shared concurrency limit.
+
+        The threads run in copies of the current context, so the limit (and the request priority) are shared.
+        """
+        if not plans:
+            return {}
+        with api_concurrency_limit(self.max_concurrent_requests), \
+                ThreadPoolExecutor(max_workers=min(self.max_concurrent_requests, len(plans))) as executor:
+            contexts = [contextvars.copy_context() for _ in plans]
+            api_weather_data = list(executor.map(
+                lambda context, plan: context.run(WeatherDataProcessor(plan.data).get_weather_data_from_API,
+                                                  plan.missing_periods),
+                contexts, plans))
+        return self.add_fetched(plans, api_weather_data)
+
+    async def afetch(self, plans: list[WeatherQueryPlan]) -> dict[int, dict]:
+        """Fetch the missing periods of the plans concurrently on the event loop under the shared concurrency limit."""
+        with api_concurrency_limit(self.max_concurrent_requests):
+            api_weather_data = await gather_in_order([
+                WeatherDataProcessor(plan.data).aget_weather_data_from_API(plan.missing_periods) for plan in plans])
+        return self.add_fetched(plans, api_weather_data)
+
+    def add_fetched(self, plans: list[WeatherQueryPlan], api_weather_data: list[dict]) -> dict[int, dict]:
+        """Keep the fetched data with its periods for saving and map it by the location."""
+        self.fetched += [(plan.data['location'].pk, data, plan.missing_periods)
+                         for plan, data in zip(plans, api_weather_data)]
+        return {plan.data['location'].pk: data for plan, data in zip(plans, api_weather_data)}
+
+    def get_columns(self, plans: list[WeatherQueryPlan], api_weather_data: dict[int, dict]) -> dict:
+        """Lay out the data as a list of dates and arrays of the values of each metric by location.
+
+        Values of the dates without data are None.
+        """
+        days_count = (self.end_date - self.start_date).days + 1
+        dates = [self.start_date + datetime.timedelta(days=i) for i in range(days_count)]
+        locations = []
+        for plan in plans:
+            location = plan.data['location']
+            location_name = str(location)
+            if location.pk in api_weather_data:
+                days = plan.merge(WeatherDataProcessor.get_weather_days(api_weather_data[location.pk]))
+                location_name = WeatherData.get_api_location_name(api_weather_data[location.pk]) or location_name
+            else:
+                days = plan.stored_weather_data
+            locations.append({'id': location.pk, 'name': location_name, 'values': self.get_values(dates, days)})
+        return {'start_date': self.start_date.isoformat(), 'end_date': self.end_date.isoformat(),
+                'dates': [date.isoformat() for date in dates], 'locations': locations}
+
+    def get_values(self, dates: list[datetime.date], days: list[DayWeather]) -> dict[str, list]:
+        index = {date: i for i, date in enumerate(dates)}
+        values = {field: [None] * len(dates) for field in self.fields}
+        day_fields = [(values[field], WeatherData.METRIC_FIELDS[field]) for field in self.fields]
+        for day in days:
+            i = index.get(day.date)
+            if i is not None:
+                for field_values, day_field in day_fields:
+                    field_values[i] = getattr(day, day_field)
+        return values
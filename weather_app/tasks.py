@@ -1,12 +1,126 @@
+import datetime
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from celery.signals import worker_process_shutdown
+
 from Weather.celery import app
-from weather_app.models import WeatherData
+from weather_app.models import Location, WeatherData, WeatherQueryLog
+from weather_app.services.batch_writer import WeatherDataBatchWriter
+from weather_app.services.partitions import WeatherDataPartitions
+from weather_app.services.upstream_limiter import ApiPriority, api_priority
+from weather_app.services.weather_api_service import WeatherDataProcessor
+
+logger = logging.getLogger(__name__)
+
+PREWARM_REQUESTS_PER_LOCATION = 2
+
+batch_writer = WeatherDataBatchWriter(**settings.WEATHER_BATCH_WRITER)
 
 
 @app.task
-def save_api_weather_data(api_weather_data: dict) -> None:
+def save_api_weather_data(rows: list, local_names: dict | None = None) -> None:
     """A Celery task for save weather data to DB.
 
-    This Celery task is responsible for saving weather data received from
-    an external API to the database using the `WeatherData.save_api_weather_data` method.
+    This Celery task is responsible for saving compact rows with the daily metrics and the hourly temperature
+    curve (see `WeatherData.ROW_FIELDS`) extracted from an external API response.
+    Rows of many tasks are buffered by the worker process and saved to the database in batches.
+    """
+    local_names = {int(location_id): name for location_id, name in (local_names or {}).items()}
+    batch_writer.add(rows, local_names)
+
+
+@worker_process_shutdown.connect
+def flush_batch_writer(**kwargs) -> None:
+    """Save the rows buffered by the worker process before it exits."""
+    batch_writer.flush()
+
+
+def delay_save_api_weather_data(api_weather_data: dict, location_id: int, periods: list[dict]) -> None:
+    """Start the task for saving weather data unless the same periods of the location have just been queued.
+
+    Concurrent requests for the same location fetch the same data, so it is saved only once.
+    Only the compact rows are sent through the broker instead of the whole API response.
+    """
+    delay_save_api_weather_data_batch([(location_id, api_weather_data, periods)])
+
+
+def delay_save_api_weather_data_batch(batch: list[tuple[int, dict, list[dict]]]) -> None:
+    """Start a single task for saving weather data of many locations given as (location id, data, periods).
+
+    Locations whose periods have just been queued are skipped. If the task cannot be queued,
+    the periods are released, so the next request queues them again.
+    """
+    rows, local_names, keys = [], {}, []
+    for location_id, api_weather_data, periods in batch:
+        periods_key = ','.join(f"{period['start_date']}:{period['end_date']}" for period in periods)
+        key = 'save_api_weather_data:' + hashlib.sha1(f'{location_id}|{periods_key}'.encode()).hexdigest()
+        if cache.add(key, True, settings.WEATHER_SAVE_TASK_DEDUPLICATION_TIMEOUT):
+            keys.append(key)
+            rows += WeatherData.compact_api_weather_data(api_weather_data, location_id)
+            local_name = WeatherData.get_api_location_name(api_weather_data)
+            if local_name:
+                local_names[location_id] = local_name
+    if rows or local_names:
+        try:
+            save_api_weather_data.delay(rows, local_names)
+        except Exception:
+            cache.delete_many(keys)
+            raise
+
+
+@app.task
+def prewarm_popular_locations() -> None:
+    """A Celery beat task for fetching weather data of popular locations in advance.
+
+    The most requested locations are taken from `WeatherQueryLog`. For each of them the forecast
+    and the previous day's history are fetched into the response cache and saved to DB,
+    so popular requests are served without waiting for the external API.
+    The number of locations is limited by the API request quota of a single run.
+    Rows of the log older than the days it is counted for are deleted first.
+    """
+    prewarm_settings = settings.WEATHER_PREWARM
+    WeatherQueryLog.delete_expired(prewarm_settings['query_log_days'])
+    max_locations = prewarm_settings['max_api_requests'] // PREWARM_REQUESTS_PER_LOCATION
+    locations = WeatherQueryLog.get_popular_locations(min(prewarm_settings['top_locations'], max_locations),
+                                                      prewarm_settings['query_log_days'])
+    with ThreadPoolExecutor(max_workers=prewarm_settings['max_concurrent_requests']) as executor:
+        for location, api_weather_data in zip(locations, executor.map(fetch_prewarm_data, locations)):
+            if api_weather_data:
+                WeatherData.save_api_weather_data(api_weather_data, location.pk)
+
+
+def fetch_prewarm_data(location: Location) -> dict | None:
+    """Fetch the forecast and the previous day's history of the location, or None if the API fails.
+
+    Requests are sent with the background priority, so prewarming is throttled first when the API limits run low.
+    """
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    last_forecast_date = today + datetime.timedelta(days=settings.WEATHER_API_LIMITS['forecast_days_limit'] - 1)
+    data = {'location': location, 'city': location.name, 'start_date': yesterday, 'end_date': last_forecast_date}
+    periods = [{'start_date': yesterday, 'end_date': yesterday},
+               {'start_date': today + datetime.timedelta(days=1), 'end_date': last_forecast_date}]
+    try:
+        with api_priority(ApiPriority.BACKGROUND):
+            return WeatherDataProcessor(data).get_weather_data_from_API(periods)
+    except Exception:
+        logger.exception('Failed to prewarm weather data of %s', location)
+        return None
+
+
+@app.task
+def maintain_weather_data_partitions() -> dict:
+    """A Celery beat task for maintaining the weather data table.
+
+    Monthly partitions are created ahead of time and the data older than the history limit
+    plus a grace period is removed: whole partitions are dropped on PostgreSQL, rows are deleted elsewhere.
     """
-    WeatherData.save_api_weather_data(api_weather_data)
+    result = WeatherDataPartitions.from_settings().maintain()
+    logger.info('Weather data partitions created: %s, dropped: %s, rows deleted: %s',
+                result['created'], result['dropped'], result['deleted_rows'])
+    return result
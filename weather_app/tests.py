@@ -1,18 +1,92 @@
+import asyncio
+import calendar
 import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from weather_app.forms import THROTTLED_MESSAGE, WeatherBatchForm, WeatherForm
+from weather_app.models import Location, WeatherData, WeatherQueryLog, WeatherRollup
+from weather_app.tasks import (delay_save_api_weather_data, maintain_weather_data_partitions,
+                               prewarm_popular_locations)
+from weather_app.views import (AsyncHome, AsyncWeatherResult, async_autocomplete, async_export_weather_data,
+                               async_weather_aggregates, async_weather_batch)
+from weather_app.benchmarks.stub_server import WeatherApiStub
+from weather_app.benchmarks.suite import compare_results
+from weather_app.services.batch_writer import WeatherDataBatchWriter
+from weather_app.services.city_index import CityIndex
+from weather_app.services.day_weather import DayWeather
+from weather_app.services.metrics import WeatherMetrics, metrics, observe_task, start_task_timer
+from weather_app.services.partitions import WeatherDataPartitions, add_months
+from weather_app.services.query_planner import WeatherQueryPlan, get_missing_periods
+from weather_app.services.response_cache import response_cache
+from weather_app.services.response_parser import parse_json_response, parse_weather_response
+from weather_app.services.upstream_limiter import (ApiPriority, UpstreamLimiter, UpstreamThrottled, api_priority,
+                                                   get_api_concurrency_limit, upstream_limiter)
+from weather_app.services import weather_api_service
+from weather_app.services.weather_api_service import (RETRY_STATUSES, AbstractWeatherAPIRetriever, CitySearcher,
+                                                      ForecastWeatherRetriever, HistoryWeatherRetriever,
+                                                      WeatherDataProcessor, create_http_session, get_async_http_client,
+                                                      get_http_session, split_data_period)
+
+
+def parse_fake_response(payload: dict | list, parse=parse_json_response):
+    """Serialize a fake API response and parse it the way a streamed response body is parsed."""
+    return parse(io.BytesIO(json.dumps(payload).encode()))
+
+
+class AsyncBytesStream:
+    """Asynchronous file-like reader over bytes used in place of a streamed response body."""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
 
 class WeatherDataProcessorTestCase(TestCase):
     """Test case class for testing the WeatherDataProcessor functionality.
 
     This class contains test methods to verify the behavior of the WeatherDataProcessor when querying weather data
-    with various date ranges.
+    with various date ranges. Requests are served by a local stand-in for the Weather API.
     """
 
     today = datetime.date.today()
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        stub = WeatherApiStub().start()
+        cls.addClassCleanup(stub.stop)
+        for patcher in (mock.patch.object(AbstractWeatherAPIRetriever, 'api_url', stub.url),
+                        mock.patch('weather_app.tasks.save_api_weather_data.delay')):
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+
     def test_dates_before_today(self):
         start_date = self.today - datetime.timedelta(days=7)
         end_date = self.today - datetime.timedelta(days=1)
@@ -60,16 +134,1540 @@ class WeatherDataProcessorTestCase(TestCase):
         """
         data = {'start_date': start_date, 'end_date': end_date, 'city': 'Kyiv', }
         url = reverse('home')
-        response = self.client.post(url, data)
+        with mock.patch.object(WeatherDataProcessor, 'get_weather_days',
+                               side_effect=WeatherDataProcessor.get_weather_days) as get_weather_days:
+            response = self.client.post(url, data, follow=True)
 
-        weather_data = []
-        for key in expected_keys:
-            weather_data += response.context['api_weather_data'][key]['forecast']['forecastday']
+        api_weather_data = get_weather_days.call_args.args[0]
+        self.assertEqual({key for key, value in api_weather_data.items() if value}, set(expected_keys))
+        weather_data = response.context['weather_data']
 
         expected_day_count = (end_date - start_date + datetime.timedelta(days=1)).days
         actual_day_count = len(weather_data)
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(expected_day_count, actual_day_count)
-        self.assertEqual(datetime.datetime.strptime(weather_data[0]['date'], "%Y-%m-%d").date(), start_date)
-        self.assertEqual(datetime.datetime.strptime(weather_data[-1]['date'], "%Y-%m-%d").date(), end_date)
+        self.assertEqual(weather_data[0].date, start_date)
+        self.assertEqual(weather_data[-1].date, end_date)
+
+
+class HistoryWeatherRetrieverTestCase(SimpleTestCase):
+    """Test case class for testing the concurrent retrieval of historical weather data subperiods.
+
+    The external API is replaced with a fake that builds a response from the requested dates.
+    """
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+
+    @staticmethod
+    def fake_request_to_api(url: str, params: dict, parse=parse_json_response) -> dict:
+        days = (params['end_dt'] - params['dt']).days + 1
+        forecastdays = [{'date': (params['dt'] + datetime.timedelta(days=i)).isoformat(), 'day': {'avgtemp_c': 1.0}}
+                        for i in range(days)]
+        return parse_fake_response({'location': {'name': params['q']}, 'forecast': {'forecastday': forecastdays}},
+                                   parse)
+
+    def test_long_period_keeps_chronological_order(self):
+        start_date = self.today - datetime.timedelta(days=364)
+        data = {'start_date': start_date, 'end_date': self.today, 'city': 'Kyiv', }
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', self.fake_request_to_api):
+            response = HistoryWeatherRetriever(data).get_data_from_API()
+
+        dates = [day.date for day in response['forecast']['forecastday']]
+        self.assertEqual(len(dates), 365)
+        self.assertEqual(dates, sorted(dates))
+        self.assertEqual(dates[0], start_date)
+        self.assertEqual(data['start_date'], start_date)
+
+    def test_failed_subperiod_raises_error(self):
+        start_date = self.today - datetime.timedelta(days=364)
+        failed_subperiod = split_data_period(start_date, self.today, HistoryWeatherRetriever.max_days_range)[5]
+
+        def fake_request_to_api(url: str, params: dict, parse) -> dict:
+            if params['dt'] >= failed_subperiod['start_date']:
+                raise ValueError(params['dt'])
+            return self.fake_request_to_api(url, params, parse)
+
+        data = {'start_date': start_date, 'end_date': self.today, 'city': 'Kyiv', }
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', fake_request_to_api):
+            with self.assertRaisesMessage(ValueError, str(failed_subperiod['start_date'])):
+                HistoryWeatherRetriever(data).get_data_from_API()
+
+
+class HttpSessionTestCase(SimpleTestCase):
+    """Test case class for testing the shared HTTP session of the external API requests."""
+
+    def setUp(self):
+        for name in ('_http_session', '_http_session_pid'):
+            patcher = mock.patch.object(weather_api_service, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_session_is_reused_within_process(self):
+        session = get_http_session()
+
+        self.assertIs(get_http_session(), session)
+
+    def test_session_is_recreated_after_fork(self):
+        session = get_http_session()
+
+        with mock.patch('weather_app.services.weather_api_service.os.getpid', return_value=os.getpid() + 1):
+            forked_session = get_http_session()
+            self.assertIs(get_http_session(), forked_session)
+        self.assertIsNot(forked_session, session)
+
+    def test_session_is_configured_by_settings(self):
+        http_settings = {**settings.WEATHER_API_HTTP, 'max_retries': 5, 'backoff_factor': 0.7, 'backoff_jitter': 0.2,
+                         'pool_connections': 2, 'pool_maxsize': 7}
+        with self.settings(WEATHER_API_HTTP=http_settings):
+            session = create_http_session()
+
+        for url in ('https://api.weatherapi.com/v1', 'http://127.0.0.1/v1'):
+            adapter = session.get_adapter(url)
+            retry = adapter.max_retries
+            self.assertEqual((retry.total, retry.backoff_factor, retry.backoff_jitter), (5, 0.7, 0.2))
+            self.assertEqual(set(retry.status_forcelist), set(RETRY_STATUSES))
+            self.assertEqual((adapter._pool_connections, adapter._pool_maxsize), (2, 7))
+
+    def test_async_client_is_closed_with_event_loop(self):
+        async def get_clients():
+            return await get_async_http_client(), await get_async_http_client()
+
+        client, same_client = asyncio.run(get_clients())
+        other_client, _ = asyncio.run(get_clients())
+
+        self.assertIs(same_client, client)
+        self.assertIsNot(other_client, client)
+        self.assertTrue(client.is_closed and other_client.is_closed)
+
+
+class WeatherResponseParserTestCase(SimpleTestCase):
+    """Test case class for testing the streaming parser of weather API responses."""
+
+    payload = {
+        'location': {'name': 'Київ', 'region': 'Kyiv', 'country': 'Ukraine', 'tz_id': 'Europe/Kiev'},
+        'current': {'temp_c': 3.0},
+        'forecast': {'forecastday': [
+            {'date': '2023-11-03', 'date_epoch': 1698969600, 'astro': {'sunrise': '06:53 AM'},
+             'day': {'avgtemp_c': 7.4, 'maxtemp_c': 10.1, 'mintemp_c': 5.2, 'totalprecip_mm': 0.4,
+                     'maxwind_kph': 18.0, 'avghumidity': 81, 'uv': 2.0, 'condition': {'text': 'Cloudy'}},
+             'hour': [{'time': '2023-11-03 00:00', 'temp_c': 6.1}, {'time': '2023-11-03 01:00', 'temp_c': 5.9}]},
+        ]},
+    }
+
+    def test_keeps_only_used_fields(self):
+        response = parse_fake_response(self.payload, lambda stream: parse_weather_response(stream, False))
+
+        self.assertEqual(response['location'], {'name': 'Київ', 'region': 'Kyiv', 'country': 'Ukraine',
+                                                'tz_id': 'Europe/Kiev'})
+        self.assertNotIn('current', response)
+        day = response['forecast']['forecastday'][0]
+        self.assertEqual(day, DayWeather(datetime.date(2023, 11, 3), avgtemp_c=7.4, maxtemp_c=10.1, mintemp_c=5.2,
+                                         totalprecip_mm=0.4, maxwind_kph=18.0, avghumidity=81, uv=2.0))
+        self.assertIsNone(day.hourly_temp_c)
+
+    def test_keeps_hourly_temperatures_on_request(self):
+        response = parse_fake_response(self.payload, lambda stream: parse_weather_response(stream, True))
+        self.assertEqual(response['forecast']['forecastday'][0].hourly_temp_c, (6.1, 5.9))
+
+
+class CityIndexTestCase(SimpleTestCase):
+    """Test case class for testing the local city prefix index used by autocomplete."""
+
+    cities = [{'name': 'Kyiv', 'region': 'Kyyiv', 'country': 'Ukraine', 'lat': 50.43, 'lon': 30.52,
+               'aliases': ['Київ', 'Kiev']},
+              {'name': 'Kyiv Oblast', 'region': '', 'country': 'Ukraine', 'lat': 50.0, 'lon': 30.0, 'aliases': []}]
+
+    def test_prefix_matches_names_and_aliases(self):
+        index = CityIndex(self.cities)
+        with mock.patch('weather_app.services.city_index.CitySearcher') as city_searcher:
+            self.assertEqual([city['name'] for city in index.search('kyi')], ['Kyiv', 'Kyiv Oblast'])
+            self.assertEqual([city['name'] for city in index.search('КИЇ')], ['Kyiv'])
+            self.assertEqual([city['name'] for city in index.search('ukr')], ['Kyiv', 'Kyiv Oblast'])
+        city_searcher.assert_not_called()
+
+    def test_miss_falls_back_to_api_once(self):
+        index = CityIndex(self.cities)
+        api_cities = [{'id': 1, 'name': 'Lviv', 'region': '', 'country': 'Ukraine', 'lat': 49.84, 'lon': 24.02}]
+        with mock.patch('weather_app.services.city_index.CitySearcher') as city_searcher:
+            city_searcher.return_value.get_data_from_API.return_value = api_cities
+            self.assertEqual(index.search('Lvi'), api_cities)
+            self.assertEqual(index.search('Lvi'), api_cities)
+            self.assertEqual(index.search('Lviv'), api_cities)
+        city_searcher.assert_called_once_with({'city': 'Lvi'})
+
+
+class AutocompleteTestCase(SimpleTestCase):
+    """Test case class for testing the validation of the autocomplete requests."""
+
+    invalid_bodies = ('{"query": null}', '{"query": ""}', '{"query": "  ky  "}', '{"query": 42}', '["Kyiv"]',
+                      '{}', 'Kyiv', '{"query": "%s"}' % ('x' * 101))
+
+    def test_invalid_query_is_rejected(self):
+        with mock.patch('weather_app.views.city_index') as index:
+            for body in self.invalid_bodies:
+                with self.subTest(body=body):
+                    response = self.client.post(reverse('autocomplete'), body, content_type='application/json')
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('query', response.json()['errors'])
+        index.search.assert_not_called()
+
+    def test_query_is_stripped(self):
+        with mock.patch('weather_app.views.city_index') as index:
+            index.search.return_value = [{'name': 'Kyiv'}]
+            response = self.client.post(reverse('autocomplete'), {'query': ' Kyi '}, content_type='application/json')
+
+        self.assertEqual(response.json(), [{'name': 'Kyiv'}])
+        index.search.assert_called_once_with('Kyi')
+
+    async def test_async_invalid_query_is_rejected(self):
+        with mock.patch('weather_app.views.city_index') as index:
+            for body in self.invalid_bodies:
+                request = RequestFactory().post('/autocomplete/', body, content_type='application/json')
+                self.assertEqual((await async_autocomplete(request)).status_code, 400)
+        index.asearch.assert_not_called()
+
+
+class WeatherFormTestCase(TestCase):
+    """Test case class for testing the city validation of the WeatherForm."""
+
+    today = datetime.date.today()
+    search_results = [{'id': 2801268, 'name': 'Kyiv', 'region': "Kyyiv", 'country': 'Ukraine',
+                       'lat': 50.43, 'lon': 30.52, 'url': 'kyiv-kyyiv-ukraine'}]
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+
+    def test_city_is_validated_against_api_once(self):
+        with mock.patch('weather_app.services.location_service.CitySearcher') as city_searcher:
+            city_searcher.return_value.get_data_from_API.return_value = self.search_results
+            for city in ('Kyiv', ' kyiv ', 'KYIV'):
+                form = WeatherForm({'start_date': self.today, 'end_date': self.today, 'city': city})
+                self.assertTrue(form.is_valid())
+                self.assertEqual(form.cleaned_data['location'].api_id, 2801268)
+        city_searcher.assert_called_once()
+
+    def test_aliases_resolve_to_same_location(self):
+        with mock.patch('weather_app.services.location_service.CitySearcher') as city_searcher:
+            city_searcher.return_value.get_data_from_API.return_value = self.search_results
+            location_ids = set()
+            for city in ('Kyiv', 'Київ', 'київ'):
+                form = WeatherForm({'start_date': self.today, 'end_date': self.today, 'city': city})
+                self.assertTrue(form.is_valid())
+                location_ids.add(form.cleaned_data['location'].pk)
+        self.assertEqual(len(location_ids), 1)
+        self.assertEqual(Location.objects.get().aliases.count(), 2)
+
+    def test_unknown_city_is_invalid(self):
+        with mock.patch('weather_app.services.location_service.CitySearcher') as city_searcher:
+            city_searcher.return_value.get_data_from_API.return_value = []
+            form = WeatherForm({'start_date': self.today, 'end_date': self.today, 'city': 'Qwerty'})
+            self.assertFalse(form.is_valid())
+            self.assertIn('city', form.errors)
+
+
+class WeatherQueryPlanTestCase(TestCase):
+    """Test case class for testing that only the dates missing in the database are fetched from the API."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.location.add_aliases('Kyiv')
+
+    def test_missing_periods(self):
+        start_date = self.today - datetime.timedelta(days=9)
+        stored_dates = {start_date + datetime.timedelta(days=i) for i in (0, 1, 5, 9)}
+        self.assertEqual(get_missing_periods(start_date, self.today, stored_dates), [
+            {'start_date': start_date + datetime.timedelta(days=2), 'end_date': start_date + datetime.timedelta(days=4)},
+            {'start_date': start_date + datetime.timedelta(days=6), 'end_date': start_date + datetime.timedelta(days=8)},
+        ])
+        self.assertEqual(get_missing_periods(start_date, start_date, {start_date}), [])
+
+    def test_one_missing_day_costs_one_small_request(self):
+        start_date = self.today - datetime.timedelta(days=364)
+        missing_date = self.today - datetime.timedelta(days=100)
+        WeatherData.objects.bulk_create([
+            WeatherData(location=self.location, date=start_date + datetime.timedelta(days=i), temperature=i % 30)
+            for i in range(365) if start_date + datetime.timedelta(days=i) != missing_date])
+
+        request_to_api = mock.Mock(wraps=HistoryWeatherRetrieverTestCase.fake_request_to_api)
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', request_to_api), \
+                mock.patch('weather_app.tasks.save_api_weather_data') as save_api_weather_data:
+            response = self.client.post(reverse('home'), {'start_date': start_date, 'end_date': self.today,
+                                                          'city': 'Kyiv'}, follow=True)
+
+        request_to_api.assert_called_once()
+        params = request_to_api.call_args.args[1]
+        self.assertEqual((params['dt'], params['end_dt'], params['q']), (missing_date, missing_date, 'id:2801268'))
+        save_api_weather_data.delay.assert_called_once()
+        weather_data = response.context['weather_data']
+        self.assertEqual([data.date for data in weather_data],
+                         [start_date + datetime.timedelta(days=i) for i in range(365)])
+
+
+class ResponseCacheTestCase(SimpleTestCase):
+    """Test case class for testing the two-tier cache of external API responses."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+
+    @staticmethod
+    def fake_request_to_api(url: str, params: dict, parse=parse_json_response) -> dict:
+        forecastdays = [{'date': (datetime.date.today() + datetime.timedelta(days=i)).isoformat(),
+                         'day': {'avgtemp_c': 1.0}} for i in range(params['days'])]
+        return parse_fake_response({'location': {'name': params['q']}, 'forecast': {'forecastday': forecastdays}},
+                                   parse)
+
+    def test_forecast_is_fetched_once_and_sliced(self):
+        request_to_api = mock.Mock(wraps=self.fake_request_to_api)
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', request_to_api):
+            for days in (1, 5, 13, 5):
+                data = {'start_date': self.today, 'end_date': self.today + datetime.timedelta(days=days), 'city': 'Kyiv'}
+                response = ForecastWeatherRetriever(data).get_data_from_API()
+                self.assertEqual(len(response['forecast']['forecastday']), days)
+
+        request_to_api.assert_called_once()
+        self.assertEqual(response_cache.stats, {'miss': 1, 'local_hit': 3})
+
+    def test_shared_tier_and_invalidation(self):
+        request_to_api = mock.Mock(wraps=self.fake_request_to_api)
+        data = {'start_date': self.today, 'end_date': self.today + datetime.timedelta(days=3), 'city': 'Kyiv'}
+        retriever = ForecastWeatherRetriever(data)
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', request_to_api):
+            retriever.get_response()
+            response_cache.clear()
+            retriever.get_response()
+            self.assertEqual(response_cache.stats, {'shared_hit': 1})
+            response_cache.invalidate(retriever.api_method, retriever.get_query_params())
+            retriever.get_response()
+
+        self.assertEqual(request_to_api.call_count, 2)
+
+    def test_shared_hit_keeps_remaining_lifetime(self):
+        key = response_cache.get_key('/history.json', {'q': 'Kyiv'})
+        response_cache.set(key, {'response': 1}, 5)
+        response_cache.clear()
+        fetch = mock.Mock(return_value={'response': 2})
+
+        response = response_cache.get_or_fetch('/history.json', {'q': 'Kyiv'}, fetch, 60 * 60)
+
+        self.assertEqual(response, {'response': 1})
+        fetch.assert_not_called()
+        expires_at, _ = response_cache._local[key]
+        self.assertLessEqual(expires_at - time.monotonic(), 5)
+
+
+class PrewarmTestCase(TestCase):
+    """Test case class for testing the prewarming of popular locations from the query log."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+
+    def test_popular_locations_are_prewarmed(self):
+        kyiv = Location.objects.create(api_id=1, name='Kyiv')
+        lviv = Location.objects.create(api_id=2, name='Lviv')
+        for location, count in ((kyiv, 3), (lviv, 1)):
+            for _ in range(count):
+                WeatherQueryLog.record({'location': location, 'start_date': self.today, 'end_date': self.today})
+        self.assertEqual(WeatherQueryLog.get_popular_locations(top=1, days=7), [kyiv])
+
+        def fake_request_to_api(url: str, params: dict, parse) -> dict:
+            if 'dt' in params:
+                return HistoryWeatherRetrieverTestCase.fake_request_to_api(url, params, parse)
+            return ResponseCacheTestCase.fake_request_to_api(url, params, parse)
+
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', fake_request_to_api), \
+                self.settings(WEATHER_PREWARM={'top_locations': 10, 'query_log_days': 7,
+                                               'max_concurrent_requests': 2, 'max_api_requests': 2}):
+            prewarm_popular_locations()
+
+        self.assertEqual(set(WeatherData.objects.values_list('location', flat=True)), {kyiv.pk})
+        self.assertTrue(WeatherData.objects.filter(location=kyiv, date=self.today - datetime.timedelta(days=1)))
+        self.assertEqual(response_cache.stats['miss'], 2)
+
+    def test_expired_query_log_is_deleted(self):
+        kyiv = Location.objects.create(api_id=1, name='Kyiv')
+        for days in (7, 8):
+            WeatherQueryLog.objects.create(location=kyiv, start_date=self.today, end_date=self.today,
+                                           query_date=self.today - datetime.timedelta(days=days))
+
+        with self.settings(WEATHER_PREWARM={'top_locations': 10, 'query_log_days': 7,
+                                            'max_concurrent_requests': 2, 'max_api_requests': 0}):
+            prewarm_popular_locations()
+
+        self.assertEqual(list(WeatherQueryLog.objects.values_list('query_date', flat=True)),
+                         [self.today - datetime.timedelta(days=7)])
+
+
+class AsyncWeatherResultTestCase(TestCase):
+    """Test case class for testing the asynchronous home page and weather data views."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.location.add_aliases('Kyiv')
+
+    @staticmethod
+    async def fake_arequest_to_api(url: str, params: dict, parse) -> dict:
+        if 'dt' in params:
+            payload = HistoryWeatherRetrieverTestCase.fake_request_to_api(url, params)
+        else:
+            payload = ResponseCacheTestCase.fake_request_to_api(url, params)
+        return await parse(AsyncBytesStream(json.dumps(payload).encode()))
+
+    async def test_range_straddling_today(self):
+        start_date = self.today - datetime.timedelta(days=40)
+        end_date = self.today + datetime.timedelta(days=5)
+        request = RequestFactory().post('/', {'start_date': start_date, 'end_date': end_date, 'city': 'Kyiv'})
+        response = await AsyncHome.as_view()(request)
+        self.assertEqual(response.url, f'/weather/{self.location.pk}/{start_date}/{end_date}/')
+
+        arequest_to_api = mock.AsyncMock(wraps=self.fake_arequest_to_api)
+        with mock.patch('weather_app.services.weather_api_service.arequest_to_api', arequest_to_api), \
+                mock.patch('weather_app.tasks.save_api_weather_data') as save_api_weather_data:
+            response = await AsyncWeatherResult.as_view()(RequestFactory().get(response.url),
+                                                          location_id=self.location.pk, start_date=start_date,
+                                                          end_date=end_date)
+
+        self.assertEqual(arequest_to_api.await_count, 3)
+        save_api_weather_data.delay.assert_called_once()
+        weather_data = response.context_data['weather_data']
+        self.assertEqual([day.date for day in weather_data],
+                         [start_date + datetime.timedelta(days=i) for i in range(46)])
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    """Test case class for testing that identical concurrent API requests are sent once."""
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+
+    def test_concurrent_threads_share_one_request(self):
+        started, release = threading.Event(), threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait(5)
+            return {'response': 1}
+
+        fetch = mock.Mock(wraps=fetch)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            leader = executor.submit(response_cache.get_or_fetch, '/forecast.json', {'q': 'Kyiv'}, fetch, 60)
+            started.wait(5)
+            followers = [executor.submit(response_cache.get_or_fetch, '/forecast.json', {'q': 'kyiv '}, fetch, 60)
+                         for _ in range(7)]
+            while response_cache.stats['coalesced'] < 7:
+                time.sleep(0.01)
+            release.set()
+            responses = [future.result() for future in [leader, *followers]]
+
+        fetch.assert_called_once()
+        self.assertEqual(responses, [{'response': 1}] * 8)
+
+    def test_other_process_waits_for_shared_result(self):
+        key = response_cache.get_key('/forecast.json', {'q': 'Kyiv'})
+        cache.add(f'{key}:lock', True, 30)
+        threading.Timer(0.1, cache.set, (key, (time.time() + 60, {'response': 2}), 60)).start()
+        fetch = mock.Mock(return_value={'response': 3})
+
+        response = response_cache.get_or_fetch('/forecast.json', {'q': 'Kyiv'}, fetch, 60)
+
+        fetch.assert_not_called()
+        self.assertEqual(response, {'response': 2})
+
+    def test_concurrent_tasks_share_one_request(self):
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return {'response': 4}
+
+        async def request_concurrently():
+            return await asyncio.gather(*[response_cache.aget_or_fetch('/forecast.json', {'q': 'Kyiv'}, fetch, 60)
+                                          for _ in range(5)])
+
+        fetch = mock.AsyncMock(wraps=fetch)
+        self.assertEqual(asyncio.run(request_concurrently()), [{'response': 4}] * 5)
+        fetch.assert_awaited_once()
+
+
+class WeatherDataBatchWriterTestCase(TestCase):
+    """Test case class for testing compact save task payloads and batched writes."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+
+    def test_task_receives_compact_rows(self):
+        period = {'start_date': self.today, 'end_date': self.today + datetime.timedelta(days=1)}
+        api_weather_data = {'historical_weather_data': {}, 'forecast_weather_data': {
+            'location': {'name': 'Київ'},
+            'forecast': {'forecastday': [DayWeather(self.today, avgtemp_c=1.5)]}}}
+        with mock.patch('weather_app.tasks.save_api_weather_data') as save_api_weather_data:
+            delay_save_api_weather_data(api_weather_data, self.location.pk, [period])
+            delay_save_api_weather_data(api_weather_data, self.location.pk, [period])
+
+        save_api_weather_data.delay.assert_called_once_with(
+            [(self.location.pk, self.today.isoformat(), 1.5, None, None, None, None, None, None, None, 'forecast',
+              None)],
+            {self.location.pk: 'Київ'})
+
+    def test_failed_enqueue_releases_periods(self):
+        period = {'start_date': self.today, 'end_date': self.today}
+        api_weather_data = {'forecast_weather_data': {
+            'location': {'name': 'Київ'}, 'forecast': {'forecastday': [DayWeather(self.today, avgtemp_c=1.5)]}}}
+        with mock.patch('weather_app.tasks.save_api_weather_data') as save_api_weather_data:
+            save_api_weather_data.delay.side_effect = ConnectionError('Broker is unavailable')
+            with self.assertRaises(ConnectionError):
+                delay_save_api_weather_data(api_weather_data, self.location.pk, [period])
+            save_api_weather_data.delay.side_effect = None
+            delay_save_api_weather_data(api_weather_data, self.location.pk, [period])
+
+        self.assertEqual(save_api_weather_data.delay.call_count, 2)
+
+    def test_rows_of_many_tasks_are_written_in_one_batch(self):
+        writer = WeatherDataBatchWriter(max_rows=100, flush_interval=60)
+        dates = [(self.today - datetime.timedelta(days=i)).isoformat() for i in range(10)]
+        for date in dates:
+            writer.add([(self.location.pk, date, 1.5), (self.location.pk, dates[0], 2.5)], {self.location.pk: 'Київ'})
+        self.assertFalse(WeatherData.objects.exists())
+
+        # Names, final rows, the upsert, and the weekly and monthly rollups of the touched periods
+        with self.assertNumQueries(6):
+            writer.flush()
+
+        self.assertEqual(WeatherData.objects.count(), 10)
+        self.assertEqual(WeatherData.objects.get(date=self.today).temperature, Decimal('2.5'))
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.local_name, 'Київ')
+
+    def test_full_buffer_is_flushed(self):
+        writer = WeatherDataBatchWriter(max_rows=2, flush_interval=60)
+        writer.add([(self.location.pk, self.today.isoformat(), 1.5)], {})
+        self.assertFalse(WeatherData.objects.exists())
+        writer.add([(self.location.pk, (self.today - datetime.timedelta(days=1)).isoformat(), 1.5)], {})
+        self.assertEqual(WeatherData.objects.count(), 2)
+
+
+class WeatherDataMetricsTestCase(TestCase):
+    """Test case class for testing storage of the full daily metrics and the packed hourly curve."""
+
+    def setUp(self):
+        cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+
+    def test_api_day_is_stored_with_all_metrics(self):
+        api_weather_data = {'forecast_weather_data': {}, 'historical_weather_data': parse_fake_response(
+            WeatherResponseParserTestCase.payload, lambda stream: parse_weather_response(stream, True))}
+        WeatherData.save_api_weather_data(api_weather_data, self.location.pk)
+
+        weather_data = WeatherData.objects.get()
+        self.assertEqual((weather_data.temperature, weather_data.max_temperature, weather_data.min_temperature,
+                          weather_data.precipitation, weather_data.max_wind_speed, weather_data.humidity,
+                          weather_data.uv_index),
+                         (Decimal('7.4'), Decimal('10.1'), Decimal('5.2'), Decimal('0.40'), Decimal('18.0'), 81,
+                          Decimal('2.0')))
+        self.assertEqual(weather_data.hourly_temperatures, (6.1, 5.9))
+
+        day, = WeatherData.get_data_according_to_form(
+            {'location': self.location, 'start_date': weather_data.date, 'end_date': weather_data.date})
+        self.assertEqual(day, api_weather_data['historical_weather_data']['forecast']['forecastday'][0])
+        self.assertEqual(day.hourly_temp_c, (6.1, 5.9))
+
+    def test_rows_of_old_format_are_saved(self):
+        WeatherData.save_weather_rows([(self.location.pk, '2023-11-03', 1.5)], {})
+        weather_data = WeatherData.objects.get()
+        self.assertEqual(weather_data.temperature, Decimal('1.5'))
+        self.assertIsNone(weather_data.max_temperature)
+        self.assertIsNone(weather_data.hourly_temperatures)
+
+
+class WeatherDataUpsertTestCase(TestCase):
+    """Test case class for testing forecast and observed rows replacing each other on save."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.date = self.today - datetime.timedelta(days=1)
+        self.data = {'location': self.location, 'start_date': self.date, 'end_date': self.date}
+
+    def save_row(self, source: str, temperature: float, fetched_at: datetime.datetime) -> None:
+        WeatherData.save_weather_rows([(self.location.pk, self.date.isoformat(), temperature,
+                                        None, None, None, None, None, None, None, source, fetched_at.isoformat())], {})
+
+    def test_forecast_is_promoted_to_observation(self):
+        self.save_row('forecast', 1.5, datetime.datetime.now() - datetime.timedelta(days=2))
+        self.save_row('history', 2.5, datetime.datetime.now())
+
+        weather_data = WeatherData.objects.get()
+        self.assertEqual((weather_data.source, weather_data.temperature), ('history', Decimal('2.5')))
+
+    def test_observation_is_not_replaced_by_forecast(self):
+        self.save_row('history', 2.5, datetime.datetime.now())
+        self.save_row('forecast', 1.5, datetime.datetime.now() - datetime.timedelta(days=2))
+
+        self.assertEqual(WeatherData.objects.get().temperature, Decimal('2.5'))
+
+    def test_forecast_is_served_until_ttl_expires(self):
+        fetched_at = datetime.datetime.now() - datetime.timedelta(days=2)
+        self.save_row('forecast', 1.5, fetched_at)
+        ttl = int((datetime.datetime.now() - fetched_at).total_seconds())
+        with self.settings(WEATHER_CACHE_TIMEOUTS={**settings.WEATHER_CACHE_TIMEOUTS, 'stored_forecast': ttl + 60}):
+            self.assertEqual(len(WeatherData.get_data_according_to_form(self.data)), 1)
+        with self.settings(WEATHER_CACHE_TIMEOUTS={**settings.WEATHER_CACHE_TIMEOUTS, 'stored_forecast': ttl - 60}):
+            self.assertEqual(WeatherData.get_data_according_to_form(self.data), [])
+
+
+class CoverageIndexTestCase(TestCase):
+    """Test case class for testing that stored dates are found without querying the database."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.location.add_aliases('Kyiv')
+        self.start_date = self.today - datetime.timedelta(days=9)
+        self.data = {'location': self.location, 'start_date': self.start_date, 'end_date': self.today}
+
+    def save_days(self, *days: int, source: str = 'history', fetched_at: datetime.datetime | None = None) -> None:
+        fetched_at = (fetched_at or datetime.datetime.now()).isoformat()
+        WeatherData.save_weather_rows(
+            [(self.location.pk, (self.start_date + datetime.timedelta(days=day)).isoformat(), 1.5,
+              None, None, None, None, None, None, None, source, fetched_at) for day in days], {})
+
+    def test_saved_rows_update_cached_coverage(self):
+        self.save_days(0, 1, 2)
+        with self.assertNumQueries(1):
+            plan = WeatherQueryPlan(self.data)
+        self.assertEqual(plan.missing_periods, [{'start_date': self.start_date + datetime.timedelta(days=3),
+                                                 'end_date': self.today}])
+
+        self.save_days(*range(3, 10))
+        with self.assertNumQueries(0):
+            plan = WeatherQueryPlan(self.data)
+        self.assertTrue(plan.is_covered)
+
+    def test_expired_forecast_is_missing(self):
+        self.save_days(*range(10))
+        self.save_days(9, source='forecast', fetched_at=datetime.datetime.now() - datetime.timedelta(days=2))
+        self.assertEqual(WeatherQueryPlan(self.data).missing_periods, [{'start_date': self.today,
+                                                                        'end_date': self.today}])
+
+    @mock.patch.object(WeatherData, 'has_shared_data_versions', return_value=True)
+    def test_covered_request_with_cached_table_does_not_query_weather_data(self, has_shared_data_versions):
+        self.save_days(*range(10))
+        data = {'start_date': self.start_date, 'end_date': self.today, 'city': 'Kyiv'}
+        self.client.post(reverse('home'), data, follow=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('home'), data, follow=True)
+
+        self.assertContains(response, '<td>1,5</td>', count=10)
+        self.assertFalse([query for query in queries if WeatherData._meta.db_table in query['sql']])
+
+
+class WeatherTableTestCase(TestCase):
+    """Test case class for testing the weather table rendered from DayWeather records."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.location.add_aliases('Kyiv')
+
+    def test_table_is_cached_until_data_version_changes(self):
+        WeatherData.save_weather_rows([(self.location.pk, self.today.isoformat(), 1.5)], {})
+        data = {'start_date': self.today, 'end_date': self.today, 'city': 'Kyiv'}
+        self.assertContains(self.client.post(reverse('home'), data, follow=True), '<td>1,5</td>')
+
+        WeatherData.objects.filter(location=self.location).update(temperature=Decimal('2.5'))
+        self.assertContains(self.client.post(reverse('home'), data, follow=True), '<td>1,5</td>')
+
+        WeatherData.bump_data_versions({self.location.pk})
+        self.assertContains(self.client.post(reverse('home'), data, follow=True), '<td>2,5</td>')
+
+    def test_forecast_is_sliced_by_date_range(self):
+        start_date = self.today + datetime.timedelta(days=2)
+        end_date = self.today + datetime.timedelta(days=4)
+        data = {'start_date': start_date, 'end_date': end_date, 'location': self.location}
+        with mock.patch('weather_app.services.weather_api_service.request_to_api',
+                        ResponseCacheTestCase.fake_request_to_api):
+            response = ForecastWeatherRetriever(data).get_data_from_API()
+
+        self.assertEqual([day.date for day in response['forecast']['forecastday']],
+                         [start_date + datetime.timedelta(days=i) for i in range(3)])
+
+
+class WeatherDataRetentionTestCase(TestCase):
+    """Test case class for testing the retention of weather data."""
+
+    today = datetime.date.today()
+
+    @unittest.skipIf(connection.vendor == 'postgresql', 'The weather data table is partitioned on PostgreSQL')
+    def test_expired_rows_are_deleted_without_partitioning(self):
+        location = Location.objects.create(api_id=2801268, name='Kyiv')
+        retention_days = (settings.WEATHER_API_LIMITS['history_days_limit']
+                          + settings.WEATHER_DATA_RETENTION['grace_days'])
+        kept_date = self.today - datetime.timedelta(days=retention_days)
+        expired_date = kept_date - datetime.timedelta(days=1)
+        WeatherData.save_weather_rows([(location.pk, kept_date.isoformat(), 1.5),
+                                       (location.pk, expired_date.isoformat(), 1.5)], {})
+
+        result = maintain_weather_data_partitions()
+
+        self.assertEqual(result, {'created': [], 'dropped': [], 'deleted_rows': 1})
+        self.assertEqual(list(WeatherData.objects.values_list('date', flat=True)), [kept_date])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'The weather data table is partitioned on PostgreSQL')
+    def test_partitions_cover_history_window(self):
+        location = Location.objects.create(api_id=2801268, name='Kyiv')
+        partitions = WeatherDataPartitions.from_settings()
+        first_date = self.today - datetime.timedelta(days=settings.WEATHER_API_LIMITS['history_days_limit'])
+        expired_date = partitions.get_cutoff_date() - datetime.timedelta(days=40)
+
+        result = partitions.maintain()
+        WeatherData.save_weather_rows([(location.pk, first_date.isoformat(), 1.5),
+                                       (location.pk, expired_date.isoformat(), 1.5)], {})
+
+        self.assertEqual(result['dropped'], [])
+        self.assertIn(add_months(first_date, 0), partitions.get_partitions())
+        self.assertEqual(WeatherData.objects.count(), 2)
+        self.assertEqual(partitions.maintain()['deleted_rows'], 1)
+        self.assertEqual(list(WeatherData.objects.values_list('date', flat=True)), [first_date])
+
+    def test_add_months(self):
+        self.assertEqual(add_months(datetime.date(2023, 11, 15), 0), datetime.date(2023, 11, 1))
+        self.assertEqual(add_months(datetime.date(2023, 11, 15), 2), datetime.date(2024, 1, 1))
+        self.assertEqual(add_months(datetime.date(2024, 1, 31), -1), datetime.date(2023, 12, 1))
+
+
+@override_settings(WEATHER_EXPORT={**settings.WEATHER_EXPORT, 'token': 'secret'})
+class WeatherExportTestCase(TestCase):
+    """Test case class for testing the streamed export of stored weather data."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        self.client = Client(HTTP_AUTHORIZATION='Bearer secret')
+        self.kyiv = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.lviv = Location.objects.create(api_id=2801269, name='Lviv')
+        fetched_at = datetime.datetime.now().isoformat()
+        WeatherData.save_weather_rows(
+            [(location.pk, (self.today - datetime.timedelta(days=days)).isoformat(), 1.5, 3, -1, None, None, None,
+              None, [1.5, 2.0], 'history', fetched_at)
+             for location in (self.kyiv, self.lviv) for days in range(1, 4)], {})
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('export'), {'location': self.kyiv.pk})
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('location_id,location_api_id,location_name,date,temperature,'))
+        date = self.today - datetime.timedelta(days=3)
+        self.assertTrue(lines[1].startswith(f'{self.kyiv.pk},2801268,Kyiv,{date.isoformat()},1.5,3.0,-1.0,'))
+        self.assertIn(',1.5;2.0,history,', lines[1])
+
+    def test_ndjson_export_by_date_range(self):
+        date = self.today - datetime.timedelta(days=2)
+        response = self.client.get(reverse('export'), {'format': 'ndjson', 'start_date': date, 'end_date': date})
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['location_name'], row['date']) for row in rows],
+                         [('Kyiv', date.isoformat()), ('Lviv', date.isoformat())])
+        self.assertEqual((rows[0]['temperature'], rows[0]['hourly_temperature']), (1.5, [1.5, 2.0]))
+
+    def test_keyset_pagination(self):
+        dates = []
+        params = {'format': 'ndjson', 'limit': 4}
+        while True:
+            response = self.client.get(reverse('export'), params)
+            dates += [json.loads(line)['date'] for line in b''.join(response.streaming_content).splitlines()]
+            if not response.has_header('X-Next-Cursor'):
+                break
+            self.assertIn('rel="next"', response['Link'])
+            params['after'] = response['X-Next-Cursor']
+
+        self.assertEqual(len(dates), 6)
+        self.assertEqual(params['after'], f'{self.lviv.pk}:{(self.today - datetime.timedelta(days=3)).isoformat()}')
+
+    def test_gzip_export(self):
+        response = self.client.get(reverse('export'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 7)
+
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse('export'), {'format': 'xml', 'after': 'abc'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']), {'format', 'after'})
+
+    def test_pages_are_limited_by_default(self):
+        with self.settings(WEATHER_EXPORT={**settings.WEATHER_EXPORT, 'max_page_size': 4}):
+            response = self.client.get(reverse('export'))
+
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 5)
+        self.assertEqual(response['X-Next-Cursor'],
+                         f'{self.lviv.pk}:{(self.today - datetime.timedelta(days=3)).isoformat()}')
+
+    def test_export_token(self):
+        self.assertEqual(Client().get(reverse('export')).status_code, 401)
+        self.assertEqual(self.client.get(reverse('export'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with self.settings(WEATHER_EXPORT={**settings.WEATHER_EXPORT, 'token': None}):
+            self.assertEqual(Client().get(reverse('export')).status_code, 403)
+            with self.settings(DEBUG=True):
+                self.assertEqual(Client().get(reverse('export')).status_code, 200)
+
+    async def test_async_export(self):
+        request = RequestFactory().get('/export/', {'format': 'ndjson', 'location': self.lviv.pk, 'limit': 2},
+                                       HTTP_AUTHORIZATION='Bearer secret')
+        response = await async_export_weather_data(request)
+
+        lines = [line async for line in response.streaming_content]
+        self.assertEqual(len(b''.join(lines).splitlines()), 2)
+        self.assertEqual(response['X-Next-Cursor'],
+                         f'{self.lviv.pk}:{(self.today - datetime.timedelta(days=2)).isoformat()}')
+
+
+class BackfillWeatherCommandTestCase(TestCase):
+    """Test case class for testing the resumable backfill of historical weather data."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        Location.objects.create(api_id=2801268, name='Kyiv').add_aliases('Kyiv')
+        Location.objects.create(api_id=2801269, name='Lviv').add_aliases('Lviv')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.cities_file = Path(self.temp_dir.name) / 'cities.txt'
+        self.cities_file.write_text('# cities\nKyiv\nLviv\nKyiv\n', encoding='utf-8')
+        self.start_date = self.today - datetime.timedelta(days=70)
+        self.end_date = self.today - datetime.timedelta(days=1)
+
+    def backfill(self, request_to_api, *args: str) -> str:
+        output = io.StringIO()
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', request_to_api):
+            call_command('backfill_weather', str(self.cities_file), '--start-date', self.start_date.isoformat(),
+                         '--end-date', self.end_date.isoformat(), '--rate', '0', '--batch-size', '40', *args,
+                         stdout=output)
+        return output.getvalue()
+
+    def test_backfill_fills_missing_days(self):
+        request_to_api = mock.Mock(wraps=HistoryWeatherRetrieverTestCase.fake_request_to_api)
+        output = self.backfill(request_to_api)
+
+        self.assertEqual(request_to_api.call_count, 6)
+        self.assertEqual(WeatherData.objects.count(), 140)
+        self.assertIn('Backfilled 140 days of 2 locations', output)
+        self.assertIn('days/s', output)
+        self.assertIn('API calls/s', output)
+
+        request_to_api.reset_mock()
+        self.backfill(request_to_api)
+        request_to_api.assert_not_called()
+
+    def test_backfill_bounds_requests_in_flight(self):
+        in_flight = []
+
+        def recording_wait(futures, **kwargs):
+            in_flight.append(len(futures))
+            return wait(futures, **kwargs)
+
+        with mock.patch('weather_app.services.backfill.wait', recording_wait):
+            self.backfill(HistoryWeatherRetrieverTestCase.fake_request_to_api, '--workers', '1')
+
+        self.assertEqual(WeatherData.objects.count(), 140)
+        self.assertLessEqual(max(in_flight), 2)
+
+    def test_backfill_resumes_after_failure(self):
+        failed_start_date = self.start_date + datetime.timedelta(days=31)
+
+        def failing_request_to_api(url: str, params: dict, parse) -> dict:
+            if params['dt'] == failed_start_date and params['q'] == 'id:2801269':
+                raise ValueError(params['dt'])
+            return HistoryWeatherRetrieverTestCase.fake_request_to_api(url, params, parse)
+
+        with self.assertRaisesMessage(CommandError, '1 periods failed'), \
+                self.assertLogs('weather_app.services.backfill', 'ERROR'):
+            self.backfill(failing_request_to_api)
+        self.assertEqual(WeatherData.objects.count(), 109)
+        checkpoint = json.loads((Path(self.temp_dir.name) / 'cities.txt.checkpoint.json').read_text())
+        self.assertEqual(len(checkpoint['done']), 5)
+
+        cache.clear()
+        request_to_api = mock.Mock(wraps=HistoryWeatherRetrieverTestCase.fake_request_to_api)
+        self.backfill(request_to_api)
+        self.assertEqual(request_to_api.call_count, 1)
+        self.assertEqual(request_to_api.call_args.args[1]['dt'], failed_start_date)
+        self.assertEqual(WeatherData.objects.count(), 140)
+
+
+class UpstreamLimiterTestCase(SimpleTestCase):
+    """Test case class for testing the priorities and the daily quota of the external API rate limiter."""
+
+    priorities = {'interactive': {'reserve': 0, 'quota_share': 1, 'max_wait': 0},
+                  'autocomplete': {'reserve': 0.25, 'quota_share': 0.9, 'max_wait': 0},
+                  'background': {'reserve': 0.5, 'quota_share': 0.5, 'max_wait': 0}}
+
+    def acquire_all(self, limiter: UpstreamLimiter, priority: str) -> int:
+        granted = 0
+        with self.assertRaises(UpstreamThrottled):
+            while True:
+                limiter.acquire(priority)
+                granted += 1
+        return granted
+
+    def test_background_leaves_reserve_to_interactive(self):
+        limiter = UpstreamLimiter(requests_per_second=0.001, burst=8, daily_quota=1000, priorities=self.priorities)
+
+        self.assertEqual(self.acquire_all(limiter, ApiPriority.BACKGROUND), 4)
+        self.assertEqual(self.acquire_all(limiter, ApiPriority.AUTOCOMPLETE), 2)
+        self.assertEqual(self.acquire_all(limiter, ApiPriority.INTERACTIVE), 2)
+        self.assertEqual(limiter.stats['rejected_rate:background'], 1)
+
+    def test_daily_quota_shares(self):
+        limiter = UpstreamLimiter(requests_per_second=1000, burst=1000, daily_quota=10, priorities=self.priorities)
+
+        with self.assertLogs('weather_app.services.upstream_limiter', 'WARNING'):
+            self.assertEqual(self.acquire_all(limiter, ApiPriority.BACKGROUND), 5)
+            self.assertEqual(self.acquire_all(limiter, ApiPriority.INTERACTIVE), 5)
+        usage = limiter.get_usage()
+        self.assertEqual((usage['used'], usage['used:background'], usage['used:interactive']), (10, 5, 5))
+        self.assertEqual((usage['rejected:background'], usage['rejected:interactive']), (1, 1))
+
+    async def test_async_acquire_waits_for_token(self):
+        priorities = {**self.priorities, 'interactive': {'reserve': 0, 'quota_share': 1, 'max_wait': 1}}
+        limiter = UpstreamLimiter(requests_per_second=50, burst=1, daily_quota=1000, priorities=priorities)
+
+        await limiter.aacquire(ApiPriority.INTERACTIVE)
+        await limiter.aacquire(ApiPriority.INTERACTIVE)
+
+        self.assertEqual(limiter.stats['granted:interactive'], 2)
+        self.assertEqual(limiter.stats['throttled:interactive'], 1)
+
+    def test_priority_of_context(self):
+        with api_priority(ApiPriority.BACKGROUND):
+            retriever = HistoryWeatherRetriever({'city': 'Kyiv'})
+        self.assertEqual(retriever.priority, ApiPriority.BACKGROUND)
+        self.assertEqual(HistoryWeatherRetriever({'city': 'Kyiv'}).priority, ApiPriority.INTERACTIVE)
+
+    def test_throttled_autocomplete(self):
+        with mock.patch.object(upstream_limiter, 'acquire',
+                               side_effect=UpstreamThrottled(ApiPriority.AUTOCOMPLETE, 'rate')) as acquire, \
+                mock.patch.object(CityIndex, 'lookup', return_value=[]), \
+                mock.patch.object(CityIndex, 'get_cached', return_value=None):
+            response = self.client.post(reverse('autocomplete'), {'query': 'Nowhere'}, content_type='application/json')
+
+        acquire.assert_called_once_with(ApiPriority.AUTOCOMPLETE)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json(), [])
+
+
+class ThrottledWeatherRequestTestCase(TestCase):
+    """Test case class for testing the weather requests of users throttled by the external API rate limiter."""
+
+    today = datetime.date.today()
+    throttled = UpstreamThrottled(ApiPriority.INTERACTIVE, 'rate', retry_after=2.5)
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.location.add_aliases('Kyiv')
+        self.start_date = self.today - datetime.timedelta(days=3)
+
+    def assertThrottled(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertContains(response, THROTTLED_MESSAGE, status_code=429)
+
+    def test_throttled_result_page(self):
+        with mock.patch.object(upstream_limiter, 'acquire', side_effect=self.throttled), \
+                mock.patch('weather_app.tasks.save_api_weather_data') as save_api_weather_data:
+            response = self.client.get(reverse('weather', kwargs={'location_id': self.location.pk,
+                                                                  'start_date': self.start_date,
+                                                                  'end_date': self.today}))
+
+        self.assertThrottled(response)
+        self.assertEqual(response.context_data['form'].initial['city'], 'Kyiv')
+        save_api_weather_data.delay.assert_not_called()
+
+    async def test_async_throttled_result_page(self):
+        with mock.patch.object(upstream_limiter, 'aacquire', side_effect=self.throttled):
+            response = await AsyncWeatherResult.as_view()(RequestFactory().get('/'), location_id=self.location.pk,
+                                                          start_date=self.start_date, end_date=self.today)
+            response.render()
+
+        self.assertThrottled(response)
+
+    def test_throttled_city_validation(self):
+        with mock.patch.object(upstream_limiter, 'acquire', side_effect=self.throttled):
+            response = self.client.get(reverse('home'), {'start_date': self.start_date, 'end_date': self.today,
+                                                         'city': 'Lviv'})
+
+        self.assertThrottled(response)
+        self.assertIn('city', response.context_data['form'].errors)
+
+    def test_throttled_batch_city_validation(self):
+        with mock.patch.object(upstream_limiter, 'acquire', side_effect=self.throttled):
+            response = self.client.get(reverse('weather_batch'), {'start_date': self.start_date,
+                                                                  'end_date': self.today, 'city': ['Kyiv', 'Lviv']})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(response.json()['errors']['city'], [THROTTLED_MESSAGE])
+
+
+class WeatherApiStubTestCase(SimpleTestCase):
+    """Test case class for testing the local stand-in for the Weather API and the benchmark comparison."""
+
+    today = datetime.date.today()
+
+    def test_history_is_deterministic(self):
+        data = {'city': 'Kyiv', 'start_date': self.today - datetime.timedelta(days=40), 'end_date': self.today}
+        with WeatherApiStub() as stub, mock.patch.object(AbstractWeatherAPIRetriever, 'api_url', stub.url):
+            responses = [HistoryWeatherRetriever(data).fetch_response() for _ in range(2)]
+
+        days = responses[0]['forecast']['forecastday']
+        self.assertEqual([day.date for day in days], [data['start_date'] + datetime.timedelta(days=i)
+                                                      for i in range(41)])
+        self.assertEqual(days, responses[1]['forecast']['forecastday'])
+        self.assertEqual(len(days[0].hourly_temp_c), 24)
+        self.assertEqual(stub.stats['/history.json'], 2)
+
+    def test_errors_are_retried(self):
+        with WeatherApiStub(error_rate=0.5, seed=1) as stub, \
+                mock.patch.object(AbstractWeatherAPIRetriever, 'api_url', stub.url):
+            for _ in range(10):
+                self.assertTrue(CitySearcher({'city': 'Kyiv'}).fetch_response())
+
+        self.assertGreater(stub.stats['errors'], 0)
+        self.assertEqual(stub.stats['/search.json'], 10)
+
+    def test_compare_results(self):
+        baseline = {'results': {'latency': {'value': 100, 'unit': 'ms', 'higher_is_better': False},
+                                'rate': {'value': 100, 'unit': 'rows/s', 'higher_is_better': True}}}
+        results = {'results': {'latency': {'value': 130, 'unit': 'ms', 'higher_is_better': False},
+                               'rate': {'value': 200, 'unit': 'rows/s', 'higher_is_better': True},
+                               'new': {'value': 1, 'unit': 'us', 'higher_is_better': False}}}
+
+        comparison = {row['name']: (row['change'], row['status']) for row in compare_results(results, baseline, 0.25)}
+
+        self.assertEqual(comparison, {'latency': (0.3, 'regression'), 'rate': (-0.5, 'improvement'),
+                                      'new': (None, 'new')})
+
+
+class WeatherMetricsTestCase(TestCase):
+    """Test case class for testing the instrumentation of the hot paths and the metrics endpoint."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        metrics.clear()
+
+    def test_render_prometheus_text(self):
+        registry = WeatherMetrics(enabled=True, server_timing=False, flush_interval=60, buckets=(1, 0.1))
+        registry.inc('weather_api_requests_total', method='search.json', status=200)
+        registry.inc('weather_api_requests_total', method='search.json', status=200)
+        registry.inc('weather_coverage_lookups_total', result='say "hi"')
+        registry.observe('weather_template_render_duration_seconds', 0.5, template='index.html')
+
+        lines = registry.render().splitlines()
+
+        self.assertIn('# TYPE weather_api_requests_total counter', lines)
+        self.assertIn('weather_api_requests_total{method="search.json",status="200"} 2', lines)
+        self.assertIn('weather_coverage_lookups_total{result="say \\"hi\\""} 1', lines)
+        start = lines.index('# TYPE weather_template_render_duration_seconds histogram') + 1
+        self.assertEqual(lines[start:start + 5], [
+            'weather_template_render_duration_seconds_bucket{template="index.html",le="0.1"} 0',
+            'weather_template_render_duration_seconds_bucket{template="index.html",le="1"} 1',
+            'weather_template_render_duration_seconds_bucket{template="index.html",le="+Inf"} 1',
+            'weather_template_render_duration_seconds_count{template="index.html"} 1',
+            'weather_template_render_duration_seconds_sum{template="index.html"} 0.5'])
+
+    def test_disabled_registry_records_nothing(self):
+        registry = WeatherMetrics(enabled=False, server_timing=False, flush_interval=60, buckets=(1,))
+        registry.inc('weather_api_requests_total', method='search.json', status=200)
+
+        self.assertEqual(registry.get_samples(), {})
+
+    def test_home_request_is_instrumented(self):
+        data = {'city': 'Kyiv', 'start_date': self.today - datetime.timedelta(days=40),
+                'end_date': self.today - datetime.timedelta(days=1)}
+        with WeatherApiStub() as stub, mock.patch.object(AbstractWeatherAPIRetriever, 'api_url', stub.url), \
+                mock.patch('weather_app.tasks.save_api_weather_data.delay'), \
+                mock.patch.object(metrics, 'server_timing', True):
+            response = self.client.post(reverse('home'), data, follow=True)
+
+        self.assertEqual(response.status_code, 200)
+        timings = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(timings, ['db', 'render', 'upstream', 'total'])
+        samples = metrics.get_samples()
+        self.assertEqual(samples['weather_api_requests_total{method="history.json",status="200"}'], 2)
+        self.assertGreater(samples['weather_api_response_bytes_total{method="history.json"}'], 0)
+        self.assertGreater(samples['weather_api_response_chunks_total{method="history.json"}'], 0)
+        self.assertEqual(samples['weather_coverage_lookups_total{result="miss"}'], 1)
+        self.assertEqual(samples['weather_query_plans_total{stored="none"}'], 1)
+        self.assertGreater(samples['weather_db_query_duration_seconds_count{operation="SELECT",table="weather_data"}'],
+                           0)
+        self.assertEqual(samples['weather_template_render_duration_seconds_count{template="weather_app/index.html"}'],
+                         1)
+        self.assertEqual(samples['weather_http_request_duration_seconds_count{method="GET",status="200",view="weather"}'],
+                         1)
+
+    def test_celery_task_duration_and_queue_lag(self):
+        task = SimpleNamespace(name='weather_app.tasks.save_api_weather_data',
+                               request=SimpleNamespace(weather_published_at=time.time() - 2, eta=None))
+
+        start_task_timer(task_id='1', task=task)
+        observe_task(task_id='1', task=task, state='SUCCESS')
+
+        samples = metrics.get_samples()
+        labels = '{task="weather_app.tasks.save_api_weather_data"}'
+        self.assertEqual(samples[f'weather_celery_task_queue_lag_seconds_count{labels}'], 1)
+        self.assertGreaterEqual(samples[f'weather_celery_task_queue_lag_seconds_sum{labels}'], 2)
+        self.assertEqual(samples['weather_celery_task_duration_seconds_count'
+                                 '{state="SUCCESS",task="weather_app.tasks.save_api_weather_data"}'], 1)
+
+    def test_metrics_endpoint_requires_token(self):
+        metrics.inc('weather_coverage_lookups_total', result='hit')
+        with mock.patch.object(metrics, 'token', 'secret'):
+            unauthorized = self.client.get(reverse('metrics'))
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(unauthorized.status_code, 401)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        with mock.patch.object(metrics, 'token', None):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertIn('weather_coverage_lookups_total{result="hit"} 1', response.content.decode().splitlines())
+
+
+
+class WeatherResultTestCase(TestCase):
+    """Test case class for testing the cacheable weather data URLs."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.location.add_aliases('Kyiv')
+
+    def get_url(self, start_date: datetime.date, end_date: datetime.date) -> str:
+        return reverse('weather', kwargs={'location_id': self.location.pk, 'start_date': start_date,
+                                          'end_date': end_date})
+
+    def save_days(self, start_date: datetime.date, days: int, **values) -> None:
+        WeatherData.save_weather_rows([(self.location.pk, (start_date + datetime.timedelta(days=i)).isoformat(), 1.5,
+                                        *[None] * 7, values.get('source'), values.get('fetched_at'))
+                                       for i in range(days)], {})
+
+    def test_form_redirects_to_canonical_url(self):
+        data = {'start_date': self.today - datetime.timedelta(days=7), 'end_date': self.today, 'city': 'Kyiv'}
+        url = self.get_url(data['start_date'], data['end_date'])
+
+        self.assertRedirects(self.client.get(reverse('home'), data), url, fetch_redirect_response=False)
+        self.assertRedirects(self.client.post(reverse('home'), data), url, fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('home'), {**data, 'city': ''}).status_code, 200)
+
+    @mock.patch.object(WeatherData, 'has_shared_data_versions', return_value=True)
+    def test_past_range_is_immutable_and_revalidated(self, has_shared_data_versions):
+        start_date = self.today - datetime.timedelta(days=10)
+        end_date = self.today - datetime.timedelta(days=1)
+        self.save_days(start_date, 10)
+        url = self.get_url(start_date, end_date)
+
+        response = self.client.get(url)
+
+        self.assertContains(response, '<td>1,5</td>', count=10)
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertFalse([query for query in queries if WeatherData._meta.db_table in query['sql']
+                          or WeatherQueryLog._meta.db_table in query['sql']])
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        WeatherData.bump_data_versions({self.location.pk})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_validators_without_shared_cache_are_derived_from_stored_rows(self):
+        start_date = self.today - datetime.timedelta(days=10)
+        end_date = self.today - datetime.timedelta(days=1)
+        self.save_days(start_date, 10)
+        url = self.get_url(start_date, end_date)
+
+        response = self.client.get(url)
+        # The data versions are local to the process, so they do not change the validators
+        WeatherData.bump_data_versions({self.location.pk})
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(len([query for query in queries if WeatherData._meta.db_table in query['sql']]), 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        # A task worker saves the data without changing the data versions of the web processes
+        self.save_days(start_date, 1, fetched_at=datetime.datetime.now() + datetime.timedelta(seconds=5))
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+    def test_fetched_page_without_shared_cache_has_no_validators(self):
+        start_date = self.today - datetime.timedelta(days=3)
+        with mock.patch('weather_app.services.weather_api_service.request_to_api',
+                        HistoryWeatherRetrieverTestCase.fake_request_to_api), \
+                mock.patch('weather_app.tasks.save_api_weather_data'):
+            response = self.client.get(self.get_url(start_date, self.today - datetime.timedelta(days=1)))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('max-age', response['Cache-Control'])
+
+    def test_fetched_provisional_history_is_short_lived(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+
+        def request_cached_before_midnight(url: str, params: dict, parse) -> dict:
+            response = HistoryWeatherRetrieverTestCase.fake_request_to_api(url, params, parse)
+            return {**response, 'fetched_at': datetime.datetime.combine(yesterday, datetime.time(23, 30)).isoformat()}
+
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', request_cached_before_midnight), \
+                mock.patch('weather_app.tasks.save_api_weather_data'):
+            response = self.client.get(self.get_url(yesterday, yesterday))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        max_age = int(response['Cache-Control'].split('max-age=')[1])
+        self.assertLessEqual(max_age, settings.WEATHER_CACHE_TIMEOUTS['result_page_provisional'])
+
+    def test_forecast_range_is_short_lived(self):
+        self.save_days(self.today, 3, source='forecast')
+
+        response = self.client.get(self.get_url(self.today, self.today + datetime.timedelta(days=2)))
+
+        self.assertContains(response, '<td>1,5</td>', count=3)
+        max_age = int(response['Cache-Control'].split('max-age=')[1])
+        self.assertTrue(0 < max_age <= settings.WEATHER_CACHE_TIMEOUTS['result_page_provisional'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_range_outside_limits_is_not_found(self):
+        self.assertEqual(self.client.get(self.get_url(self.today, self.today - datetime.timedelta(days=1)))
+                         .status_code, 404)
+        self.assertEqual(self.client.get(self.get_url(self.today - datetime.timedelta(days=400), self.today))
+                         .status_code, 404)
+        self.assertEqual(self.client.get(reverse('weather', kwargs={'location_id': 0, 'start_date': self.today,
+                                                                    'end_date': self.today})).status_code, 404)
+        self.assertEqual(self.client.get(f'/weather/{self.location.pk}/2024-02-30/2024-03-01/').status_code, 404)
+
+
+class WeatherBatchTestCase(TestCase):
+    """Test case class for testing the batch weather data API."""
+
+    today = datetime.date.today()
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.kyiv = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.kyiv.add_aliases('Kyiv')
+        self.lviv = Location.objects.create(api_id=2801269, name='Lviv')
+        self.start_date = self.today - datetime.timedelta(days=10)
+        self.end_date = self.today - datetime.timedelta(days=1)
+
+    def save_days(self, location: Location, days: int) -> None:
+        WeatherData.save_weather_rows([(location.pk, (self.start_date + datetime.timedelta(days=i)).isoformat(),
+                                        1.5, *[None] * 7, None, None) for i in range(days)], {})
+
+    def get_params(self, **params) -> dict:
+        return {'start_date': self.start_date, 'end_date': self.end_date, **params}
+
+    def test_stored_locations_are_read_by_single_query(self):
+        self.save_days(self.kyiv, 10)
+        self.save_days(self.lviv, 10)
+        params = self.get_params(city='Kyiv', location=[self.lviv.pk, self.kyiv.pk], field='temperature')
+        request_to_api = mock.Mock(side_effect=AssertionError('Unexpected API request'))
+
+        with mock.patch('weather_app.services.weather_api_service.request_to_api', request_to_api):
+            self.client.get(reverse('weather_batch'), params)  # builds the coverage indexes
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('weather_batch'), params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([query for query in queries if WeatherData._meta.db_table in query['sql']]), 1)
+        data = response.json()
+        self.assertEqual(data['dates'], [(self.start_date + datetime.timedelta(days=i)).isoformat()
+                                         for i in range(10)])
+        self.assertEqual([location['id'] for location in data['locations']], [self.kyiv.pk, self.lviv.pk])
+        self.assertEqual(data['locations'][1]['values'], {'temperature': [1.5] * 10})
+
+    def test_missing_locations_are_fetched_and_saved_together(self):
+        self.save_days(self.kyiv, 5)
+
+        with WeatherApiStub() as stub, mock.patch.object(AbstractWeatherAPIRetriever, 'api_url', stub.url), \
+                mock.patch('weather_app.tasks.save_api_weather_data.delay') as delay:
+            response = self.client.get(reverse('weather_batch'),
+                                       self.get_params(location=[self.kyiv.pk, self.lviv.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stub.stats[settings.WEATHER_API_METHOD['history']], 2)
+        delay.assert_called_once()
+        rows, local_names = delay.call_args.args
+        self.assertEqual(len(rows), 15)
+        kyiv, lviv = response.json()['locations']
+        self.assertEqual(set(kyiv['values']), set(WeatherData.METRIC_FIELDS))
+        self.assertEqual(kyiv['values']['temperature'][:5], [1.5] * 5)
+        self.assertNotIn(None, kyiv['values']['temperature'] + lviv['values']['max_temperature'])
+
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse('weather_batch'), self.get_params(field='pressure'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']), {'__all__', 'field'})
+
+        with mock.patch('weather_app.forms.resolve_locations', return_value=[None]):
+            response = self.client.get(reverse('weather_batch'), self.get_params(city='Nowhere'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('city', response.json()['errors'])
+
+        with self.settings(WEATHER_BATCH_API={**settings.WEATHER_BATCH_API, 'max_locations': 1}):
+            response = self.client.get(reverse('weather_batch'),
+                                       self.get_params(location=[self.kyiv.pk, self.lviv.pk]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_too_many_cities_are_rejected_before_resolving(self):
+        params = self.get_params(city=[f'City {i}' for i in range(settings.WEATHER_BATCH_API['max_locations'])],
+                                 location=self.kyiv.pk)
+        with mock.patch('weather_app.forms.resolve_locations') as resolve_locations:
+            response = self.client.get(reverse('weather_batch'), params)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('city', response.json()['errors'])
+        resolve_locations.assert_not_called()
+
+    def test_unknown_cities_are_validated_concurrently(self):
+        search_results = {'Odesa': [{'id': 2801270, 'name': 'Odesa'}], 'Dnipro': [{'id': 2801271, 'name': 'Dnipro'}]}
+        concurrency_limits = []
+
+        def get_data_from_API(searcher):
+            concurrency_limits.append(get_api_concurrency_limit())
+            return search_results.get(searcher.data['city'], [])
+
+        with mock.patch.object(CitySearcher, 'get_data_from_API', get_data_from_API):
+            form = WeatherBatchForm(self.get_params(city=['Kyiv', 'Odesa', 'Dnipro', 'odesa']))
+            self.assertTrue(form.is_valid(), form.errors)
+
+        self.assertEqual([location.name for location in form.cleaned_data['locations']], ['Kyiv', 'Odesa', 'Dnipro'])
+        self.assertEqual(len(concurrency_limits), 2)
+        self.assertNotIn(None, concurrency_limits)
+
+    async def test_async_batch(self):
+        await sync_to_async(self.save_days)(self.kyiv, 10)
+        request = RequestFactory().get('/api/weather/', self.get_params(location=[self.kyiv.pk, self.lviv.pk],
+                                                                         field=['temperature', 'humidity']))
+
+        with WeatherApiStub() as stub, mock.patch.object(AbstractWeatherAPIRetriever, 'api_url', stub.url), \
+                mock.patch('weather_app.tasks.save_api_weather_data.delay') as delay:
+            response = await async_weather_batch(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stub.stats[settings.WEATHER_API_METHOD['history']], 1)
+        delay.assert_called_once()
+        kyiv, lviv = json.loads(response.content)['locations']
+        self.assertEqual(kyiv['values']['temperature'], [1.5] * 10)
+        self.assertEqual(set(lviv['values']), {'temperature', 'humidity'})
+        self.assertNotIn(None, lviv['values']['humidity'])
+
+
+def save_monthly_rows(location: Location, start_date: datetime.date, end_date: datetime.date,
+                      temperature=lambda date: date.month) -> None:
+    """Save observed rows of the dates with the temperature depending on the date, 1 °C in January by default."""
+    rows = []
+    for i in range((end_date - start_date).days + 1):
+        date = start_date + datetime.timedelta(days=i)
+        value = temperature(date)
+        rows.append((location.pk, date.isoformat(), value, value + 5, value - 5, 1.0, 10.0, 50, 1.0, None,
+                     'history', None))
+    WeatherData.save_weather_rows(rows, {})
+
+
+class WeatherRollupTestCase(TestCase):
+    """Test case class for testing the incremental weekly and monthly rollups of the weather data."""
+
+    def setUp(self):
+        cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+
+    def get_rollup(self, period: str, start_date: datetime.date) -> WeatherRollup:
+        return WeatherRollup.objects.get(location=self.location, period=period, start_date=start_date)
+
+    def test_touched_periods_are_recomputed(self):
+        # The week starting on Monday, January 29 spans two months
+        save_monthly_rows(self.location, datetime.date(2024, 1, 29), datetime.date(2024, 2, 4))
+
+        week = self.get_rollup('week', datetime.date(2024, 1, 29))
+        self.assertEqual((week.days, week.temperature_sum, week.min_temperature, week.max_temperature),
+                         (7, 3 * 1 + 4 * 2, -4, 7))
+        self.assertEqual(week.heating_degree_days, 3 * 17 + 4 * 16)
+        self.assertEqual((week.cooling_degree_days, week.precipitation_sum, week.humidity_days), (0, 7, 7))
+        self.assertEqual(self.get_rollup('month', datetime.date(2024, 1, 1)).days, 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            save_monthly_rows(self.location, datetime.date(2024, 2, 4), datetime.date(2024, 2, 4),
+                              temperature=lambda date: 20)
+        self.assertFalse([query for query in queries if '2024-01-01' in query['sql']])
+        self.assertEqual(self.get_rollup('week', datetime.date(2024, 1, 29)).temperature_sum, 3 + 3 * 2 + 20)
+        february = self.get_rollup('month', datetime.date(2024, 2, 1))
+        self.assertEqual((february.days, february.temperature_sum, february.cooling_degree_days), (4, 26, 2))
+
+    def test_only_final_rows_are_rolled_up(self):
+        save_monthly_rows(self.location, datetime.date(2024, 3, 4), datetime.date(2024, 3, 8))
+        # Observed during its day, and forecast days before
+        WeatherData.save_weather_rows([
+            (self.location.pk, '2024-03-09', 30, *[None] * 7, 'history', datetime.datetime(2024, 3, 9, 12)),
+            (self.location.pk, '2024-03-10', 30, *[None] * 7, 'forecast', datetime.datetime(2024, 3, 5, 12)),
+            (self.location.pk, '2024-04-01', 30, *[None] * 7, 'forecast', datetime.datetime(2024, 3, 5, 12)),
+        ], {})
+
+        week = self.get_rollup('week', datetime.date(2024, 3, 4))
+        self.assertEqual((week.days, week.temperature_sum, week.max_temperature), (5, 15, 8))
+        self.assertFalse(WeatherRollup.objects.filter(start_date=datetime.date(2024, 4, 1)).exists())
+
+        save_monthly_rows(self.location, datetime.date(2024, 3, 9), datetime.date(2024, 3, 10))
+        self.assertEqual(self.get_rollup('week', datetime.date(2024, 3, 4)).days, 7)
+        self.assertEqual(self.get_rollup('month', datetime.date(2024, 3, 1)).temperature_sum, 21)
+
+    def test_periods_without_rows_are_removed_and_rebuilt(self):
+        save_monthly_rows(self.location, datetime.date(2024, 1, 29), datetime.date(2024, 2, 4))
+        keys = list(WeatherData.objects.filter(date__lt=datetime.date(2024, 2, 1)).values_list('location_id', 'date'))
+        WeatherData.objects.filter(date__lt=datetime.date(2024, 2, 1)).delete()
+
+        WeatherRollup.refresh(keys)
+
+        self.assertFalse(WeatherRollup.objects.filter(start_date=datetime.date(2024, 1, 1)).exists())
+        self.assertEqual(self.get_rollup('week', datetime.date(2024, 1, 29)).days, 4)
+
+        WeatherRollup.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_weather_rollups', location_ids=[self.location.pk], stdout=out)
+        self.assertIn('Rolled up 4 rows', out.getvalue())
+        self.assertEqual(WeatherRollup.objects.count(), 2)
+
+
+class WeatherAggregatesTestCase(TestCase):
+    """Test case class for testing the weather statistics API answered from the rollups."""
+
+    def setUp(self):
+        cache.clear()
+        self.location = Location.objects.create(api_id=2801268, name='Kyiv')
+        self.empty_location = Location.objects.create(api_id=2801269, name='Lviv')
+        # A year warmer by a degree than the year before
+        save_monthly_rows(self.location, datetime.date(2023, 1, 1), datetime.date(2024, 12, 31),
+                          temperature=lambda date: date.month + date.year - 2023)
+
+    def get_params(self, **params) -> dict:
+        return {'location': [self.location.pk, self.empty_location.pk], 'start_date': '2024-01-15',
+                'end_date': '2024-12-10', **params}
+
+    def test_monthly_statistics_of_a_year(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('weather_aggregates'), self.get_params())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if WeatherData._meta.db_table in query['sql']])
+        self.assertEqual(len([query for query in queries if WeatherRollup._meta.db_table in query['sql']]), 1)
+        data = response.json()
+        self.assertEqual((data['period'], data['start_date'], data['end_date']), ('month', '2024-01-01', '2024-12-31'))
+        self.assertEqual(data['periods'], [datetime.date(2024, month, 1).isoformat() for month in range(1, 13)])
+        location, empty_location = data['locations']
+        values = location['values']
+        self.assertEqual(values['mean_temperature'], [month + 1 for month in range(1, 13)])
+        self.assertEqual(values['days'][:3], [31, 29, 31])
+        self.assertEqual(values['min_temperature'][0], -3)
+        self.assertEqual(values['heating_degree_days'][0], 31 * 16)
+        # January 2024 compared with the whole of 2023, weighted by the days of the months
+        trailing_2023 = sum(month * calendar.monthrange(2023, month)[1] for month in range(1, 13)) / 365
+        self.assertEqual(values['temperature_anomaly'][0], round(2 - trailing_2023, 2))
+        self.assertEqual(location['totals']['days'], 366)
+        self.assertEqual(location['totals']['max_temperature'], 18)
+        self.assertEqual(location['totals']['precipitation'], 366)
+        self.assertEqual(empty_location['values']['mean_temperature'], [None] * 12)
+        self.assertEqual(empty_location['totals'], {**dict.fromkeys(location['totals']), 'days': 0})
+
+    def test_weekly_statistics(self):
+        response = self.client.get(reverse('weather_aggregates'),
+                                   self.get_params(period='week', start_date='2024-12-25', end_date='2025-01-08'))
+
+        data = response.json()
+        self.assertEqual(data['periods'], ['2024-12-23', '2024-12-30', '2025-01-06'])
+        values = data['locations'][0]['values']
+        self.assertEqual(values['days'], [7, 2, 0])
+        self.assertEqual(values['mean_temperature'], [13, 13, None])
+        # The 12 weeks since Monday, September 30
+        self.assertEqual(values['temperature_anomaly'][0], round(13 - (10 * 1 + 11 * 31 + 12 * 30 + 13 * 22) / 84, 2))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('weather_aggregates'), self.get_params(period='year')).status_code,
+                         400)
+        response = self.client.get(reverse('weather_aggregates'),
+                                   self.get_params(period='week', start_date='2000-01-01'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('__all__', response.json()['errors'])
+
+    def test_cities_are_resolved_without_api(self):
+        self.location.add_aliases('Kyiv')
+        with mock.patch.object(CitySearcher, 'get_data_from_API', side_effect=AssertionError('Unexpected API request')):
+            response = self.client.get(reverse('weather_aggregates'), {**self.get_params(), 'location': [],
+                                                                        'city': ['Kyiv', 'Nowhere']})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['errors']['city'], ['Не знайдено міста: Nowhere'])
+
+            response = self.client.get(reverse('weather_aggregates'), {**self.get_params(), 'location': [],
+                                                                        'city': 'kyiv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([location['id'] for location in response.json()['locations']], [self.location.pk])
+
+    async def test_async_aggregates(self):
+        request = RequestFactory().get('/api/aggregates/', self.get_params(period='month'))
+
+        response = await async_weather_aggregates(request)
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['locations'][0]['values']['mean_temperature'][-1], 13)
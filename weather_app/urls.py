@@ -14,11 +14,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.urls import path
+from django.conf import settings
+from django.urls import path, register_converter
 
 from weather_app import views
+from weather_app.converters import DateConverter
+
+register_converter(DateConverter, 'date')
+
+if settings.WEATHER_ASYNC_VIEWS:
+    home_view, autocomplete_view = views.AsyncHome.as_view(), views.async_autocomplete
+    weather_view = views.AsyncWeatherResult.as_view()
+    export_view, batch_view = views.async_export_weather_data, views.async_weather_batch
+    aggregates_view = views.async_weather_aggregates
+else:
+    home_view, autocomplete_view = views.Home.as_view(), views.autocomplete
+    weather_view = views.WeatherResult.as_view()
+    export_view, batch_view = views.export_weather_data, views.weather_batch
+    aggregates_view = views.weather_aggregates
 
 urlpatterns = [
-    path('', views.Home.as_view(), name='home'),
-    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('', home_view, name='home'),
+    path('weather/<int:location_id>/<date:start_date>/<date:end_date>/', weather_view, name='weather'),
+    path('autocomplete/', autocomplete_view, name='autocomplete'),
+    path('export/', export_view, name='export'),
+    path('api/weather/', batch_view, name='weather_batch'),
+    path('api/aggregates/', aggregates_view, name='weather_aggregates'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
@@ -1,44 +1,521 @@
+import datetime
 import json
+import re
+import time
 
-from django.http import JsonResponse, Http404
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, Http404, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import FormView
 
-from .forms import WeatherForm
-from .models import WeatherData
-from .services.weather_api_service import WeatherDataProcessor, CitySearcher
-from .tasks import save_api_weather_data
+from .forms import THROTTLED_MESSAGE, WeatherAggregatesForm, WeatherBatchForm, WeatherExportForm, WeatherForm
+from .models import Location, WeatherData, WeatherQueryLog
+from .services.aggregates import WeatherAggregates
+from .services.city_index import city_index
+from .services.exporter import WeatherDataExporter, agzip_chunks, gzip_chunks
+from .services.metrics import TimedTemplateResponse, metrics
+from .services.query_planner import WeatherQueryPlan
+from .services.upstream_limiter import ApiPriority, UpstreamThrottled, api_priority
+from .services.weather_api_service import WeatherDataProcessor
+from .services.weather_batch import WeatherBatch
+from .tasks import delay_save_api_weather_data, delay_save_api_weather_data_batch
 
 
 class Home(FormView):
-    """View class for home page with a weather request form and a table with weather data."""
+    """View class for home page with a weather request form.
+
+    A valid request is redirected to the canonical GET URL of its results (see `WeatherResult`),
+    so repeated views are served from the browser and proxy caches.
+    The form is submitted by GET, POST is still accepted. If the city could not be validated because
+    the external API request was throttled, the form is shown with the 429 status.
+    """
 
     template_name = 'weather_app/index.html'
+    response_class = TimedTemplateResponse
     form_class = WeatherForm
     extra_context = {'title': 'Дізнайся про погоду'}
 
+    def get(self, request, *args, **kwargs):
+        """Show the empty form, or handle the form submitted in the query string."""
+        if request.GET:
+            return self.post(request, *args, **kwargs)
+        return super().get(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        if self.request.method in ('GET', 'HEAD') and self.request.GET:
+            kwargs['data'] = self.request.GET
+        return kwargs
+
     def form_valid(self, form):
-        """Handles the form when data is valid.
+        """Redirect to the weather data of the resolved location and the date range."""
+        return redirect(get_weather_url(form.cleaned_data))
+
+    def form_invalid(self, form):
+        response = super().form_invalid(form)
+        if form.throttled is not None:
+            return get_throttled_response(response, form.throttled)
+        return response
+
+
+class AsyncHome(Home):
+    """Asynchronous version of the home page view for ASGI deployments."""
+
+    async def get(self, request, *args, **kwargs):
+        if request.GET:
+            return await self.post(request, *args, **kwargs)
+        return self.render_to_response(self.get_context_data())
+
+    async def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        if await sync_to_async(form.is_valid)():
+            return self.form_valid(form)
+        return self.form_invalid(form)
+
+    async def put(self, *args, **kwargs):
+        return await self.post(*args, **kwargs)
+
+
+class WeatherResult(Home):
+    """View class for the weather data of a location and a date range at a canonical GET URL.
+
+    If all the data is stored, the conditional request is answered by the data version of the location
+    before anything is loaded, rendered or recorded in the query log, which only counts the full renders.
+    Otherwise, the missing periods are fetched from an API and a background task is started to save them
+    (once for concurrent identical requests); fetched data may replace expired stored rows, so the data version
+    is changed. Stored and fetched data are displayed together.
+
+    The data versions are changed by the task workers too, so they only validate the pages if the cache is shared
+    by all processes (see `WeatherData.has_shared_data_versions`). Otherwise, the validators are derived from
+    the stored rows of the range, and pages with fetched data, which is not saved yet, are sent without them.
+
+    Pages are cacheable by browsers and shared caches: ranges of past days with final data only never change,
+    ranges with forecasts or the current day are cached until the earliest of their provisional rows expires.
+    If the request of the missing data is throttled, the form is shown with the 429 status instead.
+    """
+
+    http_method_names = ['get', 'head', 'options']
+
+    def get(self, request, *args, **kwargs):
+        data = self.get_query_data(Location.objects.filter(pk=kwargs['location_id']).first(),
+                                   kwargs['start_date'], kwargs['end_date'])
+        location_id = data['location'].pk
+        plan = WeatherQueryPlan(data)
+        api_weather_data = None
+        if not plan.is_covered:
+            try:
+                api_weather_data = WeatherDataProcessor(data).get_weather_data_from_API(plan.missing_periods)
+            except UpstreamThrottled as error:
+                return self.render_throttled(data, error)
+            delay_save_api_weather_data(api_weather_data, location_id, plan.missing_periods)
+            WeatherData.bump_data_versions({location_id})
+        data_version = str(WeatherData.get_data_version(location_id))
+        validators = None
+        if WeatherData.has_shared_data_versions():
+            validators = (data_version, WeatherData.get_last_modified(location_id))
+        elif api_weather_data is None:
+            validators = WeatherData.get_stored_validators(location_id, data['start_date'], data['end_date'])
+        response = self.get_cacheable_response(data, plan, api_weather_data, data_version, validators)
+        if response.status_code == 200:
+            WeatherQueryLog.record(data)
+        return response
+
+    def get_query_data(self, location: Location | None, start_date: datetime.date, end_date: datetime.date) -> dict:
+        """Build the weather request of the URL, raising Http404 if it is not allowed by the form."""
+        form = self.get_form_class()()
+        if location is None or not form.min_date <= start_date <= end_date <= form.max_date:
+            raise Http404()
+        return {'location': location, 'city': location.name, 'start_date': start_date, 'end_date': end_date}
+
+    def get_cacheable_response(self, data: dict, plan: WeatherQueryPlan, api_weather_data: dict | None,
+                               data_version: str, validators: tuple[str, float | None] | None):
+        """Answer the conditional request or render the weather data, adding the cache validators and lifetime.
+
+        `validators` are the version of the data and the time of its last change, the page is sent without them
+        if they are not given. The page also depends on the current date through the date limits of the form,
+        so it is a part of the ETag.
+        """
+        if validators is None:
+            response = self.render_weather_data(data, plan, api_weather_data, data_version)
+            return self.patch_max_age(response, data, plan, api_weather_data)
+        version, last_modified = validators
+        etag = f'W/"{data["location"].pk}-{version}-{datetime.date.today().toordinal()}"'
+        if last_modified is not None:
+            last_modified = int(last_modified)
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            if version != data_version:
+                # The rendered table is cached in the process as well, so it also expires on changes of the process
+                data_version = f'{data_version}.{version}'
+            response = self.render_weather_data(data, plan, api_weather_data, data_version)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return self.patch_max_age(response, data, plan, api_weather_data)
+
+    def patch_max_age(self, response, data: dict, plan: WeatherQueryPlan, api_weather_data: dict | None):
+        """Make the response cacheable by browsers and shared caches for as long as the page is fresh."""
+        max_age = self.get_max_age(data, plan, api_weather_data)
+        if max_age is None:
+            patch_cache_control(response, public=True, max_age=settings.WEATHER_CACHE_TIMEOUTS['result_page_final'],
+                                immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=max_age)
+        return response
+
+    @staticmethod
+    def get_max_age(data: dict, plan: WeatherQueryPlan, api_weather_data: dict | None) -> int | None:
+        """Define how long the page is fresh in seconds, or None if it never changes.
+
+        Data of past days is final unless it was observed during the day, whether it is stored or fetched
+        (a cached response may have been fetched before midnight). Provisional data is served
+        for the `stored_forecast` timeout since it was fetched, and the current date ends at midnight.
+        """
+        today = datetime.date.today()
+        expires_at = [plan.get_stored_expiry()]
+        if api_weather_data is not None:
+            expires_at += [WeatherData.get_api_expiry(api_weather_data)]
+        if data['end_date'] >= today:
+            expires_at += [datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time()).timestamp()]
+        expires_at = min((timestamp for timestamp in expires_at if timestamp is not None), default=None)
+        if expires_at is None:
+            return None
+        return max(0, min(int(expires_at - time.time()), settings.WEATHER_CACHE_TIMEOUTS['result_page_provisional']))
+
+    def render_weather_data(self, data: dict, plan: WeatherQueryPlan, api_weather_data: dict | None,
+                            data_version: str):
+        """Render the stored weather data, the data fetched from an API, or both merged.
 
-        If weather data is already in the database, it displays it. If not, it calls
-        a service to fetch data from an API and initiates a background task to save it.
+        Both kinds of data are rendered from a single list of DayWeather records. The table is cached
+        by the location, the date range and the version of the stored data of the location,
+        fully stored data is loaded only if the cached table is missing.
+        The form is filled with the request, so it can be changed and submitted again.
         """
-        db_weather_data = WeatherData.get_data_according_to_form(form.cleaned_data)
-        if db_weather_data:
-            return self.render_to_response(self.get_context_data(form=form, db_weather_data=db_weather_data))
+        location = data['location']
+        context = {'form': self.get_filled_form(data), 'location': location, 'data_version': data_version,
+                   'weather_table_cache_timeout': settings.WEATHER_CACHE_TIMEOUTS['weather_table'],
+                   'start_date': data['start_date'], 'end_date': data['end_date'],
+                   'location_name': location}
+        if api_weather_data is None:
+            context['weather_data'] = plan.get_lazy_stored_weather_data()
         else:
-            api_weather_data = WeatherDataProcessor(form.cleaned_data).get_weather_data_from_API()
-            save_api_weather_data.delay(api_weather_data)
-            return self.render_to_response(self.get_context_data(form=form, api_weather_data=api_weather_data))
+            context['weather_data'] = plan.merge(WeatherDataProcessor.get_weather_days(api_weather_data))
+            context['location_name'] = WeatherData.get_api_location_name(api_weather_data) or location
+        return self.render_to_response(self.get_context_data(**context))
+
+    def render_throttled(self, data: dict, error: UpstreamThrottled):
+        """Render the form filled with the request and the message that the external API request is throttled."""
+        response = self.render_to_response(self.get_context_data(form=self.get_filled_form(data),
+                                                                 error_message=THROTTLED_MESSAGE))
+        return get_throttled_response(response, error)
+
+    def get_filled_form(self, data: dict) -> WeatherForm:
+        """Create the form filled with the request, so it can be changed and submitted again."""
+        return self.get_form_class()(initial={'city': data['location'].name, 'start_date': data['start_date'],
+                                              'end_date': data['end_date']})
+
+
+class AsyncWeatherResult(WeatherResult):
+    """Asynchronous version of the weather data view for ASGI deployments.
+
+    Requests to the API and the database are awaited on the event loop, so a worker
+    is not blocked for the full upstream round-trip.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        """Answer the conditional request or render the weather data, fetching the missing data concurrently."""
+        data = self.get_query_data(await Location.objects.filter(pk=kwargs['location_id']).afirst(),
+                                   kwargs['start_date'], kwargs['end_date'])
+        location_id = data['location'].pk
+        plan = await WeatherQueryPlan.acreate(data)
+        api_weather_data = None
+        if not plan.is_covered:
+            try:
+                api_weather_data = await WeatherDataProcessor(data).aget_weather_data_from_API(plan.missing_periods)
+            except UpstreamThrottled as error:
+                return self.render_throttled(data, error)
+            await plan.aload_stored_weather_data()
+            await sync_to_async(delay_save_api_weather_data)(api_weather_data, location_id, plan.missing_periods)
+            await sync_to_async(WeatherData.bump_data_versions)({location_id})
+        data_version = str(await WeatherData.aget_data_version(location_id))
+        validators = None
+        if WeatherData.has_shared_data_versions():
+            validators = (data_version, await WeatherData.aget_last_modified(location_id))
+        elif api_weather_data is None:
+            validators = await WeatherData.aget_stored_validators(location_id, data['start_date'], data['end_date'])
+        response = self.get_cacheable_response(data, plan, api_weather_data, data_version, validators)
+        if response.status_code == 200:
+            await WeatherQueryLog.arecord(data)
+        return response
+
+
+def get_throttled_response(response: HttpResponse, error: UpstreamThrottled) -> HttpResponse:
+    """Mark the response to a throttled request with the 429 status and the time after which to retry it."""
+    response.status_code = 429
+    response['Retry-After'] = str(error.retry_after)
+    patch_cache_control(response, no_store=True)
+    return response
+
+
+def get_weather_url(data: dict) -> str:
+    """Get the canonical URL of the weather data of the location and the date range."""
+    return reverse('weather', kwargs={'location_id': data['location'].pk, 'start_date': data['start_date'],
+                                      'end_date': data['end_date']})
 
 
+@csrf_exempt
 def autocomplete(request):
     """Handles requests for city name autocompletion.
 
     Returns JSON response with a list of city name autocompletions.
+    Suggestions are served from the local city index; the external API is queried only on a miss
+    with the autocomplete priority. If the request is throttled, an empty list is returned with the 429 status.
+    The lookup changes nothing for the user, so it is exempt from the CSRF protection: it is used
+    on the cached result pages, which carry no CSRF token.
     """
     if request.method == 'POST':
-        data = json.loads(request.body)
-        autocomplete_data = CitySearcher({'city': data.get('query')}).get_data_from_API()
+        query = get_autocomplete_query(request)
+        if query is None:
+            return get_invalid_autocomplete_response()
+        try:
+            with api_priority(ApiPriority.AUTOCOMPLETE):
+                autocomplete_data = city_index.search(query)
+        except UpstreamThrottled as error:
+            return get_throttled_response(JsonResponse([], safe=False), error)
         return JsonResponse(autocomplete_data, safe=False)
     else:
         raise Http404()
+
+
+async def async_autocomplete(request):
+    """Handles requests for city name autocompletion asynchronously.
+
+    The external API is awaited on the event loop on a miss of the local city index.
+    """
+    if request.method == 'POST':
+        query = get_autocomplete_query(request)
+        if query is None:
+            return get_invalid_autocomplete_response()
+        try:
+            with api_priority(ApiPriority.AUTOCOMPLETE):
+                autocomplete_data = await city_index.asearch(query)
+        except UpstreamThrottled as error:
+            return get_throttled_response(JsonResponse([], safe=False), error)
+        return JsonResponse(autocomplete_data, safe=False)
+    else:
+        raise Http404()
+
+
+def get_autocomplete_query(request) -> str | None:
+    """Get the city name prefix from the JSON body of an autocomplete request.
+
+    Returns None unless the body is a JSON object with a `query` string, whose length without the surrounding
+    whitespace is within the limits of the `CITY_INDEX` setting.
+    """
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None
+    query = data.get('query') if isinstance(data, dict) else None
+    if not isinstance(query, str):
+        return None
+    query = query.strip()
+    if not settings.CITY_INDEX['min_query_length'] <= len(query) <= settings.CITY_INDEX['max_query_length']:
+        return None
+    return query
+
+
+def get_invalid_autocomplete_response() -> JsonResponse:
+    """Report the missing query or the query of the wrong length with the 400 status."""
+    return JsonResponse({'errors': {'query': [
+        f"Введіть від {settings.CITY_INDEX['min_query_length']} до {settings.CITY_INDEX['max_query_length']} "
+        f"символів назви міста"]}}, status=400)
+
+
+# The csrf_exempt decorator of Django 4.2 wraps the view in a synchronous function, so the flag is set directly
+async_autocomplete.csrf_exempt = True
+
+
+def weather_batch(request):
+    """Handles requests for weather data of many locations for the same date range.
+
+    Returns JSON response with the dates and arrays of the daily metrics of each location (see `WeatherBatch`).
+    Missing data is fetched from the external API concurrently and saved by a single background task.
+    Invalid parameters are reported with the 400 status, a throttled request with the 429 status.
+    """
+    if request.method != 'GET':
+        raise Http404()
+    form = WeatherBatchForm(request.GET)
+    if not form.is_valid():
+        return get_invalid_batch_response(form)
+    batch = WeatherBatch.from_settings(form.cleaned_data['locations'], form.cleaned_data['start_date'],
+                                       form.cleaned_data['end_date'], form.cleaned_data['field'])
+    try:
+        weather_data = batch.get_data()
+    except UpstreamThrottled as error:
+        return get_throttled_response(JsonResponse({'errors': {'__all__': [str(error)]}}), error)
+    if batch.fetched:
+        delay_save_api_weather_data_batch(batch.fetched)
+        WeatherData.bump_data_versions({location_id for location_id, *_ in batch.fetched})
+    return JsonResponse(weather_data)
+
+
+async def async_weather_batch(request):
+    """Handles requests for weather data of many locations asynchronously.
+
+    The missing data of all the locations is awaited concurrently on the event loop.
+    """
+    if request.method != 'GET':
+        raise Http404()
+    form = WeatherBatchForm(request.GET)
+    if not await sync_to_async(form.is_valid)():
+        return get_invalid_batch_response(form)
+    batch = WeatherBatch.from_settings(form.cleaned_data['locations'], form.cleaned_data['start_date'],
+                                       form.cleaned_data['end_date'], form.cleaned_data['field'])
+    try:
+        weather_data = await batch.aget_data()
+    except UpstreamThrottled as error:
+        return get_throttled_response(JsonResponse({'errors': {'__all__': [str(error)]}}), error)
+    if batch.fetched:
+        await sync_to_async(delay_save_api_weather_data_batch)(batch.fetched)
+        await sync_to_async(WeatherData.bump_data_versions)({location_id for location_id, *_ in batch.fetched})
+    return JsonResponse(weather_data)
+
+
+def get_invalid_batch_response(form: WeatherBatchForm) -> JsonResponse:
+    """Report the invalid parameters with the 400 status.
+
+    If a city is not validated because the external API request is throttled, the 429 status is used instead.
+    """
+    response = JsonResponse({'errors': form.errors}, status=400)
+    if form.throttled is not None:
+        return get_throttled_response(response, form.throttled)
+    return response
+
+
+def weather_aggregates(request):
+    """Handles requests for statistics of the stored weather data of many locations by weeks or months.
+
+    Returns JSON response with the periods and arrays of the statistics of each location (see `WeatherAggregates`).
+    Statistics are computed from the rollups of the stored data, and city names are resolved by the stored aliases
+    only, so the external API is not requested.
+    """
+    if request.method != 'GET':
+        raise Http404()
+    form = WeatherAggregatesForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    aggregates = WeatherAggregates.from_settings(form.cleaned_data['locations'], form.cleaned_data['start_date'],
+                                                 form.cleaned_data['end_date'], form.cleaned_data['period'])
+    return JsonResponse(aggregates.get_data())
+
+
+async def async_weather_aggregates(request):
+    """Handles requests for statistics of the stored weather data of many locations asynchronously."""
+    if request.method != 'GET':
+        raise Http404()
+    form = WeatherAggregatesForm(request.GET)
+    if not await sync_to_async(form.is_valid)():
+        return JsonResponse({'errors': form.errors}, status=400)
+    aggregates = WeatherAggregates.from_settings(form.cleaned_data['locations'], form.cleaned_data['start_date'],
+                                                 form.cleaned_data['end_date'], form.cleaned_data['period'])
+    return JsonResponse(await aggregates.aget_data())
+
+
+def export_weather_data(request):
+    """Handles requests for an export of stored weather data.
+
+    Streams the rows filtered by the query parameters as CSV or NDJSON, gzip-compressed if the client accepts it.
+    Pages are limited by the `limit` parameter, or by the `max_page_size` export setting, and the cursor
+    of the next page is returned in the `X-Next-Cursor` and `Link` headers.
+    The export token must be sent as a bearer token unless it is not configured with `DEBUG`.
+    """
+    if request.method == 'GET':
+        unauthorized_response = get_unauthorized_response(request, settings.WEATHER_EXPORT['token'])
+        if unauthorized_response is not None:
+            return unauthorized_response
+        form = WeatherExportForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        exporter = WeatherDataExporter.from_settings(form.cleaned_data)
+        chunks = exporter.iter_chunks()
+        if accepts_gzip(request):
+            chunks = gzip_chunks(chunks, settings.WEATHER_EXPORT['compress_level'])
+        return get_export_response(request, exporter, chunks, exporter.get_next_cursor())
+    else:
+        raise Http404()
+
+
+async def async_export_weather_data(request):
+    """Handles requests for an export of stored weather data asynchronously.
+
+    Rows are read by an asynchronous iterator, so the export is streamed by ASGI servers
+    instead of being collected in memory.
+    """
+    if request.method == 'GET':
+        unauthorized_response = get_unauthorized_response(request, settings.WEATHER_EXPORT['token'])
+        if unauthorized_response is not None:
+            return unauthorized_response
+        form = WeatherExportForm(request.GET)
+        if not await sync_to_async(form.is_valid)():
+            return JsonResponse({'errors': form.errors}, status=400)
+        exporter = WeatherDataExporter.from_settings(form.cleaned_data)
+        chunks = exporter.aiter_chunks()
+        if accepts_gzip(request):
+            chunks = agzip_chunks(chunks, settings.WEATHER_EXPORT['compress_level'])
+        return get_export_response(request, exporter, chunks, await exporter.aget_next_cursor())
+    else:
+        raise Http404()
+
+
+def accepts_gzip(request) -> bool:
+    """Check whether the client accepts a gzip-compressed response."""
+    return bool(re.search(r'\bgzip\b', request.headers.get('Accept-Encoding', '')))
+
+
+def get_export_response(request, exporter: WeatherDataExporter, chunks, next_cursor: str | None):
+    """Build a streaming response of the export with the pagination and the encoding headers."""
+    response = StreamingHttpResponse(chunks, content_type=exporter.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{exporter.filename}"'
+    if accepts_gzip(request):
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if next_cursor:
+        query = request.GET.copy()
+        query['after'] = next_cursor
+        response['X-Next-Cursor'] = next_cursor
+        response['Link'] = f'<{request.build_absolute_uri(request.path)}?{query.urlencode()}>; rel="next"'
+    return response
+
+
+def metrics_view(request):
+    """Handles requests for the metrics of the app in the Prometheus text format.
+
+    The metrics token must be sent as a bearer token unless it is not configured with `DEBUG`.
+    """
+    if not metrics.enabled or request.method != 'GET':
+        raise Http404()
+    unauthorized_response = get_unauthorized_response(request, metrics.token)
+    if unauthorized_response is not None:
+        return unauthorized_response
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def get_unauthorized_response(request, token: str | None) -> HttpResponse | None:
+    """Check the bearer token of the request, returning the response refusing it if the token is wrong.
+
+    Without a configured token the endpoint is only open with `DEBUG`.
+    """
+    if not token:
+        return None if settings.DEBUG else HttpResponseForbidden()
+    if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return None